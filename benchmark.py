@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+"""
+离线性能测试
+启动本地模拟交易所（mock_exchange.py），在不同币种数量下测量：
+  - 更新周期耗时（RefreshScheduler.tick，即 update_funding_rates 每轮的工作；
+    第一轮获取全部数据，之后只刷新价格和到期的资金费率）
+  - 汇总计算（_build_summary）和序列化耗时
+  - /api/data 在并发客户端下的吞吐量和延迟（200 和 304 两种路径）
+
+不需要网络和代理，可在笔记本上运行。
+
+用法:
+    python benchmark.py
+    python benchmark.py --symbols 50 500 5000 --cycles 5 --clients 50 --requests 5000
+    python benchmark.py --latency-ms 80 --jitter-ms 40 --error-rate 0.01 --json result.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+import aiohttp
+from aiohttp import web
+
+import funding_rate_monitor as monitor
+from mock_exchange import MockExchange, make_fixtures, point_monitor_at
+
+# ==================== 工具函数 ====================
+def percentile(samples, pct):
+    """返回样本的 pct 分位数（最近秩法）"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(samples_ms):
+    """耗时样本（毫秒）的统计"""
+    return {
+        'count': len(samples_ms),
+        'mean_ms': statistics.fmean(samples_ms) if samples_ms else 0.0,
+        'p50_ms': percentile(samples_ms, 50),
+        'p99_ms': percentile(samples_ms, 99),
+        'max_ms': max(samples_ms, default=0.0),
+    }
+
+def time_call(func, iterations):
+    """重复调用 func，返回每次耗时（毫秒）"""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+# ==================== 测试项 ====================
+async def bench_cycles(client, cycles):
+    """测量更新周期，监控器自身的日志输出被丢弃
+
+    Returns:
+        tuple: (第一轮耗时, 之后各轮耗时列表)
+    """
+    scheduler = monitor.RefreshScheduler(client)
+    samples = []
+    logging.disable(logging.CRITICAL)
+    try:
+        for _ in range(cycles):
+            samples.append(await scheduler.tick())
+    finally:
+        logging.disable(logging.NOTSET)
+    return samples[0], samples[1:]
+
+def bench_summary(iterations):
+    """测量汇总计算和 JSON 序列化"""
+    store = monitor.store
+    build = time_call(store._build_summary, iterations)
+
+    rows = store._build_summary()
+    stats = store.get_stats()
+
+    def serialize():
+        # 新建快照以绕过缓存，测量的是每个新版本的首次序列化
+        monitor.SummarySnapshot(store.version, rows, stats, 'bench').body()
+
+    return build, time_call(serialize, iterations), len(rows)
+
+async def bench_http(port, clients, total_requests, conditional):
+    """并发请求 /api/data
+
+    Args:
+        port: 监控器 Web 服务端口
+        clients: 并发客户端数
+        total_requests: 总请求数
+        conditional: True 时带 If-None-Match（测 304 路径）
+
+    Returns:
+        tuple: (每个请求的耗时列表, 总耗时秒, 非预期状态码次数)
+    """
+    url = f'http://127.0.0.1:{port}/api/data'
+    expected = 304 if conditional else 200
+    headers = {'If-None-Match': monitor.store.snapshot.etag} if conditional else {}
+    samples = []
+    errors = 0
+    remaining = total_requests
+
+    async def worker(session):
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            async with session.get(url, headers=headers) as response:
+                await response.read()
+                if response.status != expected:
+                    errors += 1
+            samples.append((time.perf_counter() - start) * 1000)
+
+    connector = aiohttp.TCPConnector(limit=clients)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+    return samples, elapsed, errors
+
+# ==================== 主流程 ====================
+async def run_for_symbols(n_symbols, args):
+    """在指定币种数量下运行全部测试项"""
+    mock = MockExchange(
+        make_fixtures(n_symbols, args.seed),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    mock_runner, mock_port = await mock.start()
+    point_monitor_at(monitor, mock_port)
+    monitor.store = monitor.FundingRateStore()
+
+    client = monitor.ExchangeHttpClient()
+    await client.start()
+    web_runner = web.AppRunner(monitor.create_app())
+    await web_runner.setup()
+    site = web.TCPSite(web_runner, '127.0.0.1', 0)
+    await site.start()
+    web_port = site._server.sockets[0].getsockname()[1]
+
+    try:
+        cold_cycle, warm_cycles = await bench_cycles(client, args.cycles)
+        build, serialize, rows = bench_summary(args.summary_iterations)
+        body_bytes = len(monitor.store.snapshot.body())
+
+        http = {}
+        for name, conditional in (('200', False), ('304', True)):
+            samples, elapsed, errors = await bench_http(web_port, args.clients, args.requests, conditional)
+            http[name] = dict(summarize(samples), rps=len(samples) / elapsed, errors=errors)
+    finally:
+        await web_runner.cleanup()
+        await client.close()
+        await mock_runner.cleanup()
+
+    return {
+        'symbols': n_symbols,
+        'rows': rows,
+        'body_bytes': body_bytes,
+        'upstream_requests': sum(mock.request_counts.values()),
+        'cold_cycle_ms': cold_cycle,
+        'warm_cycle': summarize(warm_cycles),
+        'build_summary': summarize(build),
+        'serialize': summarize(serialize),
+        'api_data': http,
+    }
+
+def print_report(results, args):
+    """打印结果表"""
+    print(f"\n{'='*100}")
+    print(f"并发客户端 {args.clients} | 每项请求数 {args.requests} | 周期数 {args.cycles} | "
+          f"模拟延迟 {args.latency_ms}ms ±{args.jitter_ms}ms | 错误率 {args.error_rate:.1%}")
+    print(f"{'='*100}")
+    print(f"{'币种':>6} {'行数':>6} {'响应体':>9} | {'首轮':>9} {'后续p50':>9} | "
+          f"{'汇总p50':>9} {'序列化p50':>9} | {'200 rps':>9} {'200 p99':>9} | {'304 rps':>9} {'304 p99':>9}")
+    for r in results:
+        ok, nm = r['api_data']['200'], r['api_data']['304']
+        print(f"{r['symbols']:>6} {r['rows']:>6} {r['body_bytes'] / 1024:>7.1f}KB | "
+              f"{r['cold_cycle_ms']:>7.1f}ms {r['warm_cycle']['p50_ms']:>7.1f}ms | "
+              f"{r['build_summary']['p50_ms']:>7.2f}ms {r['serialize']['p50_ms']:>7.2f}ms | "
+              f"{ok['rps']:>9.0f} {ok['p99_ms']:>7.2f}ms | {nm['rps']:>9.0f} {nm['p99_ms']:>7.2f}ms")
+        if ok['errors'] or nm['errors']:
+            print(f"       ⚠️  非预期状态码: 200 路径 {ok['errors']} 次, 304 路径 {nm['errors']} 次")
+    print()
+
+async def main():
+    parser = argparse.ArgumentParser(description='离线性能测试')
+    parser.add_argument('--symbols', type=int, nargs='+', default=[50, 500, 5000], help='币种数量（可多个）')
+    parser.add_argument('--cycles', type=int, default=5, help='每个规模运行的更新周期数（至少 2）')
+    parser.add_argument('--summary-iterations', type=int, default=50, help='汇总计算重复次数')
+    parser.add_argument('--clients', type=int, default=20, help='/api/data 并发客户端数')
+    parser.add_argument('--requests', type=int, default=2000, help='/api/data 每项总请求数')
+    parser.add_argument('--latency-ms', type=float, default=0, help='模拟交易所的固定延迟')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='模拟交易所的随机延迟上限')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='模拟交易所返回 500 的概率')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='把结果另存为 JSON 文件')
+    args = parser.parse_args()
+    args.cycles = max(2, args.cycles)
+
+    results = []
+    for n_symbols in args.symbols:
+        print(f"测试 {n_symbols} 个币种...")
+        results.append(await run_for_symbols(n_symbols, args))
+
+    print_report(results, args)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.json}")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -6,69 +6,1350 @@ VAR vs Backpack 资金费率监控器
 """
 
 import asyncio
+import bisect
+import copy
+import gzip
+import hashlib
+import heapq
+import importlib
+import importlib.util
 import json
+import logging
+import logging.handlers
+import mmap
+import multiprocessing
 import os
+import queue
+import random
+import signal
+import socket
+import sqlite3
+import struct
+import sys
+import threading
+import time
 import aiohttp
-import requests
-from datetime import datetime
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from itertools import compress, islice
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
 from aiohttp import web
 
+# 可选依赖：启动时只检查是否安装，首次使用时才导入（见 _optional_module），不拖慢启动
+HAS_BROTLI = importlib.util.find_spec('brotli') is not None    # 未安装时只提供 gzip 压缩
+HAS_MSGPACK = importlib.util.find_spec('msgpack') is not None  # 未安装时不提供 MessagePack 格式
+
 # ==================== 配置 ====================
 VAR_STATS_API = "https://omni-client-api.prod.ap-northeast-1.variational.io/metadata/stats"
-BPX_TICKERS_API = "https://api.backpack.exchange/api/v1/tickers"
+BPX_API_BASE = "https://api.backpack.exchange"
+BPX_WS_URL = "wss://ws.backpack.exchange"
 PROXY_URL = "http://127.0.0.1:10808"  # Backpack 需要代理访问
 WEB_PORT = 17010
 
-# BP到VAR的币种名称映射（BP币种名 -> VAR币种名）
-BPX_TO_VAR_SYMBOL_MAP = {
-    'PUMP': 'PUMPFUN',
-    'kBONK': 'BONK',
-    'kPEPE': 'PEPE',
-    'kSHIB': 'SHIB',
+# 多进程部署：WEB_WORKERS > 0 时由一个获取进程负责数据获取，另起 WEB_WORKERS 个 Web 工作进程
+# 通过 SO_REUSEPORT 共用 WEB_PORT，从共享内存中的快照对外服务（仅 Linux 等支持 fork 的系统）；
+# 0 表示单进程，数据获取和 Web 服务在同一个事件循环中
+WEB_WORKERS = 0
+FETCHER_METRICS_PORT = 17011             # 多进程部署时获取进程的 /metrics 端口
+SHARED_SNAPSHOT_SIZE = 64 * 1024 * 1024  # 共享快照区大小（字节），只占用实际写入的页
+SHARED_SNAPSHOT_POLL_INTERVAL = 0.1      # 工作进程检查新版本的间隔（秒）
+
+# 推送（SSE）配置
+STREAM_HEARTBEAT_INTERVAL = 15   # 无数据时的心跳间隔（秒），防止代理断开空闲连接
+STREAM_QUEUE_SIZE = 4            # 每个订阅者最多积压的版本数，溢出时改发完整快照
+
+# 增量变更配置
+CHANGES_RETENTION = 7200         # 保留最近多少秒的变更集（推送行情每 0.5s 就可能生成一个版本，按时间而非个数保留）
+CHANGES_BUFFER_MAX = 50000       # 变更集条数上限，防止版本异常频繁时内存无限增长
+CHANGE_EPSILON_DEFAULT = 1e-9    # 数值字段变化超过该阈值才记为变更（|值|>1 时按相对变化）
+CHANGE_EPSILON = {               # 按字段覆盖默认阈值
+    'price_spread': 1e-4,
+}
+
+# /api/data 响应缓存与编码配置（每个数据版本内每种查询、格式、压缩方式只编码一次）
+DATA_BODY_CACHE_SIZE = 128          # 每个数据版本最多缓存多少个响应体（查询 × 格式 × 压缩方式）
+RESPONSE_COMPRESS_MIN_SIZE = 1024   # 小于该字节数的响应不压缩
+RESPONSE_GZIP_LEVEL = 6
+RESPONSE_BROTLI_QUALITY = 5         # brotli 压缩等级（0-11），需安装 brotli
+
+# 前端静态资源配置（启动时构建并预压缩）
+STATIC_MAX_AGE = 365 * 86400      # 带内容哈希的样式和脚本的缓存时间（秒）
+STATIC_HASH_LENGTH = 12           # 文件名中内容哈希的长度
+
+UPDATE_CYCLE_DEADLINE = 20       # 单轮更新截止时间（秒），超时的交易所本轮保留上次数据
+TASK_RESTART_DELAY = 5           # 后台任务（更新循环、行情推送等）异常退出后重启前的等待（秒）
+
+# 历史数据存储配置（SQLite）
+HISTORY_ENABLED = True
+HISTORY_DB_PATH = 'funding_history.db'
+HISTORY_SAMPLE_INTERVAL = 30       # 历史样本记录间隔（秒）
+HISTORY_MAX_PENDING_BATCHES = 20   # 写线程积压超过该批数时丢弃新样本，避免内存增长
+HISTORY_PRUNE_INTERVAL = 3600      # 过期数据清理间隔（秒）
+HISTORY_READ_WORKERS = 4           # 查询线程数（WAL 模式下读写互不阻塞）
+HISTORY_DEFAULT_RANGE = 86400      # /api/history 默认查询最近多少秒
+HISTORY_MAX_POINTS = 2000          # 单次查询最多返回的桶数，未指定 step 时据此自动选择
+# 各表保留天数（None 表示永久保留）：原始样本保留较短，降采样表逐级保留更久
+HISTORY_RETENTION_DAYS = {
+    'samples': 7,
+    'samples_1m': 30,
+    'samples_1h': 365,
+    'samples_1d': None,
+}
+
+# 快照检查点：定期把最新快照原子写入磁盘，重启后立即载入（标记为过期），首轮获取完成前也有数据可看
+CHECKPOINT_PATH = 'snapshot_checkpoint.json'   # None 表示不保存
+CHECKPOINT_INTERVAL = 30                       # 保存间隔（秒），数据未变化时不写
+CHECKPOINT_MAX_AGE = 6 * 3600                  # 超过该时间的检查点不再载入（秒）
+
+# 告警配置：规则在每次数据更新时按变更增量评估，触发 / 恢复事件发送到告警输出
+ALERTS_ENABLED = True
+ALERT_SINKS = {                    # 名称 -> 输出配置，type 为 stdout / file / webhook
+    'stdout': {'type': 'stdout'},
+    'file': {'type': 'file', 'path': 'alerts.jsonl'},
+    # 'webhook': {'type': 'webhook', 'url': 'http://127.0.0.1:9000/alerts'},
+}
+ALERT_RULES = [                    # 参数见 AlertRule，metric 取值同 /api/data 的 sort 参数
+    {'name': '费率差持续偏高', 'metric': 'diff', 'threshold': 0.02, 'cycles': 3},
+    {'name': '价差过大', 'metric': 'spread', 'threshold': 0.5},
+]
+ALERT_DEFAULT_COOLDOWN = 1800      # 同一规则、同一币种两次触发之间的最短间隔（秒）
+ALERT_DEFAULT_HYSTERESIS = 0.2     # 未指定 clear 时，指标回落到阈值的 (1 - 该比例) 以下才恢复
+ALERT_QUEUE_SIZE = 1000            # 待发送告警的队列长度，溢出时丢弃新事件
+ALERT_WEBHOOK_TIMEOUT = 5          # webhook 请求超时（秒）
+
+# 日志配置：日志先放入内存队列，由后台线程写出（JSON Lines 文件 + 控制台），磁盘慢不会阻塞更新和接口
+LOG_PATH = 'monitor.jsonl'         # 结构化日志文件，None 表示不写文件；多进程部署时每个进程一个文件
+LOG_LEVEL = 'INFO'
+LOG_CONSOLE = True                 # 同时以文本格式输出到标准输出
+LOG_MAX_BYTES = 10 * 1024 * 1024   # 单个日志文件大小上限，超过后轮转
+LOG_BACKUP_COUNT = 5               # 保留的轮转文件数
+LOG_QUEUE_SIZE = 10000             # 待写出日志的队列长度，溢出时丢弃新日志
+LOG_SAMPLE_WINDOW = 60             # 高频事件采样窗口（秒）
+LOG_SAMPLE_LIMITS = {              # 高频事件 -> 每个窗口最多记录条数，其余只计数
+    'bpx_funding_symbol_error': 20,
+    'depth_snapshot_error': 10,
+}
+
+# HTTP 连接池配置（进程内共享，跨更新周期复用连接）
+PROXY_HOSTS = {'api.backpack.exchange', 'ws.backpack.exchange'}  # 只有这些主机走 PROXY_URL
+HTTP_LIMIT_PER_HOST = 20                 # 每个主机的最大连接数
+HTTP_KEEPALIVE_TIMEOUT = 75              # 空闲连接保活时间（秒），需大于更新间隔
+HTTP_DNS_CACHE_TTL = 300                 # DNS 缓存时间（秒）
+
+# 请求管控（每个主机独立：令牌桶限速、429/5xx 退避重试、熔断）
+HOST_RATE_LIMITS = {                     # 主机 -> (每秒请求数, 突发上限)
+    'api.backpack.exchange': (20, 60),
+}
+HOST_RATE_LIMIT_DEFAULT = (20, 40)
+HTTP_MAX_RETRIES = 2                     # 429/5xx/网络错误的最大重试次数
+HTTP_BACKOFF_BASE = 0.5                  # 第 n 次重试前随机等待 0 ~ BASE*2^n 秒
+HTTP_BACKOFF_MAX = 8                     # 单次退避最长等待（秒）
+HTTP_MAX_QUEUE_WAIT = 5                  # 等待令牌或 Retry-After 超过该时间则直接放弃请求（秒）
+HTTP_RETRY_AFTER_MAX = 300               # Retry-After 最长遵守时间（秒）
+CIRCUIT_FAILURE_THRESHOLD = 5            # 连续失败多少次后熔断，熔断期间请求直接失败
+CIRCUIT_OPEN_SECONDS = 30                # 熔断多久后放行一个探测请求（探测失败时翻倍）
+CIRCUIT_OPEN_MAX_SECONDS = 600           # 熔断时间上限（秒）
+EXCHANGE_STALE_AFTER = 60                # 交易所数据超过该时间未成功更新即标记为过期（秒）
+
+# 监控指标直方图的桶边界（秒）
+METRICS_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30)  # 网络请求、更新周期
+METRICS_FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)  # 计算、序列化、接口处理
+
+# 刷新调度配置
+PRICE_REFRESH_INTERVAL = 10           # 价格（BP tickers、VAR stats）刷新间隔（秒），即每轮更新的间隔
+MARKETS_REFRESH_INTERVAL = 3600       # BP markets（币种列表、结算间隔）刷新间隔（秒）
+FUNDING_SETTLEMENT_DELAY = 15         # 结算后等待多久再获取新一期资金费率（秒）
+FUNDING_RETRY_INTERVAL = 30           # 获取失败或新一期结果尚未发布时的重试间隔（秒）
+FUNDING_REFRESH_MAX_INTERVAL = 3600   # 单个币种资金费率最长多久强制刷新一次（秒）
+BPX_REQUEST_BUDGET_PER_MINUTE = 120   # 每分钟最多经代理发出的 Backpack 请求数
+
+# Backpack 行情推送（WebSocket）配置，连接不可用时自动改用 REST 轮询价格
+BPX_WS_ENABLED = True
+BPX_WS_COALESCE_INTERVAL = 0.5    # 推送行情合并写入的间隔（秒），每次合并生成一个数据版本
+BPX_WS_HEARTBEAT = 20             # WebSocket ping 间隔（秒）
+BPX_WS_STALE_AFTER = 30           # 超过该时间没有收到推送即视为不健康，改用 REST（秒）
+BPX_WS_RECONNECT_MAX = 30         # 重连等待上限（秒）
+
+# Backpack 资金费率获取配置：每轮用 markPrices 一次获取所有永续合约的当前费率，
+# 批量接口失败或缺少的币种再按结算时间逐个请求 fundingRates
+BPX_FUNDING_BULK = True
+BPX_FUNDING_CONCURRENCY = 10      # 同时进行的 fundingRates 请求数上限
+BPX_FUNDING_REQUEST_TIMEOUT = 5   # 单个币种请求超时（秒）
+BPX_FUNDING_CYCLE_DEADLINE = 12   # 整轮资金费率获取的截止时间（秒），超时币种沿用上次数据
+
+# 盘口深度：跟踪推荐等级较高币种的 Backpack 订单簿，按目标名义金额计算可成交均价、滑点和可成交价差
+DEPTH_ENABLED = True
+DEPTH_MIN_LEVEL = 2                      # 推荐等级达到该值的币种才跟踪订单簿
+DEPTH_MAX_SYMBOLS = 10                   # 最多同时跟踪的币种数（按费率差从大到小）
+DEPTH_NOTIONALS = (1000, 10000, 50000)   # 目标名义金额（USDC）
+DEPTH_MAX_LEVELS = 200                   # 计算成交结果时每侧最多遍历的档位数
+DEPTH_BUFFER_SIZE = 1000                 # 订单簿快照到达前最多缓存的增量推送数
+DEPTH_REFRESH_INTERVAL = 30              # 推送不可用时用 REST 刷新订单簿的间隔（秒）
+
+# 交易所（适配器名 -> 显示名），见 EXCHANGE_ADAPTERS
+# 主交易所决定表格的行（有资金费率的币种），对比交易所对应 var_* 字段，
+# 所有启用的交易所一起参与每个币种最优多空组合（best_pair）的计算
+EXCHANGE_LABELS = {'bpx': 'BP', 'var': 'VAR'}
+ENABLED_EXCHANGES = ('bpx', 'var')
+PRIMARY_EXCHANGE = 'bpx'
+COMPARE_EXCHANGE = 'var'
+
+# 各交易所原生币种名 -> 标准币种名（标准名沿用BP的币种名），未列出的同名
+SYMBOL_ALIASES = {
+    'var': {
+        'PUMPFUN': 'PUMP',
+        'BONK': 'kBONK',
+        'PEPE': 'kPEPE',
+        'SHIB': 'kSHIB',
+    },
 }
 
 # 币种黑名单（不在前端显示的币种）
 SYMBOL_BLACKLIST = {'kBONK', 'kPEPE', 'kSHIB'}
 
+# ==================== 监控指标 ====================
+_METRICS = []  # 所有已注册的指标，按注册顺序输出
+
+def _format_labels(names, values, extra=''):
+    """生成 Prometheus 标签字符串，如 {exchange="bpx",le="0.1"}"""
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    """只增不减的计数器"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}  # 标签值元组 -> 计数
+        _METRICS.append(self)
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for labels, value in self._values.items():
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+class Gauge:
+    """可任意设置的当前值"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        _METRICS.append(self)
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        for labels, value in self._values.items():
+            if value is not None:
+                lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {value}')
+        return lines
+
+class Histogram:
+    """固定桶边界的直方图
+
+    observe 只做一次二分查找和两次加法；累计计数在输出时才计算。
+    """
+
+    def __init__(self, name, help_text, labelnames=(), buckets=METRICS_LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # 标签值元组 -> [各桶计数（最后一个是 +Inf）, 总和]
+        _METRICS.append(self)
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        """记录 with 块的耗时（秒）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{le} {cumulative}')
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_str} {total}')
+            lines.append(f'{self.name}_count{label_str} {cumulative}')
+        return lines
+
+def render_metrics():
+    """以 Prometheus 文本格式输出所有指标"""
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+# 交易所请求
+EXCHANGE_REQUEST_SECONDS = Histogram(
+    'exchange_request_duration_seconds', '交易所接口请求耗时（到收到响应头）', ('exchange', 'endpoint'))
+EXCHANGE_REQUEST_ERRORS = Counter(
+    'exchange_request_errors_total', '交易所接口错误（HTTP 状态码或 exception）', ('exchange', 'endpoint', 'status'))
+EXCHANGE_REQUEST_TIMEOUTS = Counter(
+    'exchange_request_timeouts_total', '交易所接口超时或被截止时间取消', ('exchange', 'endpoint'))
+EXCHANGE_REQUEST_RETRIES = Counter('exchange_request_retries_total', '交易所请求重试次数', ('host',))
+EXCHANGE_REQUESTS_REJECTED = Counter(
+    'exchange_requests_rejected_total', '因熔断或限速等待过久而未发出的请求', ('host', 'reason'))
+EXCHANGE_CIRCUIT_STATE = Gauge('exchange_circuit_state', '熔断器状态（0=关闭 1=半开 2=打开）', ('host',))
+EXCHANGE_FETCH_FAILURES = Counter(
+    'exchange_fetch_failures_total', '整轮获取失败或超时、保留上次数据的次数', ('exchange',))
+BPX_FUNDING_FANOUT_SECONDS = Histogram(
+    'bpx_funding_fanout_duration_seconds', 'Backpack fundingRates 并发获取总耗时')
+BPX_FUNDING_STALE_SYMBOLS = Counter(
+    'bpx_funding_stale_symbols_total', 'Backpack 资金费率获取失败或超时的币种次数')
+BPX_FUNDING_DEFERRED_SYMBOLS = Counter(
+    'bpx_funding_deferred_symbols_total', '资金费率已到期但因请求预算不足顺延的币种次数')
+BPX_REQUEST_BUDGET_REMAINING = Gauge(
+    'bpx_request_budget_remaining', '最近一分钟内剩余的 Backpack 请求预算')
+
+# 行情推送
+BPX_WS_CONNECTED = Gauge('bpx_ws_connected', 'Backpack 行情推送是否已连接')
+BPX_WS_MESSAGES = Counter('bpx_ws_messages_total', 'Backpack 行情推送消息数')
+BPX_WS_RECONNECTS = Counter('bpx_ws_reconnects_total', 'Backpack 行情推送断线重连次数')
+BPX_PRICE_LATENCY_SECONDS = Histogram(
+    'bpx_price_latency_seconds', '推送行情从交易所事件时间到写入快照的延迟',
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1, 2.5, 5, 10))
+DEPTH_TRACKED_SYMBOLS = Gauge('depth_tracked_symbols', '当前跟踪订单簿的币种数')
+DEPTH_UPDATES = Counter('depth_updates_total', '应用的订单簿增量推送数')
+DEPTH_RESYNCS = Counter(
+    'depth_snapshots_total', '订单簿 REST 快照请求数（新跟踪 snapshot / 序号断档 gap / 无推送时刷新 poll）',
+    ('reason',))
+
+# 更新周期和数据处理
+UPDATE_CYCLE_SECONDS = Histogram('update_cycle_duration_seconds', '一轮更新（获取两个交易所数据）的耗时')
+UPDATE_FAILURES = Counter('update_failures_total', '更新周期异常次数')
+TASK_RESTARTS = Counter('background_task_restarts_total', '后台任务异常退出后的重启次数', ('task',))
+STORE_OPERATION_SECONDS = Histogram(
+    'store_operation_duration_seconds', '存储层操作耗时', ('operation',), buckets=METRICS_FAST_BUCKETS)
+JSON_SERIALIZE_SECONDS = Histogram(
+    'json_serialize_duration_seconds', '响应体序列化耗时', ('payload',), buckets=METRICS_FAST_BUCKETS)
+RESPONSE_COMPRESS_SECONDS = Histogram(
+    'response_compress_duration_seconds', '响应体压缩耗时', ('encoding',), buckets=METRICS_FAST_BUCKETS)
+HISTORY_DROPPED_BATCHES = Counter('history_dropped_batches_total', '写入积压时丢弃的历史样本批数')
+
+# Web 服务
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Web 接口处理耗时（不含推送长连接）', ('route',), buckets=METRICS_FAST_BUCKETS)
+HTTP_REQUESTS = Counter('http_requests_total', 'Web 接口请求数', ('route', 'status'))
+
+# 日志
+LOG_DROPPED = Counter('log_dropped_total', '日志队列已满时丢弃的日志条数')
+LOG_SAMPLED = Counter('log_sampled_total', '高频事件超过采样上限而未记录的日志条数', ('event',))
+
+# 告警
+ALERTS_SENT = Counter('alerts_total', '告警事件数', ('rule', 'state'))
+ALERTS_SUPPRESSED = Counter('alerts_suppressed_total', '冷却期内再次触发而未发送的告警数', ('rule',))
+ALERTS_DROPPED = Counter('alerts_dropped_total', '发送队列已满时丢弃的告警事件数')
+ALERT_SINK_ERRORS = Counter('alert_sink_errors_total', '告警输出发送失败次数', ('sink',))
+ALERTS_ACTIVE = Gauge('alerts_active', '当前满足触发条件的（规则, 币种）数')
+ALERT_EVALUATION_SECONDS = Histogram(
+    'alert_evaluation_duration_seconds', '每个数据版本的告警评估耗时', buckets=METRICS_FAST_BUCKETS)
+
+# 当前状态
+DATA_VERSION = Gauge('data_version', '当前数据版本号')
+SYMBOLS = Gauge('symbols', '当前显示的币种数')
+STALE_SYMBOLS = Gauge('bpx_stale_symbols', '当前沿用上次费率的 Backpack 币种数')
+LAST_UPDATE_TIMESTAMP = Gauge('last_update_timestamp_seconds', '最近一次数据更新的时间戳')
+LEG_SKEW_SECONDS = Gauge('leg_skew_seconds', '两个交易所价格快照的时间差')
+STREAM_SUBSCRIBERS = Gauge('stream_subscribers', '当前推送连接数')
+PROCESS_START_TIME = Gauge('process_start_time_seconds', '进程启动时间戳')
+PROCESS_START_TIME.set(time.time())
+
+# ==================== 日志 ====================
+log = logging.getLogger('funding_monitor')
+
+def log_event(event, message, level=logging.INFO, exc_info=None, **fields):
+    """记录一条结构化日志
+
+    调用方只做一次入队，格式化和写盘都在后台线程进行，可以在事件循环和接口处理中直接调用。
+
+    Args:
+        event: 事件名（JSON 日志的 event 字段，也是 LOG_SAMPLE_LIMITS 的采样键）
+        message: 可读的消息文本
+        level: 日志级别
+        exc_info: 需要附带堆栈的异常（True 表示当前正在处理的异常）
+        **fields: 结构化字段，如耗时（*_ms）、币种、HTTP 状态码，原样写入 JSON
+    """
+    log.log(level, message, exc_info=exc_info, extra={'event': event, 'fields': fields})
+
+class JsonLogFormatter(logging.Formatter):
+    """每条日志一行 JSON：时间、级别、事件名、消息、进程号，以及 log_event 传入的结构化字段"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'event': getattr(record, 'event', record.name),
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        # 保留键优先：与 ts、level、event、msg、pid、exc 同名的结构化字段被忽略，不能覆盖它们
+        reserved = ('ts', 'level', 'event', 'msg', 'pid', 'exc')
+        entry.update(
+            (key, value) for key, value in getattr(record, 'fields', {}).items() if key not in reserved
+        )
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class EventSampler(logging.Filter):
+    """高频事件采样：每个采样窗口内同一事件最多记录 limit 条，其余只计入 log_sampled_total
+
+    新窗口的第一条日志带 suppressed 字段，记录上个窗口被丢弃的条数。
+
+    Args:
+        limits: {事件名: 每个窗口最多记录条数}
+        window: 采样窗口（秒）
+    """
+
+    def __init__(self, limits, window):
+        super().__init__()
+        self.limits = limits
+        self.window = window
+        self._windows = {}  # 事件名 -> [窗口开始时间, 已记录条数, 已丢弃条数]
+        self._lock = threading.Lock()  # 历史写入、检查点等线程也会记录日志
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        limit = self.limits.get(event)
+        if limit is None:
+            return True
+        with self._lock:
+            state = self._windows.get(event)
+            if state is None or record.created - state[0] >= self.window:
+                if state is not None and state[2]:
+                    record.fields = {**record.fields, 'suppressed': state[2]}
+                state = self._windows[event] = [record.created, 0, 0]
+            if state[1] >= limit:
+                state[2] += 1
+                LOG_SAMPLED.inc(event)
+                return False
+            state[1] += 1
+            return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """只把日志放入有界队列，由 QueueListener 线程写出；队列已满时丢弃并计数，从不等待"""
+
+    def prepare(self, record):
+        # 消息参数和异常堆栈在调用方线程转为字符串，其余格式化留给写出线程
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+class LogQueueListener(logging.handlers.QueueListener):
+    """日志写出线程；停止时等待队列有空位再放入结束标记（队列满时默认实现会抛出 queue.Full）"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+def setup_logging(tag=None):
+    """配置本进程的日志：所有日志（包括 aiohttp、asyncio 等库的日志）经内存队列由后台线程写出
+
+    Args:
+        tag: 多进程部署时的进程标识，日志文件名加上该后缀（如 monitor.web1.jsonl），
+             每个进程分别写入和轮转自己的文件
+
+    Returns:
+        LogQueueListener: 已启动的写出线程，进程退出前调用 stop() 写完队列中剩余的日志
+    """
+    handlers = []
+    if LOG_PATH:
+        path = LOG_PATH
+        if tag:
+            stem, ext = os.path.splitext(LOG_PATH)
+            path = f'{stem}.{tag}{ext}'
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+        file_handler.setFormatter(JsonLogFormatter())
+        handlers.append(file_handler)
+    if LOG_CONSOLE:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter('[%(asctime)s] %(message)s', '%H:%M:%S'))
+        handlers.append(console_handler)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(EventSampler(LOG_SAMPLE_LIMITS, LOG_SAMPLE_WINDOW))
+    root = logging.getLogger()
+    for handler in root.handlers[:]:  # fork 出的子进程替换掉继承自父进程的队列
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    logging.getLogger('aiohttp.access').setLevel(logging.WARNING)  # 接口访问情况见 /metrics
+
+    listener = LogQueueListener(queue_handler.queue, *handlers)
+    listener.start()
+    return listener
+
+# ==================== 费率标准化 ====================
+HOURS_PER_YEAR = 365 * 24
+
+def to_hourly(funding, intervals):
+    """把每个结算周期的费率（%）按结算间隔（秒）折算为每小时，0 表示间隔未知，按 1 小时处理"""
+    return [
+        rate * 3600 / interval if interval > 0 else rate
+        for rate, interval in zip(funding, intervals)
+    ]
+
+def normalize_funding(var_funding, var_intervals, bpx_funding, bpx_intervals):
+    """把两个交易所的资金费率统一为每小时、每8小时和年化（APR）
+
+    适配器返回的都是每个结算周期的费率（%），按各自的结算间隔折算到每小时。
+    所有输入为按币种对齐的列，整列一次性计算。
+
+    Args:
+        var_funding: VAR 每个结算周期的费率（%）
+        var_intervals: VAR 结算间隔（秒）
+        bpx_funding: BP 每个结算周期的费率（%）
+        bpx_intervals: BP 结算间隔（秒）
+
+    Returns:
+        dict: 各列结果（list），键为 var_hourly / bpx_hourly / diff_hourly，
+              以及对应的 _8h 和 _apr
+    """
+    var_hourly = to_hourly(var_funding, var_intervals)
+    bpx_hourly = to_hourly(bpx_funding, bpx_intervals)
+    diff_hourly = [var - bp for var, bp in zip(var_hourly, bpx_hourly)]
+
+    columns = {
+        'var_hourly': var_hourly,
+        'bpx_hourly': bpx_hourly,
+        'diff_hourly': diff_hourly,
+    }
+    for name in ('var', 'bpx', 'diff'):
+        hourly = columns[f'{name}_hourly']
+        columns[f'{name}_8h'] = [rate * 8 for rate in hourly]
+        columns[f'{name}_apr'] = [rate * HOURS_PER_YEAR for rate in hourly]
+    return columns
+
+def best_funding_pairs(hourly_columns):
+    """逐币种找出每小时费率最高（做空）和最低（做多）的交易所
+
+    每个交易所一列、按币种对齐；缺失值填为 ±inf 后按行整体取最大 / 最小值，
+    计算量为 交易所数 × 币种数，不需要两两比较交易所。
+
+    Args:
+        hourly_columns: 每个交易所一列每小时费率（%），None 表示该交易所没有该币种
+
+    Returns:
+        list: 每个币种一项 (做空交易所序号, 做多交易所序号, 费率差)，
+              有数据的交易所少于两个时为 None
+    """
+    inf = float('inf')
+    high_rows = list(zip(*([-inf if r is None else r for r in column] for column in hourly_columns)))
+    low_rows = list(zip(*([inf if r is None else r for r in column] for column in hourly_columns)))
+    counts = map(sum, zip(*([r is not None for r in column] for column in hourly_columns)))
+
+    pairs = []
+    for high_row, low_row, high, low, count in zip(
+        high_rows, low_rows, map(max, high_rows), map(min, low_rows), counts
+    ):
+        if count < 2:
+            pairs.append(None)
+            continue
+        # 做多取最后一个最小值，所有交易所费率相同时也不会选到同一个交易所
+        long_index = len(low_row) - 1 - low_row[::-1].index(low)
+        pairs.append((high_row.index(high), long_index, high - low))
+    return pairs
+
+# ==================== 响应编码 ====================
+# /api/data 的响应格式（format 参数）-> Content-Type
+RESPONSE_FORMATS = {
+    'json': 'application/json',         # 每行一个对象（默认）
+    'columnar': 'application/json',     # 每个字段一个数组
+    'msgpack': 'application/msgpack',   # 与 columnar 相同的结构，MessagePack 编码（需安装 msgpack）
+}
+
+def _optional_module(name):
+    """导入可选依赖（HAS_BROTLI / HAS_MSGPACK 为真时才调用），第一次调用时才真正导入"""
+    return sys.modules.get(name) or importlib.import_module(name)
+
+# 压缩方式（Accept-Encoding）-> 压缩函数，按优先顺序排列
+RESPONSE_ENCODERS = {}
+if HAS_BROTLI:
+    RESPONSE_ENCODERS['br'] = lambda body: _optional_module('brotli').compress(body, quality=RESPONSE_BROTLI_QUALITY)
+RESPONSE_ENCODERS['gzip'] = lambda body: gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL, mtime=0)
+
+def _columnar(rows):
+    """行 -> 列：{字段: [各行的值]}
+
+    推荐信息只保留等级 recommendation_level，文本、方向和样式可由等级和费率差的符号得到。
+    """
+    if not rows:
+        return {}
+    columns = {field: [row[field] for row in rows] for field in rows[0]}
+    if 'recommendation' in columns:
+        columns['recommendation_level'] = [rec['level'] for rec in columns.pop('recommendation')]
+    return columns
+
+def encode_payload(payload, fmt):
+    """把 /api/data 的响应数据编码为 fmt 格式（RESPONSE_FORMATS 中的名称）的字节"""
+    if fmt != 'json':
+        payload = dict(payload, summary=_columnar(payload['summary']))
+    if fmt == 'msgpack':
+        return _optional_module('msgpack').packb(payload, use_bin_type=True)
+    return json.dumps(payload).encode('utf-8')
+
 # ==================== 数据存储 ====================
+# 推荐等级阈值（每小时费率差绝对值，%）：低于第一个为 0 级，依次为 1/2/3 级
+RECOMMENDATION_THRESHOLDS = (0.005, 0.01, 0.02)
+
+# /api/data 的排序方式（sort 参数）：名称 -> 排序值，均按降序排列
+DATA_SORT_KEYS = {
+    'diff': lambda row: abs(row['funding_rate_diff']),     # 每小时费率差绝对值（默认，即快照的行顺序）
+    'spread': lambda row: abs(row['price_spread']),        # 价格差异绝对值
+    'var_funding': lambda row: row['var_funding_hourly'],  # VAR 每小时费率
+    'apr': lambda row: row['best_pair']['diff_apr'] if row['best_pair'] else float('-inf'),  # 最优多空组合的年化费率差
+}
+
+# 交易所数据表的列及其 array 类型码
+EXCHANGE_COLUMNS = {
+    'funding': 'd',   # 资金费率（%）
+    'interval': 'q',  # 结算间隔（秒）
+    'price': 'd',     # 价格
+}
+
+class ExchangeTable:
+    """单个交易所的列式数据
+
+    固定的币种索引（symbols / index）加每个字段一列（array），各列按行号对齐，
+    汇总计算时按列整体处理，不再逐币种查多个字典。
+    """
+
+    def __init__(self, symbols=(), columns=None):
+        self.symbols = tuple(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        columns = columns or {}
+        self.columns = {}
+        for name, typecode in EXCHANGE_COLUMNS.items():
+            values = columns.get(name, [0] * len(self.symbols))
+            self.columns[name] = array(typecode, map(int, values) if typecode == 'q' else values)
+
+    @classmethod
+    def from_fields(cls, fields, symbols=None):
+        """由 {列名: {币种: 值}} 构建，symbols 为空时取所有字段中出现过的币种"""
+        if symbols is None:
+            symbols = sorted(set().union(*fields.values()))
+        columns = {
+            name: [values.get(symbol, 0) for symbol in symbols]
+            for name, values in fields.items()
+        }
+        return cls(symbols, columns)
+
+    def same_as(self, other):
+        """币种和各列的值是否与另一张表完全相同（逐列整体比较）"""
+        return self.symbols == other.symbols and self.columns == other.columns
+
+    def get(self, symbol, column, default=0):
+        """读取单个值"""
+        i = self.index.get(symbol)
+        return default if i is None else self.columns[column][i]
+
+    def with_values(self, column, values):
+        """返回替换了某一列部分值的新表，币种索引和其它列与原表共享
+
+        Args:
+            column: 列名
+            values: {币种: 新值}，不在表中的币种忽略
+
+        Returns:
+            ExchangeTable: 新表；没有任何值变化时返回原表
+        """
+        current = self.columns[column]
+        updates = []
+        for symbol, value in values.items():
+            i = self.index.get(symbol)
+            if i is not None and current[i] != value:
+                updates.append((i, value))
+        if not updates:
+            return self
+
+        updated = array(current.typecode, current)
+        for i, value in updates:
+            updated[i] = value
+        table = ExchangeTable.__new__(ExchangeTable)
+        table.symbols = self.symbols
+        table.index = self.index
+        table.columns = dict(self.columns, **{column: updated})
+        return table
+
+    def __len__(self):
+        return len(self.symbols)
+
+_EMPTY_TABLE = ExchangeTable()
+
+class ChangeSet:
+    """相邻两个数据版本之间的变更集
+
+    Attributes:
+        added: 新增的币种
+        removed: 删除的币种
+        changed: {币种: {字段: 新值}}，只包含变化超过阈值的字段
+        level_changes: 推荐等级变化 [{'symbol', 'from', 'to'}]
+        order_changed: 排序是否变化
+    """
+
+    def __init__(self, version, base_version, added, removed, changed, level_changes, order_changed):
+        self.version = version
+        self.base_version = base_version
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+        self.level_changes = level_changes
+        self.order_changed = order_changed
+        self.created_at = time.monotonic()
+
+    @classmethod
+    def compute(cls, version, previous, rows):
+        """比较上一版本快照与新版本的行，生成变更集"""
+        old_by_symbol = previous.by_symbol if previous else {}
+        added, changed, level_changes = [], {}, []
+        for row in rows:
+            symbol = row['symbol']
+            old = old_by_symbol.get(symbol)
+            if old is None:
+                added.append(symbol)
+                level_changes.append({'symbol': symbol, 'from': None, 'to': row['recommendation']['level']})
+                continue
+
+            fields = {}
+            for field, value in row.items():
+                if field not in old:  # 旧版本（如检查点）没有的字段
+                    fields[field] = value
+                    continue
+                old_value = old[field]
+                if isinstance(value, float) or isinstance(old_value, float):
+                    epsilon = CHANGE_EPSILON.get(field, CHANGE_EPSILON_DEFAULT)
+                    if abs(value - old_value) > epsilon * max(1.0, abs(value), abs(old_value)):
+                        fields[field] = value
+                elif value != old_value:
+                    fields[field] = value
+            if fields:
+                changed[symbol] = fields
+            old_level, new_level = old['recommendation']['level'], row['recommendation']['level']
+            if old_level != new_level:
+                level_changes.append({'symbol': symbol, 'from': old_level, 'to': new_level})
+
+        new_symbols = {row['symbol'] for row in rows}
+        removed = [symbol for symbol in old_by_symbol if symbol not in new_symbols]
+        for symbol in removed:
+            level_changes.append({'symbol': symbol, 'from': old_by_symbol[symbol]['recommendation']['level'], 'to': None})
+
+        old_order = [row['symbol'] for row in previous.rows] if previous else []
+        order_changed = [row['symbol'] for row in rows] != old_order
+        return cls(version, previous.version if previous else None,
+                   added, removed, changed, level_changes, order_changed)
+
+    def encode(self):
+        """序列化为 JSON（多进程部署时随响应体一起发布到共享区）"""
+        return json.dumps([self.version, self.base_version, self.added, self.removed, self.changed,
+                           self.level_changes, self.order_changed]).encode('utf-8')
+
+    @classmethod
+    def decode(cls, data):
+        """由 encode() 的结果还原"""
+        return cls(*json.loads(data))
+
+class SummarySnapshot:
+    """某个数据版本的只读快照
+
+    每次 update_data 时构建一次：排好序的行、统计信息，以及按需缓存的
+    响应体（各 limit 变体和查询变体，各种格式及其压缩版本）。同一版本内的所有
+    /api/data 请求直接返回缓存的字节，与币种数量无关；其它排序方式的行号索引
+    同样每个版本只计算一次。
+    """
+
+    def __init__(self, version, rows, stats, etag_prefix, previous=None):
+        self.version = version
+        self.rows = tuple(rows)
+        self.by_symbol = {row['symbol']: row for row in self.rows}
+        self.stats = stats
+        self.etag = f'"{etag_prefix}-{version}"'
+        self._bodies = {}  # (limit 或查询, 格式) -> /api/data 响应体，limit=None 表示全部
+        self._compressed = {}  # (压缩方式, 响应体 id) -> (响应体, 压缩后的响应体)
+        self._sort_indexes = {}  # 排序方式 -> 按该方式降序排列的行号
+        self._neg_abs_diffs = None  # 各行 -|费率差|（升序），用于二分查找 min_diff 的截断位置
+        self._sse_snapshot = None
+        self._changes_bodies = {}  # since -> /api/changes 响应体
+
+        # 相对上一版本的变更集（供推送和 /api/changes 使用）
+        self.base_version = previous.version if previous else None
+        self.changes = ChangeSet.compute(version, previous, self.rows)
+        self._sse_delta = None
+
+    def body(self, limit=None, fmt='json'):
+        """返回前 limit 行的响应体（字节），同一 limit 和格式只序列化一次"""
+        if limit is not None and (limit <= 0 or limit >= len(self.rows)):
+            limit = None
+        key = (limit, fmt)
+        body = self._bodies.get(key)
+        if body is None:
+            rows = self.rows[:limit] if limit else self.rows
+            with JSON_SERIALIZE_SECONDS.time('data' if fmt == 'json' else f'data_{fmt}'):
+                body = encode_payload({
+                    'summary': list(rows), 'stats': self.stats, 'version': self.version
+                }, fmt)
+            self._cache_body(key, body)
+        return body
+
+    def _cache_body(self, key, body):
+        if len(self._bodies) < DATA_BODY_CACHE_SIZE or key == (None, 'json'):
+            self._bodies[key] = body
+
+    def compressed(self, body, encoding):
+        """返回 body 压缩后的字节，同一响应体每种压缩方式只压缩一次
+
+        Args:
+            body: 本快照返回的响应体
+            encoding: RESPONSE_ENCODERS 中的压缩方式
+
+        Returns:
+            bytes: 压缩后的响应体；小于 RESPONSE_COMPRESS_MIN_SIZE 不值得压缩时返回 None
+        """
+        if len(body) < RESPONSE_COMPRESS_MIN_SIZE:
+            return None
+        # 按对象身份查找（响应体来自本快照的缓存，不必对整个响应体求哈希）；
+        # 缓存项同时保存原响应体，保证 id 在快照存活期间不会被复用
+        key = (encoding, id(body))
+        cached = self._compressed.get(key)
+        if cached is not None and cached[0] is body:
+            return cached[1]
+        with RESPONSE_COMPRESS_SECONDS.time(encoding):
+            result = RESPONSE_ENCODERS[encoding](body)
+        if len(self._compressed) < DATA_BODY_CACHE_SIZE:
+            self._compressed[key] = (body, result)
+        return result
+
+    def sorted_positions(self, sort):
+        """按 sort（DATA_SORT_KEYS 中的名称）降序排列的行号，每种排序只计算一次"""
+        positions = self._sort_indexes.get(sort)
+        if positions is None:
+            if sort == 'diff':
+                positions = range(len(self.rows))  # 行本身已按费率差绝对值排序
+            else:
+                values = [DATA_SORT_KEYS[sort](row) for row in self.rows]
+                positions = tuple(sorted(range(len(values)), key=values.__getitem__, reverse=True))
+            self._sort_indexes[sort] = positions
+        return positions
+
+    def query_body(self, query, fmt='json'):
+        """按查询条件过滤、排序、分页和投影后的响应体（字节），同一查询和格式只计算一次
+
+        Args:
+            query: _parse_data_query 返回的查询
+            fmt: 响应格式（RESPONSE_FORMATS 中的名称）
+
+        Raises:
+            ValueError: fields 含未知字段，或 cursor 指向的币种不在结果中
+        """
+        key = (tuple(sorted(query.items())), fmt)
+        body = self._bodies.get(key)
+        if body is not None:
+            return body
+
+        rows = self.rows
+        sort = query['sort']
+        positions = self.sorted_positions(sort)
+        min_diff = query['min_diff']
+        if query['min_level'] > 0:
+            # 推荐等级 >= n 等价于费率差绝对值 >= 第 n 个阈值
+            min_diff = max(min_diff, RECOMMENDATION_THRESHOLDS[query['min_level'] - 1])
+        if min_diff > 0 and sort == 'diff':
+            # 按费率差排序时满足条件的是一个前缀，二分查找截断
+            if self._neg_abs_diffs is None:
+                self._neg_abs_diffs = [-abs(row['funding_rate_diff']) for row in rows]
+            positions = positions[:bisect.bisect_right(self._neg_abs_diffs, -min_diff)]
+
+        include, exclude, has_var = query['symbols'], query['exclude'], query['has_var']
+        matched = [
+            i for i in positions
+            if (not include or rows[i]['symbol'] in include)
+            and rows[i]['symbol'] not in exclude
+            and (has_var is None or rows[i]['has_var_data'] == has_var)
+            and abs(rows[i]['funding_rate_diff']) >= min_diff
+        ]
+
+        # 分页：cursor 为上一页最后一个币种，offset 在此基础上再跳过
+        start = query['offset']
+        if query['cursor']:
+            cursor_position = next(
+                (n for n, i in enumerate(matched) if rows[i]['symbol'] == query['cursor']), None
+            )
+            if cursor_position is None:
+                raise ValueError('cursor 已失效（该币种不在当前结果中），请从第一页重新获取')
+            start += cursor_position + 1
+        limit = query['limit']
+        page = matched[start:start + limit] if limit else matched[start:]
+        more = start + len(page) < len(matched)
+
+        fields = query['fields']
+        if fields and rows:
+            unknown = [field for field in fields if field not in rows[0]]
+            if unknown:
+                raise ValueError(f"未知字段: {', '.join(unknown)}")
+        summary = [
+            {field: rows[i][field] for field in fields} if fields else rows[i]
+            for i in page
+        ]
+
+        with JSON_SERIALIZE_SECONDS.time('data_query' if fmt == 'json' else f'data_query_{fmt}'):
+            body = encode_payload({
+                'summary': summary,
+                'stats': self.stats,
+                'version': self.version,
+                'total': len(matched),  # 过滤后的总行数（分页前）
+                'offset': start,
+                'next_cursor': rows[page[-1]]['symbol'] if page and more else None,
+            }, fmt)
+        self._cache_body(key, body)
+        return body
+
+    def sse_snapshot(self):
+        """完整快照的 SSE 事件（字节）"""
+        if self._sse_snapshot is None:
+            with JSON_SERIALIZE_SECONDS.time('sse_snapshot'):
+                self._sse_snapshot = _sse_event('snapshot', self.version, {
+                    'version': self.version,
+                    'summary': list(self.rows),
+                    'stats': self.stats,
+                })
+        return self._sse_snapshot
+
+    def sse_delta(self):
+        """相对 base_version 的增量 SSE 事件（字节）：变化/新增的行、删除的币种，以及排序变化"""
+        if self._sse_delta is None:
+            changes = self.changes
+            with JSON_SERIALIZE_SECONDS.time('sse_delta'):
+                self._sse_delta = _sse_event('delta', self.version, {
+                    'version': self.version,
+                    'base_version': self.base_version,
+                    'upserts': [self.by_symbol[symbol] for symbol in changes.added + list(changes.changed)],
+                    'removed': changes.removed,
+                    # None 表示排序未变
+                    'order': [row['symbol'] for row in self.rows] if changes.order_changed else None,
+                    'stats': self.stats,
+                })
+        return self._sse_delta
+
+    def changes_body(self, since, history):
+        """/api/changes 的响应体：合并 since 之后的所有变更集，同一 since 只计算一次
+
+        Args:
+            since: 客户端已有的版本号
+            history: 按版本递增排列的最近变更集
+        """
+        body = self._changes_bodies.get(since)
+        if body is not None:
+            return body
+
+        if since == self.version:
+            result = {'since': since, 'version': self.version, 'reset': False,
+                      'added': [], 'removed': [], 'changed': {}, 'level_changes': []}
+        elif not history or since < history[0].base_version or since > self.version:
+            # 变更集已移出缓冲区（或版本号无效），客户端需要重新拉取 /api/data
+            result = {'since': since, 'version': self.version, 'reset': True}
+        else:
+            # readded：since 时已存在、中途删除后又重新出现的币种，对客户端而言不是新增，按所有字段变化返回
+            added, removed, readded, changed, level_changes = set(), set(), set(), {}, []
+            start = bisect.bisect_right(history, since, key=lambda changes: changes.version)
+            for changes in islice(history, start, None):
+                for symbol in changes.removed:
+                    if symbol in added:
+                        added.discard(symbol)
+                    else:
+                        readded.discard(symbol)
+                        removed.add(symbol)
+                    changed.pop(symbol, None)
+                for symbol in changes.added:
+                    if symbol in removed:
+                        removed.discard(symbol)
+                        readded.add(symbol)
+                    else:
+                        added.add(symbol)
+                    changed.pop(symbol, None)
+                for symbol, fields in changes.changed.items():
+                    if symbol not in added and symbol not in readded:
+                        changed.setdefault(symbol, {}).update(fields)
+            for symbol in readded:
+                changed[symbol] = {
+                    field: value for field, value in self.by_symbol[symbol].items() if field != 'symbol'
+                }
+                level_changes.extend(
+                    dict(change, version=changes.version) for change in changes.level_changes
+                )
+            result = {
+                'since': since,
+                'version': self.version,
+                'reset': False,
+                'added': [self.by_symbol[symbol] for symbol in sorted(added)],
+                'removed': sorted(removed),
+                'changed': changed,
+                'level_changes': level_changes,
+            }
+
+        with JSON_SERIALIZE_SECONDS.time('changes'):
+            body = json.dumps(result).encode('utf-8')
+        if len(self._changes_bodies) < DATA_BODY_CACHE_SIZE:
+            self._changes_bodies[since] = body
+        return body
+
+class SharedSummarySnapshot(SummarySnapshot):
+    """其它进程发布的快照（多进程部署的 Web 工作进程使用）
+
+    完整响应体和变更集都取自获取进程：完整数据请求和 304 直接返回发布的字节，
+    只有查询、推送、/api/changes 等需要逐行数据时才解析响应体（每个版本一次）。
+
+    Args:
+        version: 数据版本号
+        body: 该版本 /api/data 的完整 JSON 响应体
+        changes: 获取进程计算的 ChangeSet
+        etag_prefix: ETag 前缀（fork 自同一个主进程，各进程相同）
+    """
+
+    def __init__(self, version, body, changes, etag_prefix):
+        self.version = version
+        self.etag = f'"{etag_prefix}-{version}"'
+        self._bodies = {(None, 'json'): body}
+        self._compressed = {}
+        self._sort_indexes = {}
+        self._neg_abs_diffs = None
+        self._sse_snapshot = None
+        self._changes_bodies = {}
+        self._payload = None
+        self.base_version = changes.base_version
+        self.changes = changes
+        self._sse_delta = None
+
+    def _parsed(self):
+        if self._payload is None:
+            payload = json.loads(self._bodies[(None, 'json')])
+            rows = tuple(payload['summary'])
+            self._payload = (rows, {row['symbol']: row for row in rows}, payload['stats'])
+        return self._payload
+
+    @property
+    def rows(self):
+        return self._parsed()[0]
+
+    @property
+    def by_symbol(self):
+        return self._parsed()[1]
+
+    @property
+    def stats(self):
+        return self._parsed()[2]
+
+def _sse_event(event, event_id, data):
+    """编码一个 Server-Sent Events 事件"""
+    return f'event: {event}\nid: {event_id}\ndata: {json.dumps(data)}\n\n'.encode('utf-8')
+
+class SymbolRegistry:
+    """标准币种名与各交易所原生币种名的双向映射
+
+    存储和前端只使用标准币种名，适配器在获取数据时转换为标准名，显示时再转换回原生名。
+
+    Args:
+        aliases: {交易所: {原生币种名: 标准币种名}}，未列出的币种两边同名
+    """
+
+    def __init__(self, aliases=None):
+        self._to_canonical = {}
+        self._to_native = {}
+        for exchange, mapping in (aliases or {}).items():
+            for native, canonical in mapping.items():
+                self.register(exchange, native, canonical)
+
+    def register(self, exchange, native, canonical):
+        """登记一个别名"""
+        self._to_canonical.setdefault(exchange, {})[native] = canonical
+        self._to_native.setdefault(exchange, {})[canonical] = native
+
+    def canonical(self, exchange, native):
+        """原生币种名 -> 标准币种名"""
+        return self._to_canonical.get(exchange, {}).get(native, native)
+
+    def native(self, exchange, canonical):
+        """标准币种名 -> 原生币种名"""
+        return self._to_native.get(exchange, {}).get(canonical, canonical)
+
+symbol_registry = SymbolRegistry(SYMBOL_ALIASES)
+
 class FundingRateStore:
     def __init__(self):
-        self.var_funding_rates = {}
-        self.var_funding_intervals = {}  # 新增：存储资金费间隔
-        self.var_prices = {}
+        # 各交易所的列式数据（每个结算周期的费率、结算间隔、价格），行为标准币种名
+        self.tables = {}                 # {交易所: ExchangeTable}，主交易所以有资金费率的币种为行
+        self.stale_symbols = {}          # {交易所: 本轮未按时获取、沿用上次费率的币种}
+        self.fetched_at = {}             # {交易所: 价格数据获取时间戳（秒）}
 
-        # BP 数据 - 新增资金费率和间隔
-        self.bpx_prices = {}
-        self.bpx_funding_rates = {}      # 新增
-        self.bpx_funding_intervals = {}  # 新增
+        # 主交易所行 -> 各交易所行的连接索引（-1 表示该交易所没有该币种），币种集合变化时才重建
+        self._joins = {}                 # {交易所: (两边的币种元组, 连接索引)}
 
         self.symbols = []
         self.start_time = datetime.now()
         self.update_count = 0
         self.last_update = None
+        self.last_cycle_ms = None        # 最近一轮更新耗时（毫秒）
+
+        # 数据版本号和对应快照，ETag 前缀区分不同进程实例
+        self.version = 0
+        self._etag_prefix = format(int(time.time()), 'x')
+        self.snapshot = SummarySnapshot(0, [], self.get_stats(), self._etag_prefix)
+        self._subscribers = set()  # 推送订阅者的队列
+        self._listeners = []       # 每个新版本同步调用的回调（如告警引擎）
+        self.depth = None          # 盘口深度（DepthTracker），None 表示未启用
+        self.changes = deque(maxlen=CHANGES_BUFFER_MAX)  # 最近 CHANGES_RETENTION 秒的变更集
+
+    def table(self, exchange):
+        """某个交易所的数据表，没有数据时为空表"""
+        return self.tables.get(exchange, _EMPTY_TABLE)
+
+    def update_data(self, exchange_data, cycle_ms=None):
+        """更新所有数据，并构建新版本的快照
+
+        所有交易所的数据在同一次调用中一起替换，保证前端看到的是同一轮的快照。
+        数据与当前版本完全相同时不生成新版本：ETag 不变，If-None-Match 请求可以返回 304，
+        推送也不会发送空的增量。
+
+        Args:
+            exchange_data: {交易所: 适配器返回的数据}，值为 None 表示本轮未按时获取，保留上次数据
+            cycle_ms: 本轮获取耗时（毫秒）
+        """
+        update_start = time.perf_counter()
+        changed = False
+        for exchange, data in exchange_data.items():
+            if data is None:
+                continue
+            previous = self.table(exchange)
 
-    def update_data(self, var_data, bpx_data):
-        """更新所有数据"""
-        self.var_funding_rates = var_data.get('funding_rates', {})
-        self.var_funding_intervals = var_data.get('funding_intervals', {})  # 新增
-        self.var_prices = var_data.get('prices', {})
+            # 未按时获取的币种沿用上次的费率，并标记为过期
+            funding_rates = dict(data.get('funding_rates', {}))
+            stale_symbols = set()
+            for symbol in data.get('stale_symbols', []):
+                if symbol not in funding_rates and symbol in previous.index:
+                    funding_rates[symbol] = previous.get(symbol, 'funding')
+                if symbol in funding_rates:
+                    stale_symbols.add(symbol)
+            changed |= stale_symbols != self.stale_symbols.get(exchange, set())
+            self.stale_symbols[exchange] = stale_symbols
 
-        # BP 数据 - 更新所有三个字典
-        self.bpx_prices = bpx_data.get('prices', {})
-        self.bpx_funding_rates = bpx_data.get('funding_rates', {})
-        self.bpx_funding_intervals = bpx_data.get('funding_intervals', {})
+            fields = {
+                'funding': funding_rates,
+                'interval': data.get('funding_intervals', {}),
+                'price': data.get('prices', {}),
+            }
+            # 主交易所的币种列表以有资金费率的币种为基准
+            symbols = sorted(funding_rates) if exchange == PRIMARY_EXCHANGE else None
+            table = ExchangeTable.from_fields(fields, symbols=symbols)
+            if not table.same_as(previous):
+                self.tables[exchange] = table
+                changed = True
+            self.fetched_at[exchange] = data.get('fetched_at')
 
-        # 更新币种列表（改为以BP有资金费率的币种为基准）
-        self.symbols = sorted(self.bpx_funding_rates.keys())
+        self.symbols = list(self.table(PRIMARY_EXCHANGE).symbols)
 
         self.update_count += 1
         self.last_update = datetime.now()
+        if cycle_ms is not None:
+            self.last_cycle_ms = round(cycle_ms)
+        # 交易所变为过期或恢复时也要生成新版本（页面据此显示提示）
+        changed |= set(self._stale_exchanges(time.time())) != set(self.snapshot.stats.get('stale_exchanges', ()))
+        if changed or self.version == 0:
+            self._commit(update_start, 'update_data')
+            return
+
+        # 数据未变化：沿用当前版本，监听器仍以当前快照调用一次（告警的连续周期按更新周期计数）
+        for listener in self._listeners:
+            try:
+                listener(self.snapshot, self.update_count)
+            except Exception as e:
+                log_event('listener_error', f"数据更新回调出错: {e}", logging.ERROR, exc_info=e)
+        LAST_UPDATE_TIMESTAMP.set(time.time())
+        STORE_OPERATION_SECONDS.observe(time.perf_counter() - update_start, 'update_data')
+
+    def update_prices(self, exchange, prices, fetched_at):
+        """只更新某个交易所的价格（推送行情合并后的一批），费率和其它数据不变
+
+        Args:
+            exchange: 交易所
+            prices: {标准币种名: 最新价}
+            fetched_at: 收到这批行情的时间戳
+
+        Returns:
+            bool: 是否有价格变化（有变化时生成新版本）
+        """
+        update_start = time.perf_counter()
+        current = self.table(exchange)
+        table = current.with_values('price', prices)
+        if table is current:
+            return False
+        self.tables[exchange] = table
+        self.fetched_at[exchange] = fetched_at
+        self.last_update = datetime.now()
+        self._commit(update_start, 'update_prices')
+        return True
+
+    def _commit(self, update_start, operation):
+        """生成新版本的快照并通知订阅者"""
+        # 每个数据版本只计算、排序一次
+        self.version += 1
+        with STORE_OPERATION_SECONDS.time('build_summary'):
+            summary = self._build_summary()
+        stats = self.get_stats()
+        self.snapshot = SummarySnapshot(
+            self.version, summary, stats, self._etag_prefix, previous=self.snapshot
+        )
+        self._append_changes(self.snapshot.changes)
+        self._publish(self.snapshot)
+        for listener in self._listeners:
+            try:
+                listener(self.snapshot, self.update_count)
+            except Exception as e:
+                log_event('listener_error', f"数据更新回调出错: {e}", logging.ERROR, exc_info=e)
+
+        DATA_VERSION.set(self.version)
+        SYMBOLS.set(len(summary))
+        STALE_SYMBOLS.set(len(self.stale_symbols.get(PRIMARY_EXCHANGE, ())))
+        LAST_UPDATE_TIMESTAMP.set(time.time())
+        LEG_SKEW_SECONDS.set(stats['leg_skew_ms'] / 1000 if stats['leg_skew_ms'] is not None else None)
+        STORE_OPERATION_SECONDS.observe(time.perf_counter() - update_start, operation)
+
+    def update_depth(self):
+        """盘口深度变化后生成新版本（各交易所数据不变）"""
+        self._commit(time.perf_counter(), 'update_depth')
+
+    def load_snapshot(self, version, body, tables=None, fetched_at=None):
+        """载入保存的快照（快照检查点使用）
+
+        同时载入各交易所的列式数据和获取时间：重启后某个交易所获取失败时，汇总仍基于保存时的数据
+        计算（该交易所按获取时间标记为过期），而不是从空表重建。主交易所的所有币种标记为过期，
+        直到该交易所第一次获取成功。
+
+        Args:
+            version: 数据版本号
+            body: 该版本 /api/data 的完整 JSON 响应体，直接作为本进程的响应体缓存
+            tables: {交易所: ExchangeTable}，None 表示检查点中没有保存（旧格式）
+            fetched_at: {交易所: 获取时间戳}
+        """
+        update_start = time.perf_counter()
+        payload = json.loads(body)
+        if tables:
+            self.tables = dict(tables)
+            self.fetched_at = dict(fetched_at or {})
+            self.symbols = list(self.table(PRIMARY_EXCHANGE).symbols)
+            self.stale_symbols[PRIMARY_EXCHANGE] = set(self.symbols)
+        self.version = version
+        self.snapshot = SummarySnapshot(
+            version, payload['summary'], payload['stats'], self._etag_prefix, previous=self.snapshot
+        )
+        self.snapshot._cache_body((None, 'json'), body)
+        self._append_changes(self.snapshot.changes)
+        self._publish(self.snapshot)
+
+        DATA_VERSION.set(version)
+        SYMBOLS.set(len(self.snapshot.rows))
+        STORE_OPERATION_SECONDS.observe(time.perf_counter() - update_start, 'load_snapshot')
+
+    def load_shared(self, version, body, changes):
+        """载入获取进程发布的版本（多进程部署的 Web 工作进程使用），不解析响应体、不重新计算变更集
+
+        Args:
+            version: 数据版本号
+            body: 该版本 /api/data 的完整 JSON 响应体
+            changes: 该版本相对上一个发布版本的 ChangeSet
+        """
+        update_start = time.perf_counter()
+        if changes.base_version != self.version:
+            self.changes.clear()  # 错过了中间的版本，之前的变更集与之后的不再连续
+        self.version = version
+        self.snapshot = SharedSummarySnapshot(version, body, changes, self._etag_prefix)
+        self._append_changes(changes)
+        self._publish(self.snapshot)
+
+        DATA_VERSION.set(version)
+        STORE_OPERATION_SECONDS.observe(time.perf_counter() - update_start, 'load_shared')
+
+    def _append_changes(self, changes):
+        """记录新版本的变更集，并移除超过 CHANGES_RETENTION 秒的旧变更集"""
+        self.changes.append(changes)
+        expire_before = changes.created_at - CHANGES_RETENTION
+        while self.changes[0].created_at < expire_before:
+            self.changes.popleft()
+
+    def add_listener(self, callback):
+        """注册新版本回调，callback(snapshot, update_count) 在生成每个新版本时同步调用；
+        数据未变化的更新周期也会以当前快照调用一次（snapshot.version 与上次相同）
+
+        回调在数据更新路径上执行，只应做与变更集大小成正比的少量工作。重复注册同一个回调不会重复调用。
+        """
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def subscribe(self):
+        """订阅新版本快照，返回一个接收 SummarySnapshot 的队列"""
+        subscriber = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self._subscribers.add(subscriber)
+        STREAM_SUBSCRIBERS.set(len(self._subscribers))
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """取消订阅"""
+        self._subscribers.discard(subscriber)
+        STREAM_SUBSCRIBERS.set(len(self._subscribers))
+
+    def _publish(self, snapshot):
+        """通知所有订阅者；积压过多的订阅者丢弃最旧版本，之后会收到完整快照"""
+        for subscriber in self._subscribers:
+            if subscriber.full():
+                subscriber.get_nowait()
+            subscriber.put_nowait(snapshot)
 
     def _generate_recommendation(self, funding_rate_diff):
         """根据费率差生成套利推荐
 
         Args:
-            funding_rate_diff: 费率差（VAR - BP）
+            funding_rate_diff: 标准化后的每小时费率差（VAR - BP，%）
 
         Returns:
             dict: {
@@ -78,530 +1359,2235 @@ class FundingRateStore:
                 'class': CSS类名
             }
         """
-        abs_diff = abs(funding_rate_diff)
+        level = bisect.bisect_right(RECOMMENDATION_THRESHOLDS, abs(funding_rate_diff))
+        return _RECOMMENDATIONS[(level, funding_rate_diff > 0)]
 
-        # 无机会
-        if abs_diff < 0.005:
-            return {
-                'level': 0,
-                'text': '- 无机会',
-                'direction': '',
-                'class': 'rec-none'
-            }
-
-        # 确定方向
-        if funding_rate_diff > 0:
-            direction = 'VAR空/BP多'
-        else:
-            direction = 'BP空/VAR多'
+    def get_summary(self, limit=None):
+        """获取汇总数据（来自当前版本的快照），按费率差绝对值排序"""
+        with STORE_OPERATION_SECONDS.time('get_summary'):
+            rows = self.snapshot.rows
+            # 如果指定了limit，返回前N个，否则返回全部
+            return list(rows[:limit] if limit else rows)
 
-        # 一般机会
-        if abs_diff < 0.01:
-            return {
-                'level': 1,
-                'text': f'✓ 可考虑 {direction}',
-                'direction': direction,
-                'class': 'rec-normal'
-            }
+    def _join(self, exchange):
+        """返回主交易所行 -> 该交易所行的连接索引"""
+        primary, other = self.table(PRIMARY_EXCHANGE), self.table(exchange)
+        key = (primary.symbols, other.symbols)
+        cached = self._joins.get(exchange)
+        if cached is None or cached[0] != key:
+            index = other.index
+            cached = self._joins[exchange] = (key, array('q', (index.get(s, -1) for s in primary.symbols)))
+        return cached[1]
 
-        # 好机会
-        if abs_diff < 0.02:
-            return {
-                'level': 2,
-                'text': f'⭐ 推荐 {direction}',
-                'direction': direction,
-                'class': 'rec-good'
-            }
+    def _build_summary(self):
+        """计算汇总数据，显示主交易所（BP）支持的所有币种，按标准化后的每小时费率差绝对值排序"""
+        bpx = self.table(PRIMARY_EXCHANGE)
 
-        # 极佳机会
-        return {
-            'level': 3,
-            'text': f'🔥 强烈推荐 {direction}',
-            'direction': direction,
-            'class': 'rec-excellent'
-        }
+        # 1. 只保留BP有完整数据的币种，跳过黑名单中的币种
+        bpx_price_column = bpx.columns['price']
+        bpx_funding_column = bpx.columns['funding']
+        mask = [
+            price > 0 and funding != 0 and symbol not in SYMBOL_BLACKLIST
+            for symbol, price, funding in zip(bpx.symbols, bpx_price_column, bpx_funding_column)
+        ]
 
-    def get_summary(self, limit=None):
-        """获取汇总数据，显示所有BP支持的币种，按费率差绝对值排序"""
-        summary = []
+        def select(column):
+            return list(compress(column, mask))
 
-        # 遍历BP的币种（self.symbols现在是BP的币种列表）
-        for symbol in self.symbols:
-            bpx_price = self.bpx_prices.get(symbol, 0)
-            bpx_funding = self.bpx_funding_rates.get(symbol, 0)
-            bpx_interval = self.bpx_funding_intervals.get(symbol, 0)
+        def gather(exchange, name, missing=0):
+            column = self.table(exchange).columns[name]
+            return select(column[j] if j >= 0 else missing for j in self._join(exchange))
 
-            # 获取VAR对应的币种名（使用映射）
-            var_symbol = BPX_TO_VAR_SYMBOL_MAP.get(symbol, symbol)
-            var_funding = self.var_funding_rates.get(var_symbol, 0)
-            var_interval = self.var_funding_intervals.get(var_symbol, 0)
-            var_price = self.var_prices.get(var_symbol, 0)
+        symbols = select(bpx.symbols)
+        var_symbols = [symbol_registry.native(COMPARE_EXCHANGE, symbol) for symbol in symbols]
+        var_funding = gather(COMPARE_EXCHANGE, 'funding')
+        var_interval = gather(COMPARE_EXCHANGE, 'interval')
+        var_price = gather(COMPARE_EXCHANGE, 'price')
+        bpx_funding, bpx_price = select(bpx_funding_column), select(bpx_price_column)
+        bpx_interval = select(bpx.columns['interval'])
 
-            # 只保留BP有完整数据的币种
-            if not (bpx_price > 0 and bpx_funding != 0):
-                continue
+        # 2. 整列计算：费率统一单位、价格差异
+        normalized = normalize_funding(var_funding, var_interval, bpx_funding, bpx_interval)
+        price_spread = [
+            (bp_price - v_price) / v_price * 100 if v_price > 0 and bp_price > 0 else 0
+            for v_price, bp_price in zip(var_price, bpx_price)
+        ]
 
-            # 跳过黑名单中的币种
-            if symbol in SYMBOL_BLACKLIST:
+        # 3. 所有交易所的每小时费率（缺失为 None），整列求每个币种的最优多空组合
+        exchanges = [exchange for exchange in ENABLED_EXCHANGES if exchange in self.tables]
+        hourly_columns = []
+        for exchange in exchanges:
+            if exchange == PRIMARY_EXCHANGE:
+                hourly_columns.append(normalized['bpx_hourly'])
                 continue
+            present = gather(exchange, 'price', missing=None)
+            hourly = to_hourly(gather(exchange, 'funding'), gather(exchange, 'interval'))
+            hourly_columns.append([
+                rate if price is not None and rate != 0 else None
+                for rate, price in zip(hourly, present)
+            ])
+        pairs = best_funding_pairs(hourly_columns)
 
-            # 计算价格差异
-            price_spread = 0
-            if var_price > 0 and bpx_price > 0:
-                price_spread = (bpx_price - var_price) / var_price * 100
-
-            # 计算资金费率差（每小时）
-            funding_rate_diff = var_funding - bpx_funding
-
-            # 生成套利推荐
-            recommendation = self._generate_recommendation(funding_rate_diff)
+        # 4. 推荐等级（整列分级），按费率差绝对值排序（从大到小）
+        diff_hourly = normalized['diff_hourly']
+        levels = [bisect.bisect_right(RECOMMENDATION_THRESHOLDS, abs(d)) for d in diff_hourly]
+        order = sorted(range(len(symbols)), key=lambda i: abs(diff_hourly[i]), reverse=True)
 
+        # 5. 按排序后的顺序组装行
+        stale_symbols = self.stale_symbols.get(PRIMARY_EXCHANGE, set())
+        depth = self.depth
+        summary = []
+        for i in order:
+            symbol = symbols[i]
+            funding_rate_diff = diff_hourly[i]
+            pair = pairs[i]
             summary.append({
                 'symbol': symbol,
-                'var_symbol': var_symbol,  # 添加VAR币种名，用于显示
-                'var_funding': var_funding,
-                'var_interval': var_interval,
-                'var_price': var_price,
-                'bpx_price': bpx_price,
-                'bpx_funding': bpx_funding,
-                'bpx_interval': bpx_interval,
-                'price_spread': price_spread,
-                'funding_rate_diff': funding_rate_diff,
-                'recommendation': recommendation,  # 新增：推荐信息
+                'var_symbol': var_symbols[i],  # 添加VAR币种名，用于显示
+                'var_funding': normalized['var_hourly'][i],  # VAR每小时费率
+                'var_interval': var_interval[i],
+                'var_funding_settlement': var_funding[i],  # VAR每个结算周期的费率
+                'var_price': var_price[i],
+                'bpx_price': bpx_price[i],
+                'bpx_funding': bpx_funding[i],  # BP原始费率（每个结算周期）
+                'bpx_interval': bpx_interval[i],
+                'var_funding_hourly': normalized['var_hourly'][i],
+                'bpx_funding_hourly': normalized['bpx_hourly'][i],
+                'var_funding_8h': normalized['var_8h'][i],
+                'bpx_funding_8h': normalized['bpx_8h'][i],
+                'var_funding_apr': normalized['var_apr'][i],
+                'bpx_funding_apr': normalized['bpx_apr'][i],
+                'price_spread': price_spread[i],
+                'funding_rate_diff': funding_rate_diff,  # 每小时费率差（已统一单位）
+                'funding_diff_8h': normalized['diff_8h'][i],
+                'funding_diff_apr': normalized['diff_apr'][i],
+                'recommendation': _RECOMMENDATIONS[(levels[i], funding_rate_diff > 0)],  # 新增：推荐信息
+                'funding_hourly_by_exchange': {
+                    exchange: column[i]
+                    for exchange, column in zip(exchanges, hourly_columns) if column[i] is not None
+                },
+                'best_pair': {
+                    'short': exchanges[pair[0]],  # 费率最高的交易所做空（收资金费）
+                    'long': exchanges[pair[1]],   # 费率最低的交易所做多
+                    'diff_hourly': pair[2],
+                    'diff_8h': pair[2] * 8,
+                    'diff_apr': pair[2] * HOURS_PER_YEAR,
+                } if pair is not None else None,
                 'has_bpx_price': True,
                 'has_bpx_funding': True,
-                'has_var_data': var_price > 0 and var_funding != 0  # 标记是否有VAR数据
+                'bpx_funding_stale': symbol in stale_symbols,  # 费率为上次数据
+                'has_var_data': var_price[i] > 0 and var_funding[i] != 0,  # 标记是否有VAR数据
+                # BP 一侧按目标名义金额的可成交情况（只有跟踪订单簿的币种有）
+                'depth': depth.describe(symbol, var_price[i], funding_rate_diff > 0) if depth is not None else None,
             })
 
-        # 按资金费率差的绝对值排序（从大到小）
-        summary.sort(key=lambda x: abs(x['funding_rate_diff']), reverse=True)
-
-        # 如果指定了limit，返回前N个，否则返回全部
-        if limit:
-            return summary[:limit]
         return summary
 
     def get_stats(self):
         """获取统计信息"""
         runtime = (datetime.now() - self.start_time).total_seconds()
+        bpx, var = self.table(PRIMARY_EXCHANGE), self.table(COMPARE_EXCHANGE)
 
         # 统计有BPX价格的币种数量（排除黑名单）
-        common_count = len([s for s in self.symbols
-                           if self.bpx_prices.get(s, 0) > 0
-                           and s not in SYMBOL_BLACKLIST])
+        common_count = sum(
+            1 for symbol, price in zip(bpx.symbols, bpx.columns['price'])
+            if price > 0 and symbol not in SYMBOL_BLACKLIST
+        )
+
+        # 统计高资金费率币种（VAR每小时费率）
+        high_funding = sum(
+            1 for f in to_hourly(var.columns['funding'], var.columns['interval']) if abs(f) > 0.01
+        )
 
-        # 统计高资金费率币种
-        high_funding = len([f for f in self.var_funding_rates.values() if abs(f) > 0.01])
+        # 各交易所价格快照的最大时间差（毫秒），影响 price_spread 的可信度
+        fetched = [ts for ts in self.fetched_at.values() if ts]
+        leg_skew_ms = None
+        if len(fetched) >= 2:
+            leg_skew_ms = round((max(fetched) - min(fetched)) * 1000)
 
         return {
             'total_symbols': len(self.symbols),
             'common_count': common_count,
             'high_funding_count': high_funding,
             'update_count': self.update_count,
+            'stale_count': len(self.stale_symbols.get(PRIMARY_EXCHANGE, ())),
+            'last_cycle_ms': self.last_cycle_ms,
+            'var_fetched_at': self.fetched_at.get(COMPARE_EXCHANGE),
+            'bpx_fetched_at': self.fetched_at.get(PRIMARY_EXCHANGE),
+            'exchanges': {
+                exchange: {'symbols': len(table), 'fetched_at': self.fetched_at.get(exchange)}
+                for exchange, table in self.tables.items()
+            },
+            'leg_skew_ms': leg_skew_ms,
+            'stale_exchanges': self._stale_exchanges(time.time()),
             'runtime': int(runtime),
             'last_update': self.last_update.strftime('%H:%M:%S') if self.last_update else '-'
         }
 
-# 全局存储
-store = FundingRateStore()
+    def _stale_exchanges(self, now):
+        """获取失败时沿用上次数据；太久未成功更新的交易所标记为过期（交易所显示名 -> 秒数）"""
+        return {
+            EXCHANGE_LABELS.get(exchange, exchange): round(now - fetched_at)
+            for exchange, fetched_at in self.fetched_at.items()
+            if fetched_at and now - fetched_at > EXCHANGE_STALE_AFTER
+        }
 
-# ==================== 数据获取 ====================
-async def fetch_var_funding_rates():
-    """获取VAR交易所的资金费率"""
-    try:
-        async with aiohttp.ClientSession() as session:
-            # VAR API 不需要代理
-            async with session.get(VAR_STATS_API, timeout=15) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    funding_rates = {}
-                    funding_intervals = {}  # 新增
-                    prices = {}
-
-                    if 'listings' in data:
-                        for listing in data['listings']:
-                            ticker = listing.get('ticker', '')
-                            funding_rate = float(listing.get('funding_rate', 0))
-                            funding_interval_s = int(listing.get('funding_interval_s', 3600))
-                            mark_price = float(listing.get('mark_price', 0))
-
-                            if ticker:
-                                # funding_rate是年化费率（小数格式）
-                                # 例如：BTC funding_rate=0.1095 表示年化10.95%
-                                # 需要转换为每小时费率
-
-                                # 年化费率转换为百分比
-                                annual_rate_percent = funding_rate * 100
-
-                                # 一年的小时数
-                                hours_per_year = 365 * 24
-
-                                # 每小时费率 = 年化费率 / 一年的小时数
-                                hourly_rate = annual_rate_percent / hours_per_year
-
-                                funding_rates[ticker] = hourly_rate
-                                funding_intervals[ticker] = funding_interval_s  # 新增：保存间隔
-                                prices[ticker] = mark_price
-
-                    return {
-                        'funding_rates': funding_rates,
-                        'funding_intervals': funding_intervals,  # 新增
-                        'prices': prices,
-                        'success': True
-                    }
-                else:
-                    print(f"VAR API错误: HTTP {response.status}")
-                    return {'funding_rates': {}, 'prices': {}, 'success': False}
+def _build_recommendations():
+    """预先生成所有 (等级, 方向) 组合的推荐信息"""
+    recommendations = {}
+    for positive in (True, False):
+        # 确定方向
+        direction = 'VAR空/BP多' if positive else 'BP空/VAR多'
+        recommendations[(0, positive)] = {
+            'level': 0, 'text': '- 无机会', 'direction': '', 'class': 'rec-none'
+        }
+        recommendations[(1, positive)] = {
+            'level': 1, 'text': f'✓ 可考虑 {direction}', 'direction': direction, 'class': 'rec-normal'
+        }
+        recommendations[(2, positive)] = {
+            'level': 2, 'text': f'⭐ 推荐 {direction}', 'direction': direction, 'class': 'rec-good'
+        }
+        recommendations[(3, positive)] = {
+            'level': 3, 'text': f'🔥 强烈推荐 {direction}', 'direction': direction, 'class': 'rec-excellent'
+        }
+    return recommendations
 
-    except Exception as e:
-        print(f"VAR获取失败: {e}")
-        return {'funding_rates': {}, 'prices': {}, 'success': False}
+_RECOMMENDATIONS = _build_recommendations()
 
-async def fetch_bpx_funding_rates(var_symbols=None):
-    """获取Backpack交易所的资金费率、价格和结算间隔
+# 全局存储
+store = FundingRateStore()
 
-    Args:
-        var_symbols: VAR交易所的币种列表，用于只获取这些币种的资金费率
+# ==================== 历史数据 ====================
+# 每个样本记录的字段（来自 get_summary 的行）
+# var_funding 是每小时费率，bpx_funding 是 BP 原始费率（每个结算周期）；与 var_funding 同单位比较时
+# 使用 bpx_funding_hourly
+HISTORY_SAMPLE_FIELDS = (
+    'var_funding', 'bpx_funding', 'var_interval', 'bpx_interval',
+    'var_price', 'bpx_price', 'price_spread', 'funding_rate_diff', 'bpx_funding_hourly',
+)
+# 降采样表中按 min/max/sum/last 聚合的字段
+HISTORY_METRIC_FIELDS = (
+    'funding_rate_diff', 'price_spread', 'var_funding', 'bpx_funding', 'var_price', 'bpx_price',
+    'bpx_funding_hourly',
+)
+# /api/history 返回的聚合字段
+HISTORY_QUERY_FIELDS = ('funding_rate_diff', 'price_spread', 'var_funding', 'bpx_funding', 'bpx_funding_hourly')
+# 降采样层级：(表名, 桶宽秒数)
+HISTORY_TIERS = (
+    ('samples_1m', 60),
+    ('samples_1h', 3600),
+    ('samples_1d', 86400),
+)
+
+def _history_schema():
+    """生成历史库建表语句"""
+    statements = [
+        'CREATE TABLE IF NOT EXISTS samples ('
+        'symbol TEXT NOT NULL, ts INTEGER NOT NULL, '
+        'var_funding REAL, bpx_funding REAL, var_interval INTEGER, bpx_interval INTEGER, '
+        'var_price REAL, bpx_price REAL, price_spread REAL, funding_rate_diff REAL, bpx_funding_hourly REAL, '
+        'PRIMARY KEY (symbol, ts)) WITHOUT ROWID'
+    ]
+    metric_columns = ', '.join(
+        f'{field}_min REAL, {field}_max REAL, {field}_sum REAL, {field}_last REAL'
+        for field in HISTORY_METRIC_FIELDS
+    )
+    for table, _ in HISTORY_TIERS:
+        statements.append(
+            f'CREATE TABLE IF NOT EXISTS {table} ('
+            f'symbol TEXT NOT NULL, ts INTEGER NOT NULL, n INTEGER NOT NULL, {metric_columns}, '
+            f'var_interval INTEGER, bpx_interval INTEGER, '
+            f'PRIMARY KEY (symbol, ts)) WITHOUT ROWID'
+        )
+    return statements
+
+def _history_migrate(conn):
+    """给旧版本创建的历史库补上 bpx_funding_hourly 列，并由已有数据回填
+
+    原始样本按 bpx_funding 和 bpx_interval 折算；降采样表的 min/max/sum/last 按桶内最后的结算间隔折算
+    （同一币种的结算间隔极少变化），与 to_hourly 的规则相同。
     """
-    try:
-        async with aiohttp.ClientSession() as session:
-            # 1. 获取市场信息（结算间隔）- Backpack 需要代理
-            async with session.get(
-                "https://api.backpack.exchange/api/v1/markets",
-                timeout=10,
-                proxy=PROXY_URL
-            ) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    prices = {}
-                    funding_rates = {}
-                    funding_intervals = {}
-                    perp_symbols = {}  # 改为字典，key是base，value是完整symbol
-
-                    if isinstance(data, list):
-                        for market in data:
-                            symbol = market.get('symbol', '')
-
-                            if '_USDC_PERP' in symbol:
-                                base = symbol.split('_')[0]
-                                perp_symbols[base] = symbol
-
-                                # 获取结算间隔（毫秒转秒）
-                                funding_interval_ms = market.get('fundingInterval', 3600000)
-                                funding_interval_s = funding_interval_ms // 1000 if funding_interval_ms else 3600
-                                funding_intervals[base] = funding_interval_s
-
-                    # 2. 获取价格数据 - Backpack 需要代理
-                    async with session.get(
-                        "https://api.backpack.exchange/api/v1/tickers",
-                        timeout=10,
-                        proxy=PROXY_URL
-                    ) as ticker_response:
-                        if ticker_response.status == 200:
-                            ticker_data = await ticker_response.json()
-                            if isinstance(ticker_data, list):
-                                for ticker in ticker_data:
-                                    symbol = ticker.get('symbol', '')
-                                    if '_USDC_PERP' in symbol:
-                                        base = symbol.split('_')[0]
-                                        last_price = float(ticker.get('lastPrice', 0))
-                                        if last_price > 0:
-                                            prices[base] = last_price
-
-                    # 3. 获取资金费率（只获取VAR中有的币种）
-                    symbols_to_fetch = []
-                    if var_symbols:
-                        # 只获取VAR和BP都有的币种
-                        for base in var_symbols:
-                            if base in perp_symbols:
-                                symbols_to_fetch.append(perp_symbols[base])
-                    else:
-                        # 如果没有提供VAR币种列表，获取所有BP币种（限制50个）
-                        symbols_to_fetch = list(perp_symbols.values())[:50]
-
-                    # 并发获取资金费率 - Backpack 需要代理
-                    for symbol in symbols_to_fetch:
-                        try:
-                            async with session.get(
-                                f"https://api.backpack.exchange/api/v1/fundingRates?symbol={symbol}&limit=1",
-                                timeout=10,
-                                proxy=PROXY_URL
-                            ) as funding_response:
-                                if funding_response.status == 200:
-                                    funding_data = await funding_response.json()
-                                    if isinstance(funding_data, list) and len(funding_data) > 0:
-                                        base = symbol.split('_')[0]
-                                        # 资金费率是小数格式，需要转换为百分比
-                                        # 例如：0.0000125 表示 0.00125%
-                                        funding_rate = float(funding_data[0].get('fundingRate', 0))
-                                        funding_rates[base] = funding_rate * 100  # 转换为百分比
-                        except Exception as e:
-                            # 静默处理单个币种的错误
-                            continue
-
-                    return {
-                        'prices': prices,
-                        'funding_rates': funding_rates,
-                        'funding_intervals': funding_intervals,
-                        'success': True
-                    }
-                else:
-                    print(f"BPX API错误: HTTP {response.status}")
-                    return {
-                        'prices': {},
-                        'funding_rates': {},
-                        'funding_intervals': {},
-                        'success': False
-                    }
-
-    except Exception as e:
-        print(f"BPX获取失败: {e}")
-        return {
-            'prices': {},
-            'funding_rates': {},
-            'funding_intervals': {},
-            'success': False
-        }
+    def hourly(column):
+        return f'CASE WHEN bpx_interval > 0 THEN {column} * 3600.0 / bpx_interval ELSE {column} END'
 
-async def update_funding_rates():
-    """定期更新资金费率数据"""
-    print("\n开始定期更新资金费率...")
+    if 'bpx_funding_hourly' not in {row[1] for row in conn.execute('PRAGMA table_info(samples)')}:
+        conn.execute('ALTER TABLE samples ADD COLUMN bpx_funding_hourly REAL')
+        conn.execute(f'UPDATE samples SET bpx_funding_hourly = {hourly("bpx_funding")}')
+    for table, _ in HISTORY_TIERS:
+        if 'bpx_funding_hourly_min' in {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}:
+            continue
+        suffixes = ('min', 'max', 'sum', 'last')
+        for suffix in suffixes:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN bpx_funding_hourly_{suffix} REAL')
+        conn.execute(f'UPDATE {table} SET ' + ', '.join(
+            f'bpx_funding_hourly_{suffix} = {hourly(f"bpx_funding_{suffix}")}' for suffix in suffixes
+        ))
 
-    while True:
-        try:
-            # 先获取BP数据（不传入币种列表，获取所有BP币种）
-            bpx_data = await fetch_bpx_funding_rates(var_symbols=None)
+def _history_query_sql(table):
+    """生成按 step 分桶的聚合查询
 
-            # 再获取VAR数据（获取所有VAR币种）
-            var_data = await fetch_var_funding_rates()
+    数据源为原始样本表或某一级降采样表，分桶和聚合全部在 SQLite 中完成；
+    每个桶的 last 取桶内时间最晚的一条。参数依次为 (step, step, symbol, from, to)。
+    """
+    if table == 'samples':
+        source_columns = ['1 AS n'] + [
+            f'{field} AS {field}_min, {field} AS {field}_max, '
+            f'{field} AS {field}_sum, {field} AS {field}_last'
+            for field in HISTORY_QUERY_FIELDS
+        ]
+    else:
+        source_columns = ['n'] + [
+            f'{field}_min, {field}_max, {field}_sum, {field}_last'
+            for field in HISTORY_QUERY_FIELDS
+        ]
+    aggregates = ['SUM(n)']
+    for field in HISTORY_QUERY_FIELDS:
+        aggregates += [
+            f'MIN({field}_min)',
+            f'MAX({field}_max)',
+            f'SUM({field}_sum) / SUM(n)',
+            f'MAX(CASE WHEN rn = 1 THEN {field}_last END)',
+        ]
+    return (
+        f'WITH bucketed AS ('
+        f'SELECT (ts / ?) * ? AS bucket, ts, {", ".join(source_columns)} FROM {table} '
+        f'WHERE symbol = ? AND ts >= ? AND ts < ?), '
+        f'ranked AS ('
+        f'SELECT *, ROW_NUMBER() OVER (PARTITION BY bucket ORDER BY ts DESC) AS rn FROM bucketed) '
+        f'SELECT bucket, {", ".join(aggregates)} FROM ranked GROUP BY bucket ORDER BY bucket'
+    )
 
-            # 更新存储
-            store.update_data(var_data, bpx_data)
+def _history_rollup_sql(table):
+    """生成降采样表的增量聚合语句（同一桶内的样本按时间顺序到达）"""
+    columns = ['symbol', 'ts', 'n']
+    updates = ['n = n + 1']
+    for field in HISTORY_METRIC_FIELDS:
+        columns += [f'{field}_min', f'{field}_max', f'{field}_sum', f'{field}_last']
+        updates += [
+            f'{field}_min = MIN({field}_min, excluded.{field}_min)',
+            f'{field}_max = MAX({field}_max, excluded.{field}_max)',
+            f'{field}_sum = {field}_sum + excluded.{field}_sum',
+            f'{field}_last = excluded.{field}_last',
+        ]
+    columns += ['var_interval', 'bpx_interval']
+    updates += ['var_interval = excluded.var_interval', 'bpx_interval = excluded.bpx_interval']
+    placeholders = ', '.join(['?', '?', '1'] + ['?'] * (len(columns) - 3))
+    return (
+        f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders}) '
+        f'ON CONFLICT(symbol, ts) DO UPDATE SET {", ".join(updates)}'
+    )
 
-            if bpx_data['success']:
-                bpx_funding_count = len([r for r in bpx_data.get('funding_rates', {}).values() if r != 0])
-                var_funding_count = len(var_data.get('funding_rates', {}))
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] 数据更新成功 - "
-                      f"BPX: {len(bpx_data.get('prices', {}))} 币种 "
-                      f"(资金费率: {bpx_funding_count} 个), "
-                      f"VAR: {var_funding_count} 币种")
+class HistoryStore:
+    """资金费率历史存储（SQLite，WAL 模式）
 
-        except Exception as e:
-            print(f"更新失败: {e}")
+    每轮数据以一个事务批量写入原始样本表，同时增量维护 1m/1h/1d 降采样表；
+    所有数据库操作都在单独的写线程中执行，不阻塞事件循环。
+    各表按 HISTORY_RETENTION_DAYS 定期清理，进程内存不随历史数据增长。
 
-        # 每30秒更新一次
-        await asyncio.sleep(30)
+    只查询时（多进程部署的 Web 工作进程）不调用 start()：查询连接在第一次查询时以只读方式打开，
+    数据库尚未由写入方创建时查询返回空结果。
+    """
 
-# ==================== Web服务器 ====================
-async def handle_index(request):
-    """主页"""
-    html = """
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>VAR资金费率监控</title>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body {
-            font-family: 'Monaco', 'Menlo', 'Consolas', monospace;
-            background: linear-gradient(135deg, #0a0e27 0%, #1a1f3a 100%);
-            color: #e0e0e0;
-            padding: 20px;
-            min-height: 100vh;
-        }
-        .header {
-            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-            padding: 30px;
-            border-radius: 15px;
-            margin-bottom: 20px;
-            box-shadow: 0 8px 16px rgba(0,0,0,0.3);
-        }
-        .header h1 {
-            font-size: 32px;
-            margin-bottom: 10px;
-            text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
-        }
-        .header p {
-            opacity: 0.95;
-            font-size: 14px;
-        }
-        .info-box {
-            background: rgba(26, 31, 58, 0.8);
-            padding: 20px;
-            border-radius: 10px;
-            margin-bottom: 20px;
-            border-left: 4px solid #fbbf24;
-            backdrop-filter: blur(10px);
-        }
-        .info-box h3 {
-            color: #fbbf24;
-            margin-bottom: 10px;
-            font-size: 16px;
-        }
-        .info-box p {
-            color: #aaa;
-            font-size: 13px;
-            line-height: 1.8;
-        }
-        .stats {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(180px, 1fr));
-            gap: 15px;
-            margin-bottom: 20px;
-        }
-        .stat-card {
-            background: rgba(26, 31, 58, 0.8);
-            padding: 20px;
-            border-radius: 10px;
-            border-left: 4px solid #667eea;
-            backdrop-filter: blur(10px);
-            transition: transform 0.2s;
-        }
-        .stat-card:hover {
-            transform: translateY(-2px);
-        }
-        .stat-label {
-            color: #888;
-            font-size: 11px;
-            margin-bottom: 8px;
-            text-transform: uppercase;
-            letter-spacing: 1px;
-        }
-        .stat-value {
-            font-size: 28px;
-            font-weight: bold;
-            color: #667eea;
-        }
-        .table-container {
-            background: rgba(26, 31, 58, 0.8);
-            border-radius: 15px;
-            overflow: hidden;
-            box-shadow: 0 8px 16px rgba(0,0,0,0.3);
-            backdrop-filter: blur(10px);
-        }
-        table {
-            width: 100%;
-            border-collapse: collapse;
-        }
-        th {
-            background: rgba(37, 43, 74, 0.9);
-            padding: 18px 15px;
-            text-align: left;
-            font-weight: bold;
-            color: #667eea;
-            position: sticky;
-            top: 0;
-            font-size: 13px;
-            text-transform: uppercase;
-            letter-spacing: 0.5px;
-        }
-        td {
-            padding: 15px;
-            border-bottom: 1px solid rgba(37, 43, 74, 0.5);
-            font-size: 13px;
-        }
-        tr:hover {
-            background: rgba(37, 43, 74, 0.5);
-        }
-        .symbol {
-            font-weight: bold;
-            color: #fff;
-            font-size: 14px;
-        }
-        .price {
-            font-family: 'Courier New', monospace;
-            color: #aaa;
-        }
-        .funding-positive {
-            color: #4ade80;
-        }
-        .funding-negative {
-            color: #f87171;
-        }
-        .funding-high {
-            color: #a78bfa;
-            font-weight: bold;
-        }
-        .funding-extreme {
-            color: #fbbf24;
-            font-weight: bold;
-            animation: pulse 2s infinite;
-        }
-        @keyframes pulse {
-            0%, 100% { opacity: 1; }
-            50% { opacity: 0.7; }
-        }
-        .spread-positive {
-            color: #4ade80;
-        }
-        .spread-negative {
-            color: #f87171;
-        }
-        .spread-large {
-            color: #fbbf24;
-            font-weight: bold;
-        }
-        .status-ok {
-            color: #4ade80;
-        }
-        .status-no {
-            color: #666;
-        }
-        /* 推荐等级样式 */
-        .rec-none {
-            color: #666;
-            font-size: 12px;
-        }
-        .rec-normal {
-            color: #60a5fa;
-            font-weight: 500;
+    def __init__(self, path=HISTORY_DB_PATH):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history-writer')
+        self._conn = None
+        self._pending = 0
+        self._last_prune = 0
+        self._sample_sql = (
+            f'INSERT OR REPLACE INTO samples (symbol, ts, {", ".join(HISTORY_SAMPLE_FIELDS)}) '
+            f'VALUES ({", ".join(["?"] * (len(HISTORY_SAMPLE_FIELDS) + 2))})'
+        )
+        self._rollup_sql = {table: _history_rollup_sql(table) for table, _ in HISTORY_TIERS}
+
+        # 查询使用独立的线程池，每个线程持有自己的只读连接
+        self._read_executor = ThreadPoolExecutor(
+            max_workers=HISTORY_READ_WORKERS, thread_name_prefix='history-reader'
+        )
+        self._read_local = threading.local()
+        self._read_connections = []
+        self._query_sql = {
+            table: _history_query_sql(table)
+            for table in ['samples'] + [table for table, _ in HISTORY_TIERS]
         }
-        .rec-good {
-            color: #a78bfa;
-            font-weight: bold;
+
+    def start(self):
+        """在写线程中打开数据库并建表，提交后立即返回，不阻塞启动
+
+        写线程按提交顺序执行，之后提交的批次总在建表之后写入；建表完成前的查询返回空结果。
+        """
+        future = asyncio.get_running_loop().run_in_executor(self._executor, self._open)
+        future.add_done_callback(self._on_open_done)
+
+    async def close(self):
+        """等待已提交的批次写完后关闭数据库"""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+        self._executor.shutdown(wait=True)
+        self._read_executor.shutdown(wait=True)
+        for conn in self._read_connections:
+            conn.close()
+
+    async def query(self, symbol, start, end, step):
+        """按时间范围和步长查询某币种的聚合历史
+
+        Args:
+            symbol: BP 币种名
+            start: 起始时间（Unix 秒，含）
+            end: 结束时间（Unix 秒，不含）
+            step: 桶宽（秒）
+
+        Returns:
+            dict: 列式结果，{'ts': [...], 'count': [...], 字段: {'min': [...], 'max': [...],
+                  'mean': [...], 'last': [...]}}，以及实际使用的数据源 'source'
+        """
+        table = self._select_tier(step)
+        rows = await asyncio.get_running_loop().run_in_executor(
+            self._read_executor, self._query, table, symbol, start, end, step
+        )
+        columns = list(zip(*rows)) if rows else [()] * (2 + 4 * len(HISTORY_QUERY_FIELDS))
+        result = {
+            'symbol': symbol,
+            'from': start,
+            'to': end,
+            'step': step,
+            'source': table,
+            'ts': list(columns[0]),
+            'count': list(columns[1]),
         }
-        .rec-excellent {
-            color: #fbbf24;
-            font-weight: bold;
-            animation: pulse 2s infinite;
+        for i, field in enumerate(HISTORY_QUERY_FIELDS):
+            base = 2 + 4 * i
+            result[field] = {
+                'min': list(columns[base]),
+                'max': list(columns[base + 1]),
+                'mean': list(columns[base + 2]),
+                'last': list(columns[base + 3]),
+            }
+        return result
+
+    @staticmethod
+    def _select_tier(step):
+        """选择能整除 step 的最粗一级降采样表（保留时间也最长），否则用原始样本"""
+        for table, seconds in reversed(HISTORY_TIERS):
+            if step % seconds == 0:
+                return table
+        return 'samples'
+
+    def _query(self, table, symbol, start, end, step):
+        """在查询线程中执行聚合查询；数据库或表尚未创建（如获取进程还未启动）时返回空结果"""
+        conn = getattr(self._read_local, 'conn', None)
+        if conn is None:
+            if not os.path.exists(self.path):
+                return []
+            conn = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False)
+            self._read_local.conn = conn
+            self._read_connections.append(conn)
+        try:
+            return conn.execute(self._query_sql[table], (step, step, symbol, start, end)).fetchall()
+        except sqlite3.OperationalError as e:
+            if str(e).startswith('no such table'):
+                return []
+            raise
+
+    def record(self, snapshot, ts=None):
+        """提交一轮样本（快照中的所有行），立即返回，由写线程异步写入"""
+        if self._pending >= HISTORY_MAX_PENDING_BATCHES:
+            log_event('history_backlog', f"历史写入积压 {self._pending} 批，丢弃本轮样本", logging.WARNING,
+                      pending=self._pending)
+            HISTORY_DROPPED_BATCHES.inc()
+            return
+        ts = int(ts if ts is not None else time.time())
+        samples = [
+            (row['symbol'],) + tuple(row[field] for field in HISTORY_SAMPLE_FIELDS)
+            for row in snapshot.rows
+        ]
+        self._pending += 1
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, self._write_batch, ts, samples
+        )
+        future.add_done_callback(self._on_batch_done)
+
+    def _on_open_done(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            log_event('history_open_error', f"历史数据库打开失败，本次运行不记录历史: {future.exception()}",
+                      logging.ERROR, exc_info=future.exception())
+
+    def _on_batch_done(self, future):
+        self._pending -= 1
+        if not future.cancelled() and future.exception() is not None:
+            log_event('history_write_error', f"历史写入失败: {future.exception()}", logging.ERROR,
+                      exc_info=future.exception())
+
+    # ---------- 以下方法只在写线程中执行 ----------
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            for statement in _history_schema():
+                self._conn.execute(statement)
+            _history_migrate(self._conn)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _write_batch(self, ts, samples):
+        if not samples or self._conn is None:  # 数据库打开失败时丢弃（已在 _on_open_done 中记录）
+            return
+        field_index = {field: i + 1 for i, field in enumerate(HISTORY_SAMPLE_FIELDS)}
+        with self._conn:
+            self._conn.executemany(
+                self._sample_sql, [(sample[0], ts) + sample[1:] for sample in samples]
+            )
+            for table, seconds in HISTORY_TIERS:
+                bucket = ts - ts % seconds
+                rows = []
+                for sample in samples:
+                    values = [sample[0], bucket]
+                    for field in HISTORY_METRIC_FIELDS:
+                        value = sample[field_index[field]]
+                        values += [value, value, value, value]
+                    values += [sample[field_index['var_interval']], sample[field_index['bpx_interval']]]
+                    rows.append(values)
+                self._conn.executemany(self._rollup_sql[table], rows)
+
+        if ts - self._last_prune >= HISTORY_PRUNE_INTERVAL:
+            self._prune(ts)
+            self._last_prune = ts
+
+    def _prune(self, now):
+        """按保留策略删除过期数据"""
+        with self._conn:
+            for table, days in HISTORY_RETENTION_DAYS.items():
+                if days is not None:
+                    self._conn.execute(f'DELETE FROM {table} WHERE ts < ?', (now - days * 86400,))
+
+# ==================== 快照检查点 ====================
+class SnapshotCheckpoint:
+    """最新快照的磁盘检查点
+
+    文件内容为 {"saved_at", "version", "fetched_at", "tables", "data"}：tables 是各交易所的列式数据
+    （{交易所: {"symbols", "columns"}}），重启后某个交易所获取失败时汇总仍基于保存时的数据；
+    data 直接使用快照中已序列化的 /api/data 响应体，保存时不重新序列化。
+    先写临时文件并 fsync，再原子替换，进程在写入中途退出也不会留下损坏的文件。
+
+    Args:
+        path: 检查点文件路径
+    """
+
+    def __init__(self, path=CHECKPOINT_PATH):
+        self.path = path
+        self._saved_version = None
+
+    def restore(self):
+        """载入检查点到存储，所有交易所标记为过期，直到第一轮获取完成
+
+        Returns:
+            bool: 是否载入成功（没有文件、文件过旧或损坏时返回 False）
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                checkpoint = json.loads(f.read())
+            saved_at, version, payload = checkpoint['saved_at'], checkpoint['version'], checkpoint['data']
+            tables = {
+                exchange: ExchangeTable(table['symbols'], table['columns'])
+                for exchange, table in checkpoint.get('tables', {}).items()
+            }
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            log_event('checkpoint_error', f"快照检查点载入失败: {e}", logging.WARNING, path=self.path)
+            return False
+        now = time.time()
+        if now - saved_at > CHECKPOINT_MAX_AGE:
+            log_event('checkpoint_expired', f"快照检查点已过期（{(now - saved_at) / 3600:.1f} 小时前），不载入",
+                      age_s=round(now - saved_at))
+            return False
+
+        # 所有费率都是重启前的数据：按行标记过期，并按保存时的获取时间给出各交易所已过期的秒数
+        for row in payload['summary']:
+            row['bpx_funding_stale'] = True
+        stats = payload['stats']
+        stats['stale_exchanges'] = {
+            EXCHANGE_LABELS.get(exchange, exchange): round(now - (info.get('fetched_at') or saved_at))
+            for exchange, info in stats.get('exchanges', {}).items()
         }
-        .loading {
-            text-align: center;
-            padding: 60px;
-            color: #888;
-            font-size: 14px;
+        stats['restored_at'] = saved_at
+        store.load_snapshot(version, encode_payload(payload, 'json'), tables, checkpoint.get('fetched_at'))
+        self._saved_version = version
+        log_event('checkpoint_restored', f"✓ 已载入快照检查点: {len(payload['summary'])} 个币种，版本 {version}，"
+                  f"{now - saved_at:.0f} 秒前保存",
+                  symbols=len(payload['summary']), version=version, age_s=round(now - saved_at))
+        return True
+
+    async def save(self):
+        """保存当前快照（本进程尚未获取到新数据、或数据未变化时不写）"""
+        snapshot = store.snapshot
+        if store.update_count == 0 or snapshot.version == self._saved_version:
+            return
+        # 表和获取时间在事件循环中取引用（表只会被整体替换，不会原地修改），序列化在线程中进行
+        await asyncio.to_thread(
+            self._write, snapshot.version, snapshot.body(), dict(store.tables), dict(store.fetched_at)
+        )
+        self._saved_version = snapshot.version
+
+    def save_now(self):
+        """同步保存当前快照（退出时调用）"""
+        snapshot = store.snapshot
+        if store.update_count > 0 and snapshot.version != self._saved_version:
+            try:
+                self._write(snapshot.version, snapshot.body(), dict(store.tables), dict(store.fetched_at))
+                self._saved_version = snapshot.version
+            except OSError as e:
+                log_event('checkpoint_error', f"快照检查点保存失败: {e}", logging.ERROR, path=self.path)
+
+    def _write(self, version, body, tables, fetched_at):
+        header = json.dumps({
+            'saved_at': time.time(),
+            'version': version,
+            'fetched_at': fetched_at,
+            'tables': {
+                exchange: {
+                    'symbols': list(table.symbols),
+                    'columns': {name: column.tolist() for name, column in table.columns.items()},
+                }
+                for exchange, table in tables.items()
+            },
+        })
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(header[:-1].encode('utf-8') + b', "data": ' + body + b'}')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    async def run(self):
+        """每 CHECKPOINT_INTERVAL 秒保存一次"""
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+            try:
+                await self.save()
+            except Exception as e:
+                log_event('checkpoint_error', f"快照检查点保存失败: {e}", logging.ERROR, path=self.path)
+
+# ==================== 告警 ====================
+class AlertRule:
+    """阈值告警规则：指标越过阈值并连续保持 cycles 个更新周期后触发，回落越过恢复阈值后恢复
+
+    Args:
+        name: 规则名
+        metric: 指标，DATA_SORT_KEYS 中的名称（diff / spread / var_funding / apr）
+        threshold: 触发阈值
+        direction: 'above' 表示指标 >= 阈值时触发，'below' 表示指标 <= 阈值时触发
+        clear: 恢复阈值（滞回，避免在阈值附近反复触发），默认按 ALERT_DEFAULT_HYSTERESIS 回退
+        cycles: 需要连续满足条件的更新周期数
+        cooldown: 同一币种两次发送之间的最短间隔（秒），冷却期内再次触发的告警不发送
+        symbols: 只对这些币种生效，None 表示所有币种
+        sinks: 发送到哪些告警输出（ALERT_SINKS 中的名称），None 表示全部
+    """
+
+    def __init__(self, name, metric, threshold, direction='above', clear=None, cycles=1,
+                 cooldown=ALERT_DEFAULT_COOLDOWN, symbols=None, sinks=None):
+        if metric not in DATA_SORT_KEYS:
+            raise ValueError(f"告警规则 {name}: metric 必须是 {' / '.join(DATA_SORT_KEYS)} 之一")
+        if direction not in ('above', 'below'):
+            raise ValueError(f'告警规则 {name}: direction 必须是 above 或 below')
+
+        # 内部统一按 "值越大越接近触发" 比较，below 规则取相反数
+        self.sign = 1 if direction == 'above' else -1
+        self.trigger_level = self.sign * threshold
+        if clear is None:
+            self.clear_level = self.trigger_level - abs(threshold) * ALERT_DEFAULT_HYSTERESIS
+        else:
+            self.clear_level = self.sign * clear
+        if self.clear_level > self.trigger_level:
+            raise ValueError(f'告警规则 {name}: 恢复阈值不能越过触发阈值')
+
+        self.name = name
+        self.metric = metric
+        self.threshold = threshold
+        self.direction = direction
+        self.clear = self.sign * self.clear_level
+        self.cycles = max(1, int(cycles))
+        self.cooldown = cooldown
+        self.symbols = frozenset(symbols) if symbols else None
+        self.sinks = sinks
+
+class _RuleGroup:
+    """同一指标、同一方向的规则，按触发阈值和恢复阈值分别排序，用于二分查找被越过的阈值"""
+
+    def __init__(self, indexed_rules):
+        by_trigger = sorted(indexed_rules, key=lambda item: item[1].trigger_level)
+        by_clear = sorted(indexed_rules, key=lambda item: item[1].clear_level)
+        self.trigger_levels = [rule.trigger_level for _, rule in by_trigger]
+        self.trigger_rules = [index for index, _ in by_trigger]
+        self.clear_levels = [rule.clear_level for _, rule in by_clear]
+        self.clear_rules = [index for index, _ in by_clear]
+
+class AlertEngine:
+    """增量告警引擎
+
+    每个数据版本只处理变更集中的币种（新增、变化、删除）；首次评估或版本不连续时（如从检查点载入后）
+    全量评估一次。同一指标的规则按阈值排序，
+    指标从旧值变为新值时二分查找出被越过的阈值，只有这些规则的状态会改变；连续周期数
+    用到期队列检查。每个版本的开销与变化的币种数和状态变化数成正比，与规则总数无关。
+
+    告警事件放入队列，由 run() 异步发送到各输出，发送慢或失败不影响数据更新。
+
+    Args:
+        rules: AlertRule 列表
+        sinks: {名称: 告警输出}，输出需实现 async send(alert)
+    """
+
+    def __init__(self, rules, sinks):
+        self.rules = list(rules)
+        self.sinks = sinks
+        for rule in self.rules:
+            unknown = [name for name in rule.sinks or () if name not in sinks]
+            if unknown:
+                raise ValueError(f"告警规则 {rule.name}: 未知的告警输出 {', '.join(unknown)}")
+
+        grouped = {}
+        for index, rule in enumerate(self.rules):
+            grouped.setdefault((rule.metric, rule.sign), []).append((index, rule))
+        self._groups = {key: _RuleGroup(items) for key, items in grouped.items()}
+
+        self._values = {}     # (指标, 方向, 币种) -> 上次的值（已按方向取符号）
+        self._states = {}     # (规则序号, 币种) -> {'since': 开始满足条件的周期, 'sent': 是否已发送}
+        self._due = []        # 堆：(到期周期, 序号, 规则序号, 币种, 开始周期)
+        self._seq = 0
+        self._last_sent = {}  # (规则序号, 币种) -> 上次发送时间
+        self._version = None  # 上次评估的数据版本
+        self._queue = asyncio.Queue(maxsize=ALERT_QUEUE_SIZE)
+
+    def evaluate(self, snapshot, cycle):
+        """按新版本快照的变更集更新规则状态（作为存储的监听器，每个数据版本调用一次）
+
+        Args:
+            snapshot: 新版本的 SummarySnapshot
+            cycle: 当前更新周期序号（store.update_count），用于连续周期计数
+        """
+        with ALERT_EVALUATION_SECONDS.time():
+            changes = snapshot.changes
+            if snapshot.version == self._version:
+                pass  # 数据未变化的更新周期：只检查连续周期是否到期
+            elif snapshot.base_version != self._version:
+                symbols = set(snapshot.by_symbol).union(key[2] for key in self._values)
+                for symbol in symbols:
+                    self._update_symbol(symbol, snapshot.by_symbol.get(symbol), cycle, snapshot)
+            else:
+                for symbol in changes.removed:
+                    self._update_symbol(symbol, None, cycle, snapshot)
+                for symbol in changes.added:
+                    self._update_symbol(symbol, snapshot.by_symbol[symbol], cycle, snapshot)
+                for symbol in changes.changed:
+                    self._update_symbol(symbol, snapshot.by_symbol[symbol], cycle, snapshot)
+            self._version = snapshot.version
+
+            while self._due and self._due[0][0] <= cycle:
+                _, _, index, symbol, since = heapq.heappop(self._due)
+                state = self._states.get((index, symbol))
+                if state is not None and state['since'] == since and not state['sent']:
+                    self._fire(index, symbol, state, snapshot)
+            ALERTS_ACTIVE.set(len(self._states))
+
+    def _update_symbol(self, symbol, row, cycle, snapshot):
+        """一个币种的指标变化：找出被越过的触发阈值和恢复阈值（row 为 None 表示币种已删除）"""
+        inf = float('inf')
+        for (metric, sign), group in self._groups.items():
+            key = (metric, sign, symbol)
+            old = self._values.get(key, -inf)
+            new = -inf if row is None else sign * DATA_SORT_KEYS[metric](row)
+            if new != new or abs(new) == inf:
+                new = -inf  # 没有数据（如没有最优组合）视为不满足任何条件
+            if new == old:
+                continue
+            if new == -inf:
+                del self._values[key]
+            else:
+                self._values[key] = new
+
+            if new > old:
+                # 向上越过触发阈值：old < 触发阈值 <= new
+                lo = bisect.bisect_right(group.trigger_levels, old)
+                hi = bisect.bisect_right(group.trigger_levels, new)
+                for index in group.trigger_rules[lo:hi]:
+                    self._enter(index, symbol, cycle)
+            else:
+                # 向下越过恢复阈值：new < 恢复阈值 <= old
+                lo = bisect.bisect_right(group.clear_levels, new)
+                hi = bisect.bisect_right(group.clear_levels, old)
+                for index in group.clear_rules[lo:hi]:
+                    self._leave(index, symbol, snapshot)
+
+    def _enter(self, index, symbol, cycle):
+        rule = self.rules[index]
+        if rule.symbols is not None and symbol not in rule.symbols:
+            return
+        if (index, symbol) in self._states:
+            return
+        self._states[(index, symbol)] = {'since': cycle, 'sent': False}
+        self._seq += 1
+        heapq.heappush(self._due, (cycle + rule.cycles - 1, self._seq, index, symbol, cycle))
+
+    def _leave(self, index, symbol, snapshot):
+        state = self._states.pop((index, symbol), None)
+        if state is not None and state['sent']:
+            self._emit(index, symbol, 'resolved', snapshot)
+
+    def _fire(self, index, symbol, state, snapshot):
+        rule = self.rules[index]
+        now = time.time()
+        last_sent = self._last_sent.get((index, symbol))
+        if last_sent is not None and now - last_sent < rule.cooldown:
+            state['sent'] = None  # 冷却期内：本次不发送，恢复时也不发送
+            ALERTS_SUPPRESSED.inc(rule.name)
+            return
+        state['sent'] = True
+        self._last_sent[(index, symbol)] = now
+        self._emit(index, symbol, 'firing', snapshot)
+
+    def _emit(self, index, symbol, state, snapshot):
+        rule = self.rules[index]
+        row = snapshot.by_symbol.get(symbol)
+        value = DATA_SORT_KEYS[rule.metric](row) if row is not None else None
+        if value is not None and abs(value) == float('inf'):
+            value = None
+        limit = rule.threshold if state == 'firing' else rule.clear
+        alert = {
+            'rule': rule.name,
+            'symbol': symbol,
+            'state': state,
+            'metric': rule.metric,
+            'value': value,
+            'threshold': rule.threshold,
+            'clear': rule.clear,
+            'cycles': rule.cycles,
+            'version': snapshot.version,
+            'time': time.time(),
+            'message': f"{symbol} {rule.name}: {rule.metric} = "
+                       f"{'-' if value is None else f'{value:.4f}'} (阈值 {limit})",
         }
-        .update-time {
-            text-align: center;
-            color: #888;
-            margin-top: 20px;
-            font-size: 12px;
+        ALERTS_SENT.inc(rule.name, state)
+        try:
+            self._queue.put_nowait((alert, rule.sinks or list(self.sinks)))
+        except asyncio.QueueFull:
+            ALERTS_DROPPED.inc()
+
+    async def run(self):
+        """把告警事件发送到各输出，单个输出失败不影响其它输出"""
+        while True:
+            alert, sink_names = await self._queue.get()
+            results = await asyncio.gather(
+                *(self.sinks[name].send(alert) for name in sink_names), return_exceptions=True
+            )
+            for name, result in zip(sink_names, results):
+                if isinstance(result, Exception):
+                    ALERT_SINK_ERRORS.inc(name)
+                    log_event('alert_sink_error', f"告警发送失败（{name}）: {result}", logging.WARNING,
+                              sink=name, rule=alert['rule'], symbol=alert['symbol'])
+
+class StdoutAlertSink:
+    """写入日志（标准输出和结构化日志文件）"""
+
+    async def send(self, alert):
+        action = '触发' if alert['state'] == 'firing' else '恢复'
+        log_event('alert', f"🔔 告警{action}: {alert['message']}", logging.WARNING,
+                  rule=alert['rule'], symbol=alert['symbol'], state=alert['state'],
+                  metric=alert['metric'], value=alert['value'], threshold=alert['threshold'])
+
+class FileAlertSink:
+    """追加写入 JSON Lines 文件（每行一个告警事件）
+
+    Args:
+        path: 文件路径
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    async def send(self, alert):
+        await asyncio.to_thread(self._append, json.dumps(alert, ensure_ascii=False) + '\n')
+
+    def _append(self, line):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+class WebhookAlertSink:
+    """以 JSON 格式 POST 到 webhook 地址（如本地的通知转发服务）
+
+    Args:
+        url: webhook 地址
+        client: 共享的 ExchangeHttpClient（复用其连接池，不经过限速和熔断）
+    """
+
+    def __init__(self, url, client):
+        self.url = url
+        self.client = client
+
+    async def send(self, alert):
+        async with self.client.session.post(
+            self.url, json=alert, timeout=aiohttp.ClientTimeout(total=ALERT_WEBHOOK_TIMEOUT)
+        ) as response:
+            if response.status >= 300:
+                raise RuntimeError(f'HTTP {response.status}')
+
+# 告警输出类型（ALERT_SINKS 中的 type）-> 类
+ALERT_SINK_TYPES = {
+    'stdout': StdoutAlertSink,
+    'file': FileAlertSink,
+    'webhook': WebhookAlertSink,
+}
+
+def create_alert_engine(client):
+    """按 ALERT_SINKS 和 ALERT_RULES 创建告警引擎
+
+    Args:
+        client: 共享的 ExchangeHttpClient，供 webhook 输出使用
+    """
+    sinks = {}
+    for name, spec in ALERT_SINKS.items():
+        options = dict(spec)
+        sink_type = options.pop('type')
+        if sink_type == 'webhook':
+            options['client'] = client
+        sinks[name] = ALERT_SINK_TYPES[sink_type](**options)
+    return AlertEngine([AlertRule(**rule) for rule in ALERT_RULES], sinks)
+
+# ==================== HTTP客户端 ====================
+CIRCUIT_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+class ExchangeUnavailableError(Exception):
+    """主机处于熔断中，或需要等待太久（限速 / Retry-After），请求没有发出"""
+
+def _parse_retry_after(value):
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回秒，无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _backoff_delay(attempt):
+    """第 attempt 次重试前的等待时间（指数退避 + 全随机抖动）"""
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+
+class HostGovernor:
+    """单个主机的请求管控
+
+    - 令牌桶限速：令牌不足时排队等待，令牌可以透支，透支量即排队长度；
+    - Retry-After：在指定时间之前不再向该主机发请求；
+    - 熔断器：连续失败 CIRCUIT_FAILURE_THRESHOLD 次后打开，期间请求直接失败；
+      到期后放行一个探测请求（半开），成功则关闭，失败则以加倍的时间重新打开。
+
+    所有方法都在事件循环线程中调用，不需要加锁。
+    """
+
+    def __init__(self, host, rate, burst):
+        self.host = host
+        self.rate = rate
+        self.burst = burst
+        self.state = 'closed'
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0       # Retry-After 或熔断到期的时间
+        self._failures = 0              # 连续失败次数
+        self._open_seconds = CIRCUIT_OPEN_SECONDS
+        self._probing = False           # 半开状态下是否已有探测请求在进行
+        EXCHANGE_CIRCUIT_STATE.set(0, host)
+
+    async def acquire(self):
+        """占用一个令牌，必要时等待；熔断中或需等待超过 HTTP_MAX_QUEUE_WAIT 时抛出 ExchangeUnavailableError"""
+        now = time.monotonic()
+        if self.state == 'open':
+            if now < self._blocked_until:
+                self._reject('circuit_open', f'{self.host} 熔断中，{self._blocked_until - now:.0f}s 后重试')
+            self._set_state('half_open')
+        if self.state == 'half_open':
+            if self._probing:
+                self._reject('circuit_open', f'{self.host} 熔断探测中')
+            self._probing = True
+
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        wait = max(self._blocked_until - now, -(self._tokens - 1) / self.rate, 0.0)
+        if wait > HTTP_MAX_QUEUE_WAIT:
+            self._probing = False
+            self._reject('throttled', f'{self.host} 需等待 {wait:.1f}s（限速或 Retry-After）')
+        self._tokens -= 1
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.release()
+                raise
+
+    def release(self):
+        """请求未完成就被取消时调用，释放探测名额"""
+        self._probing = False
+
+    def record_success(self):
+        """收到非 429/5xx 响应"""
+        self._failures = 0
+        self._probing = False
+        if self.state != 'closed':
+            self._open_seconds = CIRCUIT_OPEN_SECONDS
+            self._set_state('closed')
+
+    def record_failure(self, retry_after=None):
+        """收到 429/5xx 或网络错误"""
+        now = time.monotonic()
+        if retry_after is not None:
+            self._blocked_until = max(self._blocked_until, now + min(retry_after, HTTP_RETRY_AFTER_MAX))
+        self._failures += 1
+        if self.state == 'half_open':
+            self._open_seconds = min(self._open_seconds * 2, CIRCUIT_OPEN_MAX_SECONDS)
+        elif self._failures < CIRCUIT_FAILURE_THRESHOLD or self.state == 'open':
+            return
+        self._probing = False
+        self._blocked_until = max(self._blocked_until, now + self._open_seconds)
+        self._set_state('open')
+        log_event('circuit_open', f"{self.host} 连续失败 {self._failures} 次，熔断 {self._open_seconds}s",
+                  logging.WARNING, host=self.host, failures=self._failures, open_s=self._open_seconds)
+
+    def _set_state(self, state):
+        self.state = state
+        EXCHANGE_CIRCUIT_STATE.set(CIRCUIT_STATES[state], self.host)
+
+    def _reject(self, reason, message):
+        EXCHANGE_REQUESTS_REJECTED.inc(self.host, reason)
+        raise ExchangeUnavailableError(message)
+
+class ExchangeHttpClient:
+    """进程级共享的HTTP客户端
+
+    在 main() 中创建一次，所有更新周期复用同一个连接池（keep-alive + DNS缓存），
+    避免每轮重新建立 TCP 连接、代理 CONNECT 和 TLS 握手。
+    只有 PROXY_HOSTS 中的主机走代理。每个主机的请求经过各自的 HostGovernor
+    （限速、退避重试、熔断）。
+    """
+
+    def __init__(self):
+        self.session = None
+        self.governors = {}  # 主机 -> HostGovernor
+        self._reset_connection_stats()
+
+    async def start(self):
+        """创建连接池和会话"""
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_start.append(self._on_connection_create_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_request_end.append(self._on_request_end)
+        trace_config.on_request_exception.append(self._on_request_exception)
+
+        connector = aiohttp.TCPConnector(
+            limit_per_host=HTTP_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        )
+        self.session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+
+    async def close(self):
+        """关闭会话并释放所有连接"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def governor(self, host):
+        """返回主机对应的 HostGovernor（首次使用时创建）"""
+        governor = self.governors.get(host)
+        if governor is None:
+            rate, burst = HOST_RATE_LIMITS.get(host, HOST_RATE_LIMIT_DEFAULT)
+            governor = self.governors[host] = HostGovernor(host, rate, burst)
+        return governor
+
+    def ws_connect(self, url, **kwargs):
+        """建立WebSocket连接，用法与 aiohttp.ClientSession.ws_connect 相同（自动选择是否走代理）"""
+        host = urlsplit(url).hostname
+        proxy = PROXY_URL if host in PROXY_HOSTS else None
+        return self.session.ws_connect(url, proxy=proxy, **kwargs)
+
+    @asynccontextmanager
+    async def get(self, url, exchange=None, **kwargs):
+        """发起GET请求，用法与 aiohttp.ClientSession.get 相同（自动选择是否走代理）
+
+        429/5xx 和网络错误按指数退避重试（遵守 Retry-After），重试用完后
+        返回最后一次的响应或抛出最后一次的异常；主机熔断时抛出 ExchangeUnavailableError。
+        成功的响应在返回前读完响应体，读取时的超时和连接重置同样计入重试和熔断，
+        调用方的 resp.json() / resp.text() 直接使用已读取的内容。
+
+        Args:
+            url: 请求地址
+            exchange: 监控指标中的交易所标签，默认使用主机名
+        """
+        host = urlsplit(url).hostname
+        proxy = PROXY_URL if host in PROXY_HOSTS else None
+        governor = self.governor(host)
+
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            if attempt:
+                EXCHANGE_REQUEST_RETRIES.inc(host)
+            await governor.acquire()
+            response = None
+            try:
+                response = await self.session.get(
+                    url, proxy=proxy, trace_request_ctx={'exchange': exchange or host}, **kwargs
+                )
+                if response.status != 429 and response.status < 500:
+                    await response.read()
+            except asyncio.CancelledError:
+                governor.release()
+                if response is not None:
+                    response.release()
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if response is not None:
+                    response.release()
+                governor.record_failure()
+                if attempt == HTTP_MAX_RETRIES or governor.state != 'closed':
+                    raise
+                await asyncio.sleep(_backoff_delay(attempt))
+                continue
+
+            if response.status != 429 and response.status < 500:
+                governor.record_success()
+                break
+            retry_after = _parse_retry_after(response.headers.get('Retry-After'))
+            governor.record_failure(retry_after)
+            if (attempt == HTTP_MAX_RETRIES or governor.state != 'closed'
+                    or (retry_after or 0) > HTTP_MAX_QUEUE_WAIT):
+                break
+            response.release()
+            await asyncio.sleep(_backoff_delay(attempt))
+
+        try:
+            yield response
+        finally:
+            response.release()
+
+    def pop_connection_stats(self):
+        """返回自上次调用以来的连接统计并清零
+
+        Returns:
+            dict: {'new': 新建连接数, 'reused': 复用连接数, 'connect_ms': 建连总耗时（含代理和TLS）}
+        """
+        stats = {
+            'new': self._new_connections,
+            'reused': self._reused_connections,
+            'connect_ms': self._connect_ms,
         }
-        .opportunity {
-            background: rgba(251, 191, 36, 0.1);
-            border-left: 4px solid #fbbf24;
+        self._reset_connection_stats()
+        return stats
+
+    def _reset_connection_stats(self):
+        self._new_connections = 0
+        self._reused_connections = 0
+        self._connect_ms = 0.0
+
+    async def _on_connection_create_start(self, session, trace_config_ctx, params):
+        trace_config_ctx.connect_start = time.perf_counter()
+
+    async def _on_connection_create_end(self, session, trace_config_ctx, params):
+        self._new_connections += 1
+        self._connect_ms += (time.perf_counter() - trace_config_ctx.connect_start) * 1000
+
+    async def _on_connection_reuseconn(self, session, trace_config_ctx, params):
+        self._reused_connections += 1
+
+    async def _on_request_start(self, session, trace_config_ctx, params):
+        trace_config_ctx.request_start = time.perf_counter()
+
+    async def _on_request_end(self, session, trace_config_ctx, params):
+        labels = _trace_labels(trace_config_ctx, params)
+        EXCHANGE_REQUEST_SECONDS.observe(time.perf_counter() - trace_config_ctx.request_start, *labels)
+        if params.response.status >= 400:
+            EXCHANGE_REQUEST_ERRORS.inc(*labels, str(params.response.status))
+
+    async def _on_request_exception(self, session, trace_config_ctx, params):
+        labels = _trace_labels(trace_config_ctx, params)
+        if isinstance(params.exception, (asyncio.TimeoutError, asyncio.CancelledError)):
+            EXCHANGE_REQUEST_TIMEOUTS.inc(*labels)
+        else:
+            EXCHANGE_REQUEST_ERRORS.inc(*labels, 'exception')
+
+def _trace_labels(trace_config_ctx, params):
+    """请求指标的 (exchange, endpoint) 标签；未通过 get() 发起的请求（如WebSocket握手）用主机名"""
+    request_ctx = trace_config_ctx.trace_request_ctx or {}
+    return request_ctx.get('exchange') or params.url.host, params.url.path
+
+# ==================== 数据获取 ====================
+BPX_PERP_SUFFIX = '_USDC_PERP'   # Backpack USDC 永续合约的 symbol 后缀
+
+def _bpx_base(symbol):
+    """Backpack 永续合约 symbol -> 标准币种名，不是 USDC 永续合约时返回 None"""
+    if not symbol.endswith(BPX_PERP_SUFFIX):
+        return None
+    return symbol_registry.canonical('bpx', symbol[:-len(BPX_PERP_SUFFIX)])
+
+def _parse_interval_end(value):
+    """解析 fundingRates 的 intervalEndTimestamp（UTC 的 ISO 时间或毫秒时间戳），返回秒"""
+    if isinstance(value, (int, float)):
+        return value / 1000
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace('Z', '')).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            return None
+    return None
+
+async def _fetch_bpx_mark_prices(client):
+    """一次获取所有永续合约的当前资金费率（markPrices）
+
+    Returns:
+        dict: {base: (百分比费率, 下次结算时间戳（秒，未知时为None）)}，HTTP错误时返回None
+    """
+    async with client.get(
+        f"{BPX_API_BASE}/api/v1/markPrices",
+        exchange='bpx',
+        timeout=10
+    ) as response:
+        if response.status != 200:
+            log_event('bpx_mark_prices_error', f"BPX批量资金费率获取失败: HTTP {response.status}",
+                      logging.WARNING, status=response.status)
+            return None
+        data = await response.json()
+
+    funding_rates = {}
+    if isinstance(data, list):
+        for item in data:
+            base = _bpx_base(item.get('symbol', ''))
+            rate = item.get('fundingRate')
+            if base is None or rate in (None, ''):
+                continue
+            next_funding = item.get('nextFundingTimestamp')
+            funding_rates[base] = (float(rate) * 100,
+                                   next_funding / 1000 if isinstance(next_funding, (int, float)) else None)
+    return funding_rates
+
+async def _fetch_bpx_symbol_funding(client, symbol, semaphore):
+    """获取单个币种最新一期资金费率
+
+    Returns:
+        tuple: (百分比费率, 该期结算时间戳（秒，未知时为None）)，无数据时返回None
+    """
+    async with semaphore:
+        async with client.get(
+            f"{BPX_API_BASE}/api/v1/fundingRates?symbol={symbol}&limit=1",
+            exchange='bpx',
+            timeout=aiohttp.ClientTimeout(total=BPX_FUNDING_REQUEST_TIMEOUT)
+        ) as response:
+            if response.status != 200:
+                log_event('bpx_funding_symbol_error', f"BPX资金费率获取失败 {_bpx_base(symbol)}: HTTP {response.status}",
+                          logging.WARNING, symbol=_bpx_base(symbol), status=response.status)
+                return None
+            funding_data = await response.json()
+            if isinstance(funding_data, list) and len(funding_data) > 0:
+                # 资金费率是小数格式，需要转换为百分比
+                # 例如：0.0000125 表示 0.00125%
+                latest = funding_data[0]
+                return (float(latest.get('fundingRate', 0)) * 100,
+                        _parse_interval_end(latest.get('intervalEndTimestamp')))
+            log_event('bpx_funding_symbol_error', f"BPX资金费率获取失败 {_bpx_base(symbol)}: 无数据",
+                      logging.WARNING, symbol=_bpx_base(symbol), status=response.status)
+            return None
+
+async def _fetch_bpx_funding_fanout(client, symbols_to_fetch):
+    """并发获取多个币种的资金费率
+
+    使用信号量限制并发数，每个请求有独立超时，整轮有总截止时间；
+    截止时仍未完成的请求会被取消，不会拖慢整个更新周期。
+
+    Returns:
+        tuple: (funding_rates, stale_symbols)
+            funding_rates: {base: (百分比费率, 结算时间戳)}，本轮成功获取的币种
+            stale_symbols: 本轮失败或超时的币种（base），由存储层沿用上次数据
+    """
+    if not symbols_to_fetch:
+        return {}, []
+
+    fanout_start = time.perf_counter()
+    semaphore = asyncio.Semaphore(BPX_FUNDING_CONCURRENCY)
+    tasks = {
+        asyncio.create_task(_fetch_bpx_symbol_funding(client, symbol, semaphore)): symbol
+        for symbol in symbols_to_fetch
+    }
+    done, pending = await asyncio.wait(tasks, timeout=BPX_FUNDING_CYCLE_DEADLINE)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    funding_rates = {}
+    stale_symbols = []
+    for task, symbol in tasks.items():
+        base = _bpx_base(symbol)
+        if task in done and task.exception() is None and task.result() is not None:
+            funding_rates[base] = task.result()
+            continue
+        stale_symbols.append(base)
+        # 返回 None 的请求已在 _fetch_bpx_symbol_funding 中记录了原因
+        if task not in done:
+            log_event('bpx_funding_symbol_error', f"BPX资金费率获取失败 {base}: 超过本轮截止时间",
+                      logging.WARNING, symbol=base, error='deadline')
+        elif task.exception() is not None:
+            log_event('bpx_funding_symbol_error', f"BPX资金费率获取失败 {base}: {task.exception()!r}",
+                      logging.WARNING, symbol=base, error=repr(task.exception()))
+
+    fanout_ms = (time.perf_counter() - fanout_start) * 1000
+    BPX_FUNDING_FANOUT_SECONDS.observe(fanout_ms / 1000)
+    if stale_symbols:
+        BPX_FUNDING_STALE_SYMBOLS.inc(amount=len(stale_symbols))
+        # 单个币种的错误会被采样，每轮另记一条完整的失败币种列表
+        log_event('bpx_funding_stale', f"BPX资金费率 {len(stale_symbols)}/{len(tasks)} 个币种获取失败，沿用上次数据",
+                  logging.WARNING, symbols=stale_symbols, requested=len(tasks), fanout_ms=round(fanout_ms, 1))
+    return funding_rates, stale_symbols
+
+async def _fetch_bpx_markets(client):
+    """获取Backpack永续合约列表和结算间隔
+
+    Returns:
+        tuple: (perp_symbols, funding_intervals)，HTTP错误时返回None
+            perp_symbols: {base: 完整symbol}
+            funding_intervals: {base: 结算间隔（秒）}
+    """
+    async with client.get(
+        f"{BPX_API_BASE}/api/v1/markets",
+        exchange='bpx',
+        timeout=10
+    ) as response:
+        if response.status != 200:
+            log_event('bpx_markets_error', f"BPX市场信息获取失败: HTTP {response.status}",
+                      logging.WARNING, status=response.status)
+            return None
+        data = await response.json()
+
+    perp_symbols = {}  # key是base，value是完整symbol
+    funding_intervals = {}
+    if isinstance(data, list):
+        for market in data:
+            symbol = market.get('symbol', '')
+            base = _bpx_base(symbol)
+
+            if base is not None:
+                perp_symbols[base] = symbol
+
+                # 获取结算间隔（毫秒转秒）
+                funding_interval_ms = market.get('fundingInterval', 3600000)
+                funding_interval_s = funding_interval_ms // 1000 if funding_interval_ms else 3600
+                funding_intervals[base] = funding_interval_s
+    return perp_symbols, funding_intervals
+
+async def _fetch_bpx_tickers(client):
+    """获取Backpack永续合约最新价格
+
+    Returns:
+        tuple: (prices, fetched_at)，HTTP错误时返回None
+            prices: {base: 最新价}
+            fetched_at: 收到响应的时间戳
+    """
+    prices = {}
+    async with client.get(
+        f"{BPX_API_BASE}/api/v1/tickers",
+        exchange='bpx',
+        timeout=10
+    ) as ticker_response:
+        if ticker_response.status != 200:
+            log_event('bpx_tickers_error', f"BPX价格获取失败: HTTP {ticker_response.status}",
+                      logging.WARNING, status=ticker_response.status)
+            return None
+        ticker_data = await ticker_response.json()
+    if isinstance(ticker_data, list):
+        for ticker in ticker_data:
+            base = _bpx_base(ticker.get('symbol', ''))
+            if base is not None:
+                last_price = float(ticker.get('lastPrice', 0))
+                if last_price > 0:
+                    prices[base] = last_price
+    return prices, time.time()
+
+# ==================== 行情推送 ====================
+class BackpackPriceStream:
+    """Backpack ticker 推送（WebSocket）
+
+    订阅每个永续合约的 ticker 流，逐笔更新最新价；每 BPX_WS_COALESCE_INTERVAL 秒把这段时间内
+    变化的价格合并为一次 store.update_prices（一个新版本），而不是每笔都重建快照。
+    断线后按指数退避重连并重新订阅；连接不健康时 healthy 为 False，调度器改用 REST 获取价格。
+
+    Args:
+        client: 共享的 ExchangeHttpClient（WebSocket 同样按 PROXY_HOSTS 走代理）
+        url: WebSocket 地址，默认 BPX_WS_URL
+    """
+
+    def __init__(self, client, url=None):
+        self.client = client
+        self.url = url
+        self.prices = {}                # {base: 最新价}，连接期间逐笔更新
+        self.connected = False
+        self._symbols = set()           # 需要订阅 ticker 的完整 symbol
+        self._depth_symbols = set()     # 需要订阅 depth 的完整 symbol
+        self.on_depth = None            # depth 推送的回调（DepthTracker.on_depth）
+        self._symbols_ready = asyncio.Event()
+        self._ws = None
+        self._last_message = 0.0
+        self._pending = {}              # 上次合并之后变化的价格 {base: 最新价}
+        self._pending_event_times = {}  # {base: 最早一笔未合并行情的交易所事件时间（秒）}
+
+    @property
+    def healthy(self):
+        """已连接且最近 BPX_WS_STALE_AFTER 秒内收到过行情"""
+        return self.connected and time.time() - self._last_message < BPX_WS_STALE_AFTER
+
+    async def set_symbols(self, symbols):
+        """设置需要订阅 ticker 的 symbol，连接中时只对增减的部分发送订阅 / 取消订阅"""
+        symbols = set(symbols)
+        await self._resubscribe('ticker', self._symbols, symbols)
+        self._symbols = symbols
+        if symbols:
+            self._symbols_ready.set()
+        bases = {_bpx_base(symbol) for symbol in symbols}
+        for base in [base for base in self.prices if base not in bases]:
+            del self.prices[base]
+
+    async def set_depth_symbols(self, symbols):
+        """设置需要订阅 depth（订单簿增量）的 symbol"""
+        symbols = set(symbols)
+        await self._resubscribe('depth', self._depth_symbols, symbols)
+        self._depth_symbols = symbols
+
+    async def _resubscribe(self, kind, old, new):
+        added, removed = new - old, old - new
+        if self._ws is None or self._ws.closed:
+            return
+        try:
+            if removed:
+                await self._ws.send_json({'method': 'UNSUBSCRIBE', 'params': _streams(kind, removed)})
+            if added:
+                await self._ws.send_json({'method': 'SUBSCRIBE', 'params': _streams(kind, added)})
+        except (aiohttp.ClientError, ConnectionError) as e:
+            log_event('bpx_ws_error', f"BPX行情订阅更新失败（重连后会重新订阅）: {e}", logging.WARNING)
+
+    async def run(self):
+        """保持连接（断线重连），并定期合并写入存储"""
+        flush_task = asyncio.create_task(self._flush_loop())
+        attempt = 0
+        try:
+            await self._symbols_ready.wait()
+            while True:
+                try:
+                    await self._connect_and_read()
+                    attempt = 0  # 正常读到断开，说明连接曾经建立成功
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log_event('bpx_ws_error', f"BPX行情推送连接失败: {e}", logging.WARNING)
+                self.connected = False
+                BPX_WS_CONNECTED.set(0)
+                delay = min(BPX_WS_RECONNECT_MAX, 1 + _backoff_delay(attempt))
+                attempt += 1
+                BPX_WS_RECONNECTS.inc()
+                log_event('bpx_ws_disconnected', f"BPX行情推送断开，{delay:.1f}s 后重连（期间使用 REST 获取价格）",
+                          logging.WARNING, reconnect_delay_s=round(delay, 1))
+                await asyncio.sleep(delay)
+        finally:
+            flush_task.cancel()
+            self.connected = False
+
+    async def _connect_and_read(self):
+        async with self.client.ws_connect(self.url or BPX_WS_URL, heartbeat=BPX_WS_HEARTBEAT) as ws:
+            self._ws = ws
+            try:
+                await ws.send_json({
+                    'method': 'SUBSCRIBE',
+                    'params': _streams('ticker', self._symbols) + _streams('depth', self._depth_symbols),
+                })
+                self.connected = True
+                self._last_message = time.time()
+                BPX_WS_CONNECTED.set(1)
+                log_event('bpx_ws_connected', f"✓ BPX行情推送已连接，订阅 {len(self._symbols)} 个币种",
+                          symbols=len(self._symbols))
+                async for message in ws:
+                    if message.type == aiohttp.WSMsgType.TEXT:
+                        self._on_message(message.data)
+                    elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                        break
+            finally:
+                self._ws = None
+
+    def _on_message(self, raw):
+        """处理一条推送：{"stream": "ticker.SOL_USDC_PERP", "data": {"e": "ticker", "s": ..., "c": 最新价, "E": 微秒}}"""
+        now = time.time()
+        self._last_message = now
+        BPX_WS_MESSAGES.inc()
+        try:
+            data = json.loads(raw).get('data') or {}
+            if data.get('e') == 'depth':
+                if self.on_depth is not None:
+                    self.on_depth(data)
+                return
+            if data.get('e') != 'ticker':
+                return
+            price = float(data['c'])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return
+        if price <= 0:
+            return
+        base = _bpx_base(data.get('s', ''))
+        if base is None:
+            return
+        self.prices[base] = price
+        self._pending[base] = price
+        # 交易所事件时间（微秒），用于统计从成交到页面可见的延迟
+        self._pending_event_times.setdefault(base, data.get('E', now * 1e6) / 1e6)
+
+    async def _flush_loop(self):
+        """每 BPX_WS_COALESCE_INTERVAL 秒把积累的价格变化合并写入存储"""
+        while True:
+            await asyncio.sleep(BPX_WS_COALESCE_INTERVAL)
+            if not self._pending:
+                continue
+            pending, event_times = self._pending, self._pending_event_times
+            self._pending, self._pending_event_times = {}, {}
+            now = time.time()
+            if store.update_prices('bpx', pending, now):
+                published = time.time()
+                for event_time in event_times.values():
+                    BPX_PRICE_LATENCY_SECONDS.observe(max(0.0, published - event_time))
+
+def _streams(kind, symbols):
+    return [f'{kind}.{symbol}' for symbol in sorted(symbols)]
+
+# ==================== 盘口深度 ====================
+class OrderBook:
+    """单个币种的订单簿（紧凑的有序数组）
+
+    每侧用两个 array('d') 保存排序键和数量：卖盘的排序键是价格，买盘是负价格，两侧都按成交优先顺序
+    升序排列，更新档位和从最优价开始吃单共用同一套二分查找和遍历。增量更新保留完整的订单簿（截断后
+    被吃掉的档位无法从增量恢复），只在计算成交结果时最多遍历 DEPTH_MAX_LEVELS 档。
+
+    Args:
+        bids: 买盘 [[价格, 数量], ...]（字符串或数字）
+        asks: 卖盘 [[价格, 数量], ...]
+        update_id: 快照对应的更新序号
+    """
+
+    SIDES = {'bids': -1.0, 'asks': 1.0}  # 侧 -> 排序键 = 价格 * 系数
+
+    def __init__(self, bids=(), asks=(), update_id=0):
+        self._keys = {side: array('d') for side in self.SIDES}
+        self._sizes = {side: array('d') for side in self.SIDES}
+        self.update_id = update_id
+        self.version = 0  # 每次更新加一，用于缓存计算结果
+        self.update(bids, asks, update_id)
+
+    def update(self, bids, asks, update_id):
+        """应用一批档位变化（数量为 0 表示删除该档）"""
+        for side, levels in (('bids', bids), ('asks', asks)):
+            sign = self.SIDES[side]
+            keys, sizes = self._keys[side], self._sizes[side]
+            for price, size in levels:
+                key, size = float(price) * sign, float(size)
+                i = bisect.bisect_left(keys, key)
+                if i < len(keys) and keys[i] == key:
+                    if size > 0:
+                        sizes[i] = size
+                    else:
+                        del keys[i], sizes[i]
+                elif size > 0:
+                    keys.insert(i, key)
+                    sizes.insert(i, size)
+        self.update_id = update_id
+        self.version += 1
+
+    def best(self, side):
+        """某侧最优价，没有挂单时返回 None"""
+        keys = self._keys[side]
+        return keys[0] * self.SIDES[side] if keys else None
+
+    def fill(self, side, notional):
+        """从最优价开始吃 side 一侧的挂单，直到成交额达到 notional（最多 DEPTH_MAX_LEVELS 档）
+
+        Returns:
+            tuple: (成交均价, 实际成交额)；深度不足时实际成交额小于 notional，没有挂单时均价为 None
+        """
+        sign = self.SIDES[side]
+        filled = quantity = 0.0
+        for key, size in islice(zip(self._keys[side], self._sizes[side]), DEPTH_MAX_LEVELS):
+            price = key * sign
+            take = min(size, (notional - filled) / price)
+            filled += take * price
+            quantity += take
+            if filled >= notional:
+                break
+        return (filled / quantity if quantity else None), filled
+
+class DepthTracker:
+    """Backpack 盘口深度：按目标名义金额计算可成交均价（VWAP）、滑点和可成交价差
+
+    - 只跟踪推荐等级 >= DEPTH_MIN_LEVEL 的币种（按费率差从大到小最多 DEPTH_MAX_SYMBOLS 个），
+      每个新版本从快照头部选出，订单簿维护的开销不随币种总数增长；
+    - 行情推送可用时订阅 depth 流增量更新，新跟踪或序号断档的币种用 REST 获取快照后接上推送；
+      推送不可用时每 DEPTH_REFRESH_INTERVAL 秒用 REST 刷新；REST 请求计入 Backpack 请求预算；
+    - 每个订单簿的计算结果按版本缓存，只重新计算变化过的币种；只有盘口变化（价格没有变化）时
+      每 BPX_WS_COALESCE_INTERVAL 秒合并生成一个新版本。
+
+    Args:
+        adapter: BackpackAdapter（共享其 HTTP 客户端、行情推送和请求预算）
+    """
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+        self.books = {}          # {base: OrderBook}，已与交易所同步的订单簿
+        self._symbols = []       # 跟踪的币种，按费率差从大到小
+        self._buffers = {}       # {base: 快照到达前收到的增量}
+        self._results = {}       # {base: (订单簿版本, 各名义金额的成交结果)}
+        self._changed_version = None  # 最近一次盘口变化时的数据版本，发布后清空
+        self._wake = asyncio.Event()
+
+    def select(self, snapshot, update_count=None):
+        """按新版本快照选出跟踪的币种（作为存储的监听器）
+
+        快照的行按费率差绝对值降序排列，推荐等级随之单调，只需看头部几行。
+        """
+        symbols = []
+        for row in snapshot.rows:
+            if row['recommendation']['level'] < DEPTH_MIN_LEVEL or len(symbols) >= DEPTH_MAX_SYMBOLS:
+                break
+            symbols.append(row['symbol'])
+        if set(symbols) != set(self._symbols):
+            self._wake.set()
+        self._symbols = symbols
+
+    def describe(self, base, reference_price, buy):
+        """某币种在 BP 一侧按 DEPTH_NOTIONALS 成交的情况
+
+        Args:
+            base: 币种
+            reference_price: 对冲腿（VAR）价格，用于计算可成交价差
+            buy: 是否在 BP 买入（费率差 > 0，即 VAR空/BP多）
+
+        Returns:
+            dict: {'side', 'best', 'levels': [{'notional', 'vwap', 'slippage', 'spread', 'filled'}]}，
+                  滑点和价差均为 %，价差与 price_spread 同号（BP 相对 VAR）；未跟踪或订单簿为空时返回 None
+        """
+        book = self.books.get(base)
+        if book is None:
+            return None
+        side = 'asks' if buy else 'bids'
+        best = book.best(side)
+        if best is None:
+            return None
+        cached = self._results.get(base)
+        if cached is None or cached[0] != (book.version, side):
+            cached = ((book.version, side), [book.fill(side, notional) for notional in DEPTH_NOTIONALS])
+            self._results[base] = cached
+        levels = []
+        for notional, (vwap, filled) in zip(DEPTH_NOTIONALS, cached[1]):
+            levels.append({
+                'notional': notional,
+                'vwap': vwap,
+                'slippage': abs(vwap - best) / best * 100,
+                'spread': (vwap - reference_price) / reference_price * 100 if reference_price > 0 else None,
+                'filled': filled >= notional,
+            })
+        return {'side': 'buy' if buy else 'sell', 'best': best, 'levels': levels}
+
+    def on_depth(self, data):
+        """处理一条 depth 推送：{"e": "depth", "s": symbol, "a": [[价, 量]], "b": [[价, 量]], "U": 首序号, "u": 末序号}"""
+        base = _bpx_base(data.get('s', ''))
+        if base not in self._symbols:
+            return
+        try:
+            first, last = int(data['U']), int(data['u'])
+        except (KeyError, TypeError, ValueError):
+            return
+        book = self.books.get(base)
+        if book is None:
+            # 快照尚未到达：先缓存，快照到达后接上
+            self._buffers.setdefault(base, deque(maxlen=DEPTH_BUFFER_SIZE)).append(data)
+            return
+        if last <= book.update_id:
+            return
+        if first > book.update_id + 1:
+            # 序号断档（如断线重连）：丢弃订单簿，重新获取快照
+            del self.books[base]
+            self._buffers[base] = deque([data], maxlen=DEPTH_BUFFER_SIZE)
+            DEPTH_RESYNCS.inc('gap')
+            self._wake.set()
+            return
+        book.update(data.get('b', ()), data.get('a', ()), last)
+        DEPTH_UPDATES.inc()
+        self._mark_changed()
+
+    def _mark_changed(self):
+        self._changed_version = store.version
+
+    async def run(self):
+        """按跟踪的币种维护订单簿"""
+        store.depth = self
+        store.add_listener(self.select)
+        stream = self.adapter.stream
+        if stream is not None:
+            stream.on_depth = self.on_depth
+        flush_task = asyncio.create_task(self._flush_loop())
+        try:
+            while True:
+                try:
+                    await self._sync()
+                except Exception as e:
+                    log_event('depth_error', f"BPX盘口深度更新失败: {e}", logging.WARNING, exc_info=e)
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=DEPTH_REFRESH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+        finally:
+            flush_task.cancel()
+
+    async def _sync(self):
+        """更新订阅，并为缺少快照的币种获取快照（推送不可用时刷新所有跟踪的币种）"""
+        symbols = list(self._symbols)
+        for state in (self.books, self._buffers, self._results):
+            for base in [base for base in state if base not in symbols]:
+                del state[base]
+        DEPTH_TRACKED_SYMBOLS.set(len(symbols))
+
+        stream = self.adapter.stream
+        streaming = stream is not None and stream.healthy
+        if stream is not None:
+            await stream.set_depth_symbols(_bpx_symbol(base) for base in symbols)
+
+        needed = [base for base in symbols if not streaming or base not in self.books]
+        now = time.time()
+        needed = needed[:max(0, self.adapter.budget_remaining(now))]
+        if not needed:
+            return
+        self.adapter._spend(now, len(needed))
+        for base in needed:
+            DEPTH_RESYNCS.inc('poll' if base in self.books else 'snapshot')
+        results = await asyncio.gather(*(self._fetch_snapshot(base) for base in needed), return_exceptions=True)
+        for base, result in zip(needed, results):
+            if isinstance(result, Exception):
+                log_event('depth_snapshot_error', f"BPX订单簿获取失败 {base}: {result}", logging.WARNING,
+                          symbol=base, error=repr(result))
+
+    async def _fetch_snapshot(self, base):
+        async with self.adapter.client.get(
+            f"{BPX_API_BASE}/api/v1/depth?symbol={_bpx_symbol(base)}",
+            exchange='bpx',
+            timeout=10
+        ) as response:
+            if response.status != 200:
+                raise RuntimeError(f'HTTP {response.status}')
+            data = await response.json()
+        book = OrderBook(data.get('bids', ()), data.get('asks', ()), int(data.get('lastUpdateId') or 0))
+
+        # 接上快照之后的推送；缓存的增量与快照之间有断档时等下一轮重新获取
+        for event in self._buffers.pop(base, ()):
+            first, last = int(event['U']), int(event['u'])
+            if last <= book.update_id:
+                continue
+            if first > book.update_id + 1:
+                return
+            book.update(event.get('b', ()), event.get('a', ()), last)
+        if base in self._symbols:
+            self.books[base] = book
+            self._mark_changed()
+
+    async def _flush_loop(self):
+        """盘口变化后，若之后没有其它数据更新生成新版本，每 BPX_WS_COALESCE_INTERVAL 秒合并生成一次"""
+        while True:
+            await asyncio.sleep(BPX_WS_COALESCE_INTERVAL)
+            changed_version, self._changed_version = self._changed_version, None
+            if changed_version is not None and changed_version == store.version:
+                store.update_depth()
+
+def _bpx_symbol(base):
+    """标准币种名 -> Backpack 永续合约 symbol"""
+    return f"{symbol_registry.native('bpx', base)}{BPX_PERP_SUFFIX}"
+
+# ==================== 交易所适配器 ====================
+class ExchangeAdapter:
+    """交易所适配器基类
+
+    每个交易所一个子类，负责该交易所的接口地址、symbol 解析和刷新节奏。fetch 返回
+    按标准币种名（见 SYMBOL_ALIASES）索引的统一格式数据，由调度器一起写入存储：
+
+        {
+            'funding_rates': {币种: 每个结算周期的费率（%）},
+            'funding_intervals': {币种: 结算间隔（秒）},
+            'prices': {币种: 价格},
+            'stale_symbols': [沿用上次费率的币种]（可选）,
+            'fetched_at': 价格数据获取时间戳,
+            'success': True,
         }
-        .tooltip {
-            position: relative;
-            cursor: help;
+
+    获取失败时返回 {'success': False}，本轮保留该交易所上次的数据。
+
+    Args:
+        client: 共享的 ExchangeHttpClient
+    """
+
+    name = None
+
+    def __init__(self, client):
+        self.client = client
+
+    @property
+    def label(self):
+        """显示名"""
+        return EXCHANGE_LABELS.get(self.name, self.name)
+
+    async def fetch(self, now):
+        """获取一轮数据
+
+        Args:
+            now: 本轮开始的时间戳
+
+        Returns:
+            dict: 见类说明
+        """
+        raise NotImplementedError
+
+    def describe(self, data):
+        """本轮结果的日志摘要"""
+        return f"{self.label}: {len(data['prices'])} 币种"
+
+    def log_fields(self, data):
+        """本轮结果的结构化日志字段"""
+        return {'symbols': len(data['prices'])}
+
+    def background_tasks(self):
+        """需要与调度器一起运行的后台任务（如行情推送）
+
+        Returns:
+            dict: {任务名: 协程函数}，任务异常退出时由 supervise() 重新调用协程函数重启
+        """
+        return {}
+
+class VarAdapter(ExchangeAdapter):
+    """Variational：stats 接口一次返回所有币种的年化费率、结算间隔和标记价格，每轮获取一次"""
+
+    name = 'var'
+
+    async def fetch(self, now):
+        try:
+            # VAR API 不需要代理
+            async with self.client.get(VAR_STATS_API, exchange=self.name, timeout=15) as response:
+                if response.status != 200:
+                    log_event('var_stats_error', f"VAR API错误: HTTP {response.status}", logging.WARNING,
+                              status=response.status)
+                    return {'success': False}
+                data = await response.json()
+        except Exception as e:
+            log_event('var_stats_error', f"VAR获取失败: {e}", logging.WARNING, error=repr(e))
+            return {'success': False}
+
+        fetched_at = time.time()
+        funding_rates = {}
+        funding_intervals = {}
+        prices = {}
+        for listing in data.get('listings', []):
+            ticker = listing.get('ticker', '')
+            if not ticker:
+                continue
+            symbol = symbol_registry.canonical(self.name, ticker)
+            funding_interval_s = int(listing.get('funding_interval_s', 3600))
+
+            # funding_rate是年化费率（小数格式）
+            # 例如：BTC funding_rate=0.1095 表示年化10.95%
+            # 每个结算周期的费率 = 年化费率 / 一年的小时数 * 每个周期的小时数
+            annual_rate_percent = float(listing.get('funding_rate', 0)) * 100
+            funding_rates[symbol] = annual_rate_percent / HOURS_PER_YEAR * funding_interval_s / 3600
+            funding_intervals[symbol] = funding_interval_s
+            prices[symbol] = float(listing.get('mark_price', 0))
+
+        return {
+            'funding_rates': funding_rates,
+            'funding_intervals': funding_intervals,
+            'prices': prices,
+            'fetched_at': fetched_at,
+            'success': True
         }
-        .tooltip:hover::after {
-            content: attr(data-tooltip);
-            position: absolute;
-            bottom: 100%;
-            left: 50%;
-            transform: translateX(-50%);
-            background: rgba(0, 0, 0, 0.9);
-            color: white;
-            padding: 8px 12px;
-            border-radius: 6px;
-            white-space: nowrap;
-            font-size: 11px;
-            z-index: 1000;
+
+class BackpackAdapter(ExchangeAdapter):
+    """Backpack：按各类数据的变化频率分别刷新，取代固定间隔的全量获取
+
+    - 价格每轮都刷新；启用行情推送（BPX_WS_ENABLED）且连接正常时，价格由推送逐笔更新，
+      不再请求 tickers；
+    - markets（币种列表、结算间隔）每 MARKETS_REFRESH_INTERVAL 秒刷新一次；
+    - 资金费率（BPX_FUNDING_BULK）每轮用 markPrices 一次获取所有币种的当前费率；
+    - 批量接口失败或未返回的币种改为逐个请求 fundingRates：每个币种在下一次结算后
+      FUNDING_SETTLEMENT_DELAY 秒才重新获取，失败或新一期结果尚未发布时每
+      FUNDING_RETRY_INTERVAL 秒重试；
+    - 经代理的请求受 BPX_REQUEST_BUDGET_PER_MINUTE 限制，价格、markets 和批量费率优先，
+      剩余预算不够时优先逐个刷新没有数据的币种和费率差接近推荐阈值的币种，其余顺延到下一轮。
+    """
+
+    name = 'bpx'
+
+    def __init__(self, client):
+        super().__init__(client)
+        self.stream = BackpackPriceStream(client) if BPX_WS_ENABLED else None
+        self.depth = DepthTracker(self) if DEPTH_ENABLED else None
+        self._request_times = deque()   # 最近一分钟内 Backpack 请求的时间戳
+        self._markets_due = 0.0
+        self._perp_symbols = {}         # {base: 完整symbol}，只包含需要获取资金费率的币种
+        self._funding_intervals = {}    # {base: 结算间隔（秒）}
+        self._prices = {}               # 最近一次成功获取的 BP 价格
+        self._prices_fetched_at = None
+        self._funding_rates = {}        # {base: 百分比费率}，跨轮保留
+        self._funding_due = {}          # {base: 下次获取资金费率的时间戳}
+        self._failed_symbols = set()    # 最近一次获取失败的币种
+
+    def background_tasks(self):
+        tasks = {'bpx_stream': self.stream.run} if self.stream is not None else {}
+        if self.depth is not None:
+            tasks['bpx_depth'] = self.depth.run
+        return tasks
+
+    def budget_remaining(self, now):
+        """最近一分钟内还可以发出的 Backpack 请求数"""
+        while self._request_times and self._request_times[0] <= now - 60:
+            self._request_times.popleft()
+        return BPX_REQUEST_BUDGET_PER_MINUTE - len(self._request_times)
+
+    def _spend(self, now, count):
+        self._request_times.extend([now] * count)
+
+    def describe(self, data):
+        return (f"BPX: {len(data['prices'])} 币种 "
+                f"(资金费率: 批量获取 {data['funding_bulk']} 个, 逐个获取 {data['funding_fetched']} 个, "
+                f"顺延 {data['funding_deferred']} 个, "
+                f"过期: {len(data['stale_symbols'])} 个, 耗时 {data['funding_fetch_ms']:.0f}ms, "
+                f"剩余预算 {self.budget_remaining(time.time())} 次/分钟)")
+
+    def log_fields(self, data):
+        return {
+            'symbols': len(data['prices']),
+            'funding_bulk': data['funding_bulk'],
+            'funding_fetched': data['funding_fetched'],
+            'funding_deferred': data['funding_deferred'],
+            'stale': len(data['stale_symbols']),
+            'funding_fetch_ms': round(data['funding_fetch_ms'], 1),
+            'budget_remaining': self.budget_remaining(time.time()),
         }
-    </style>
+
+    async def fetch(self, now):
+        """刷新Backpack数据：tickers 和批量资金费率每轮获取，markets 按需获取，逐个请求只用于
+        批量接口未覆盖的到期币种
+
+        tickers 与 markets、资金费率并发进行；行情推送正常时价格直接取自推送，不请求 tickers。
+        返回的是合并了历史数据的完整数据，未到期或本轮失败的币种沿用上次的费率。
+        """
+        try:
+            return await self._refresh(now)
+        finally:
+            BPX_REQUEST_BUDGET_REMAINING.set(self.budget_remaining(time.time()))
+
+    async def _refresh(self, now):
+        use_stream = self.stream is not None and self.stream.healthy
+        tickers_task = asyncio.create_task(
+            self._stream_prices() if use_stream else _fetch_bpx_tickers(self.client)
+        )
+        markets_due = now >= self._markets_due
+        self._spend(now, (0 if use_stream else 1) + (1 if markets_due else 0))
+        try:
+            # 1. 到期时刷新市场信息（币种列表、结算间隔），失败时沿用上次的
+            if markets_due:
+                try:
+                    markets = await _fetch_bpx_markets(self.client)
+                except Exception as e:
+                    log_event('bpx_markets_error', f"BPX市场信息获取失败: {e}", logging.WARNING, error=repr(e))
+                    markets = None
+                if markets is not None:
+                    self._apply_markets(*markets)
+                    self._markets_due = now + MARKETS_REFRESH_INTERVAL
+                    if self.stream is not None:
+                        await self.stream.set_symbols(self._perp_symbols.values())
+            if not self._perp_symbols:
+                return {'success': False}
+
+            # 2. 批量获取所有币种的当前资金费率，覆盖的币种推迟到下次结算后才需要逐个请求
+            fanout_start = time.perf_counter()
+            bulk_count = 0
+            if BPX_FUNDING_BULK:
+                self._spend(now, 1)
+                try:
+                    bulk_result = await _fetch_bpx_mark_prices(self.client)
+                except Exception as e:
+                    log_event('bpx_mark_prices_error', f"BPX批量资金费率获取失败: {e}", logging.WARNING,
+                              error=repr(e))
+                    bulk_result = None
+                if bulk_result is not None:
+                    bulk_count = self._apply_bulk_funding(now, bulk_result)
+
+            # 3. 在预算内并发逐个获取其余到期币种的资金费率，同时等待价格数据
+            due_symbols, deferred = self._select_funding_symbols(now)
+            self._spend(now, len(due_symbols))
+            fanout_result, ticker_result = await asyncio.gather(
+                _fetch_bpx_funding_fanout(self.client, [self._perp_symbols[base] for base in due_symbols]),
+                tickers_task,
+                return_exceptions=True
+            )
+            funding_fetch_ms = (time.perf_counter() - fanout_start) * 1000
+            if isinstance(fanout_result, BaseException):
+                log_event('bpx_funding_error', f"BPX资金费率获取失败: {fanout_result}", logging.ERROR,
+                          exc_info=fanout_result)
+                fanout_result = ({}, due_symbols)
+            self._apply_funding(now, *fanout_result)
+
+            # 价格获取失败时沿用上次的价格
+            if isinstance(ticker_result, BaseException):
+                log_event('bpx_tickers_error', f"BPX价格获取失败: {ticker_result}", logging.WARNING,
+                          error=repr(ticker_result))
+            elif ticker_result is not None:
+                self._prices, self._prices_fetched_at = ticker_result
+
+            # 获取失败的币种，以及已过结算时间但因预算顺延的币种，费率都已过期
+            stale_symbols = self._failed_symbols.union(deferred)
+            return {
+                'prices': self._prices,
+                'funding_rates': dict(self._funding_rates),
+                'funding_intervals': self._funding_intervals,
+                'stale_symbols': [base for base in stale_symbols if base in self._funding_rates],
+                'funding_bulk': bulk_count,
+                'funding_fetched': len(due_symbols) - len(fanout_result[1]),
+                'funding_deferred': len(deferred),
+                'funding_fetch_ms': funding_fetch_ms,
+                'fetched_at': self._prices_fetched_at,
+                'success': True
+            }
+        finally:
+            if not tickers_task.done():
+                tickers_task.cancel()
+
+    async def _stream_prices(self):
+        """行情推送的最新价（尚未收到推送的币种沿用上次 REST 获取的价格）"""
+        return {**self._prices, **self.stream.prices}, time.time()
+
+    def _apply_markets(self, perp_symbols, funding_intervals):
+        """更新币种列表，下架的币种不再获取"""
+        self._perp_symbols = dict(perp_symbols)
+        self._funding_intervals = {base: funding_intervals[base] for base in self._perp_symbols}
+        for state in (self._funding_rates, self._funding_due):
+            for base in [base for base in state if base not in self._perp_symbols]:
+                del state[base]
+        self._failed_symbols &= self._perp_symbols.keys()
+
+    def _select_funding_symbols(self, now):
+        """选出本轮要获取资金费率的币种
+
+        Returns:
+            tuple: (本轮获取的币种, 到期但因预算不足顺延的币种)
+        """
+        due = [base for base in self._perp_symbols if self._funding_due.get(base, 0) <= now]
+        budget = max(0, self.budget_remaining(now))
+        if len(due) <= budget:
+            return due, []
+        due.sort(key=self._funding_priority)
+        BPX_FUNDING_DEFERRED_SYMBOLS.inc(amount=len(due) - budget)
+        return due[:budget], due[budget:]
+
+    def _funding_priority(self, base):
+        """排序键：没有数据的币种最先，其次是费率差离推荐阈值最近的币种，不显示的币种最后"""
+        if base not in self._funding_rates:
+            return (0, 0.0)
+        row = store.snapshot.by_symbol.get(base)
+        if row is None:
+            return (2, 0.0)
+        diff = abs(row['funding_rate_diff'])
+        return (1, min(abs(diff - threshold) for threshold in RECOMMENDATION_THRESHOLDS))
+
+    def _apply_bulk_funding(self, now, funding_rates):
+        """记录批量接口的结果，返回覆盖的币种数
+
+        批量接口给出的是下次结算时间；换算成本期开始时间后按逐个获取的规则安排下次获取，
+        批量接口一直可用时这些币种每轮都会被刷新，不会到期。
+        """
+        covered = {}
+        for base, (rate, next_funding) in funding_rates.items():
+            if base in self._perp_symbols:
+                interval = self._funding_intervals.get(base, 3600)
+                covered[base] = (rate, next_funding - interval if next_funding is not None else None)
+        self._apply_funding(now, covered, ())
+        return len(covered)
+
+    def _apply_funding(self, now, funding_rates, failed_symbols):
+        """记录本轮获取结果，并安排每个币种下次获取的时间"""
+        for base, (rate, interval_end) in funding_rates.items():
+            self._funding_rates[base] = rate
+            self._failed_symbols.discard(base)
+            interval = self._funding_intervals.get(base, 3600)
+            if interval_end is None:
+                due = now + interval
+            else:
+                # 下一次结算之后再获取；结算时间已过（新一期结果尚未发布）时很快重试
+                due = interval_end + interval + FUNDING_SETTLEMENT_DELAY
+            self._funding_due[base] = min(
+                max(due, now + FUNDING_RETRY_INTERVAL), now + FUNDING_REFRESH_MAX_INTERVAL
+            )
+        for base in failed_symbols:
+            self._failed_symbols.add(base)
+            self._funding_due[base] = now + FUNDING_RETRY_INTERVAL
+
+# 适配器名 -> 适配器类；新增交易所时实现 ExchangeAdapter，在这里登记并加入 ENABLED_EXCHANGES
+EXCHANGE_ADAPTERS = {
+    'bpx': BackpackAdapter,
+    'var': VarAdapter,
+}
+
+def create_adapters(client):
+    """按 ENABLED_EXCHANGES 创建交易所适配器"""
+    return [EXCHANGE_ADAPTERS[name](client) for name in ENABLED_EXCHANGES]
+
+# ==================== 刷新调度 ====================
+class RefreshScheduler:
+    """每轮并发调用所有交易所适配器，全部完成（或截止）后一次性写入存储
+
+    每轮实际请求哪些数据由各适配器按自身的刷新节奏决定；超过 UPDATE_CYCLE_DEADLINE
+    未完成或获取失败的交易所本轮保留上次数据。
+
+    Args:
+        client: 共享的 ExchangeHttpClient
+        history: HistoryStore，None 表示不记录历史
+        adapters: 交易所适配器列表，默认按 ENABLED_EXCHANGES 创建
+    """
+
+    def __init__(self, client, history=None, adapters=None):
+        self.client = client
+        self.history = history
+        self.adapters = adapters if adapters is not None else create_adapters(client)
+        self._last_history_record = 0.0
+
+    async def tick(self):
+        """执行一轮刷新
+
+        Returns:
+            float: 本轮获取耗时（毫秒）
+        """
+        cycle_start = time.perf_counter()
+        now = time.time()
+
+        tasks = {asyncio.create_task(adapter.fetch(now)): adapter for adapter in self.adapters}
+        done, pending = await asyncio.wait(tasks, timeout=UPDATE_CYCLE_DEADLINE)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            log_event('update_timeout',
+                      f"更新超时: {len(pending)} 个交易所未在 {UPDATE_CYCLE_DEADLINE}s 内完成，保留上次数据",
+                      logging.WARNING, exchanges=[tasks[task].name for task in pending],
+                      deadline_s=UPDATE_CYCLE_DEADLINE)
+
+        exchange_data = {}
+        for task, adapter in tasks.items():
+            data = None
+            if task in done:
+                if task.exception() is not None:
+                    log_event('exchange_fetch_error', f"{adapter.label}获取失败: {task.exception()}",
+                              logging.ERROR, exc_info=task.exception(), exchange=adapter.name)
+                else:
+                    data = task.result()
+            if data is None or not data['success']:
+                EXCHANGE_FETCH_FAILURES.inc(adapter.name)
+                data = None  # 获取失败时保留上次数据
+            exchange_data[adapter.name] = data
+
+        # 所有交易所都完成（或截止）后一次性更新存储
+        cycle_ms = (time.perf_counter() - cycle_start) * 1000
+        UPDATE_CYCLE_SECONDS.observe(cycle_ms / 1000)
+        store.update_data(exchange_data, cycle_ms=cycle_ms)
+        if self.history is not None and now - self._last_history_record >= HISTORY_SAMPLE_INTERVAL:
+            self.history.record(store.snapshot)
+            self._last_history_record = now
+        conn_stats = self.client.pop_connection_stats()
+
+        if any(data is not None for data in exchange_data.values()):
+            results = ', '.join(
+                adapter.describe(exchange_data[adapter.name]) if exchange_data[adapter.name] is not None
+                else f"{adapter.label}: 沿用上次数据"
+                for adapter in self.adapters
+            )
+            leg_skew_ms = store.get_stats()['leg_skew_ms']
+            log_event('update_ok',
+                      f"数据更新成功 - {results} | "
+                      f"耗时 {cycle_ms:.0f}ms | "
+                      f"新建连接 {conn_stats['new']} 个 ({conn_stats['connect_ms']:.0f}ms), "
+                      f"复用 {conn_stats['reused']} 个 | "
+                      f"交易所时间差 {leg_skew_ms}ms",
+                      version=store.version,
+                      cycle_ms=round(cycle_ms, 1),
+                      new_connections=conn_stats['new'],
+                      connect_ms=round(conn_stats['connect_ms'], 1),
+                      reused_connections=conn_stats['reused'],
+                      leg_skew_ms=leg_skew_ms,
+                      exchanges={
+                          adapter.name: adapter.log_fields(exchange_data[adapter.name])
+                          if exchange_data[adapter.name] is not None else None
+                          for adapter in self.adapters
+                      })
+        return cycle_ms
+
+async def update_funding_rates(client, history=None, adapters=None):
+    """定期更新资金费率数据
+
+    Args:
+        client: 共享的 ExchangeHttpClient
+        history: HistoryStore，None 表示不记录历史
+        adapters: 交易所适配器列表，默认按 ENABLED_EXCHANGES 创建
+    """
+    log_event('updater_started', "开始定期更新资金费率...")
+    scheduler = RefreshScheduler(client, history, adapters)
+
+    while True:
+        tick_start = time.monotonic()
+        try:
+            await scheduler.tick()
+        except Exception as e:
+            log_event('update_error', f"更新失败: {e}", logging.ERROR, exc_info=e)
+            UPDATE_FAILURES.inc()
+
+        # 每 PRICE_REFRESH_INTERVAL 秒一轮（扣除本轮耗时）
+        await asyncio.sleep(max(0.0, PRICE_REFRESH_INTERVAL - (time.monotonic() - tick_start)))
+
+async def supervise(name, factory):
+    """运行一个后台任务，异常退出时记录错误并在 TASK_RESTART_DELAY 秒后重启，不影响其它任务
+
+    Args:
+        name: 任务名（日志和监控指标中使用）
+        factory: 无参数的协程函数，每次（重新）启动时调用
+    """
+    while True:
+        try:
+            await factory()
+            return
+        except Exception as e:
+            TASK_RESTARTS.inc(name)
+            log_event('task_crashed', f"后台任务 {name} 异常退出，{TASK_RESTART_DELAY}s 后重启: {e!r}",
+                      logging.ERROR, exc_info=e, task=name)
+        await asyncio.sleep(TASK_RESTART_DELAY)
+
+# ==================== Web服务器 ====================
+HISTORY_APP_KEY = web.AppKey('history', object)
+STATIC_ASSETS_KEY = web.AppKey('static_assets', dict)
+
+# 前端页面：HTML 模板、样式和脚本，启动时构建为带内容哈希的静态资源（见 build_static_assets）
+DASHBOARD_HTML = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>VAR资金费率监控</title>
+    <link rel="stylesheet" href="__APP_CSS__">
 </head>
 <body>
     <div class="header">
@@ -612,7 +3598,7 @@ async def handle_index(request):
     <div class="info-box">
         <h3>💡 说明</h3>
         <p>
-            <strong>资金费率</strong>：永续合约中多空双方的资金交换费率（每小时）。正值表示多头支付空头（做空可收费），负值表示空头支付多头（做多可收费）。<br>
+            <strong>资金费率</strong>：永续合约中多空双方的资金交换费率（两边均按结算间隔统一折算为每小时）。正值表示多头支付空头（做空可收费），负值表示空头支付多头（做多可收费）。<br>
             <strong>推荐逻辑</strong>：根据两平台费率差给出套利建议。费率差越大，套利空间越大。<br>
             <strong>操作方式</strong>：在费率高的平台做空收费，在费率低的平台做多对冲，赚取费率差。<br>
             <strong>推荐等级</strong>：🔥 强烈推荐（≥0.02%）、⭐ 推荐（≥0.01%）、✓ 可考虑（≥0.005%）、- 无机会（<0.005%）
@@ -636,6 +3622,10 @@ async def handle_index(request):
             <div class="stat-label">更新次数</div>
             <div class="stat-value" id="update-count">-</div>
         </div>
+        <div class="stat-card">
+            <div class="stat-label">更新耗时</div>
+            <div class="stat-value" id="cycle-time">-</div>
+        </div>
         <div class="stat-card">
             <div class="stat-label">运行时间</div>
             <div class="stat-value" id="runtime">-</div>
@@ -650,9 +3640,10 @@ async def handle_index(request):
                     <th>币种</th>
                     <th class="tooltip" data-tooltip="VAR交易所资金费率（每小时）">VAR费率/小时</th>
                     <th class="tooltip" data-tooltip="VAR资金费结算间隔">VAR间隔</th>
-                    <th class="tooltip" data-tooltip="Backpack资金费率（每小时）">BPX费率/小时</th>
+                    <th class="tooltip" data-tooltip="Backpack资金费率（按结算间隔折算为每小时）">BPX费率/小时</th>
                     <th class="tooltip" data-tooltip="Backpack资金费结算间隔">BPX间隔</th>
-                    <th class="tooltip" data-tooltip="两平台资金费率差异（VAR - BPX）">费率差/小时</th>
+                    <th class="tooltip" data-tooltip="两平台资金费率差异（VAR - BPX，统一为每小时）">费率差/小时</th>
+                    <th class="tooltip" data-tooltip="费率差年化（每小时 × 24 × 365）">年化费率差</th>
                     <th class="tooltip" data-tooltip="VAR标记价格">VAR价格</th>
                     <th class="tooltip" data-tooltip="Backpack最新价格">BPX价格</th>
                     <th class="tooltip" data-tooltip="价格差异百分比">价差%</th>
@@ -661,7 +3652,7 @@ async def handle_index(request):
             </thead>
             <tbody id="funding-table">
                 <tr>
-                    <td colspan="11" class="loading">正在加载数据...</td>
+                    <td colspan="12" class="loading">正在加载数据...</td>
                 </tr>
             </tbody>
         </table>
@@ -669,211 +3660,1066 @@ async def handle_index(request):
 
     <div class="update-time" id="update-time">-</div>
 
-    <script>
-        function formatFundingRate(rate) {
-            if (rate === 0) return '-';
-            // VAR API返回的funding_rate已经是百分比格式，不需要再乘100
-            return (rate > 0 ? '+' : '') + rate.toFixed(4) + '%';
-        }
+    <script src="__APP_JS__"></script>
+</body>
+</html>
+"""
 
-        function formatPrice(price) {
-            if (price === 0) return '-';
-            if (price >= 1000) return price.toFixed(2);
-            if (price >= 10) return price.toFixed(3);
-            if (price >= 1) return price.toFixed(4);
-            if (price >= 0.1) return price.toFixed(5);
-            return price.toFixed(6);
-        }
+DASHBOARD_CSS = """
+* { margin: 0; padding: 0; box-sizing: border-box; }
+body {
+    font-family: 'Monaco', 'Menlo', 'Consolas', monospace;
+    background: linear-gradient(135deg, #0a0e27 0%, #1a1f3a 100%);
+    color: #e0e0e0;
+    padding: 20px;
+    min-height: 100vh;
+}
+.header {
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    padding: 30px;
+    border-radius: 15px;
+    margin-bottom: 20px;
+    box-shadow: 0 8px 16px rgba(0,0,0,0.3);
+}
+.header h1 {
+    font-size: 32px;
+    margin-bottom: 10px;
+    text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
+}
+.header p {
+    opacity: 0.95;
+    font-size: 14px;
+}
+.info-box {
+    background: rgba(26, 31, 58, 0.8);
+    padding: 20px;
+    border-radius: 10px;
+    margin-bottom: 20px;
+    border-left: 4px solid #fbbf24;
+    backdrop-filter: blur(10px);
+}
+.info-box h3 {
+    color: #fbbf24;
+    margin-bottom: 10px;
+    font-size: 16px;
+}
+.info-box p {
+    color: #aaa;
+    font-size: 13px;
+    line-height: 1.8;
+}
+.stats {
+    display: grid;
+    grid-template-columns: repeat(auto-fit, minmax(180px, 1fr));
+    gap: 15px;
+    margin-bottom: 20px;
+}
+.stat-card {
+    background: rgba(26, 31, 58, 0.8);
+    padding: 20px;
+    border-radius: 10px;
+    border-left: 4px solid #667eea;
+    backdrop-filter: blur(10px);
+    transition: transform 0.2s;
+}
+.stat-card:hover {
+    transform: translateY(-2px);
+}
+.stat-label {
+    color: #888;
+    font-size: 11px;
+    margin-bottom: 8px;
+    text-transform: uppercase;
+    letter-spacing: 1px;
+}
+.stat-value {
+    font-size: 28px;
+    font-weight: bold;
+    color: #667eea;
+}
+.table-container {
+    background: rgba(26, 31, 58, 0.8);
+    border-radius: 15px;
+    overflow: hidden;
+    box-shadow: 0 8px 16px rgba(0,0,0,0.3);
+    backdrop-filter: blur(10px);
+}
+table {
+    width: 100%;
+    border-collapse: collapse;
+}
+th {
+    background: rgba(37, 43, 74, 0.9);
+    padding: 18px 15px;
+    text-align: left;
+    font-weight: bold;
+    color: #667eea;
+    position: sticky;
+    top: 0;
+    font-size: 13px;
+    text-transform: uppercase;
+    letter-spacing: 0.5px;
+}
+td {
+    padding: 15px;
+    border-bottom: 1px solid rgba(37, 43, 74, 0.5);
+    font-size: 13px;
+}
+tr:hover {
+    background: rgba(37, 43, 74, 0.5);
+}
+.symbol {
+    font-weight: bold;
+    color: #fff;
+    font-size: 14px;
+}
+.price {
+    font-family: 'Courier New', monospace;
+    color: #aaa;
+}
+.funding-positive {
+    color: #4ade80;
+}
+.funding-negative {
+    color: #f87171;
+}
+.funding-high {
+    color: #a78bfa;
+    font-weight: bold;
+}
+.funding-extreme {
+    color: #fbbf24;
+    font-weight: bold;
+    animation: pulse 2s infinite;
+}
+@keyframes pulse {
+    0%, 100% { opacity: 1; }
+    50% { opacity: 0.7; }
+}
+.spread-positive {
+    color: #4ade80;
+}
+.spread-negative {
+    color: #f87171;
+}
+.spread-large {
+    color: #fbbf24;
+    font-weight: bold;
+}
+.status-ok {
+    color: #4ade80;
+}
+.status-no {
+    color: #666;
+}
+/* 推荐等级样式 */
+.rec-none {
+    color: #666;
+    font-size: 12px;
+}
+.rec-normal {
+    color: #60a5fa;
+    font-weight: 500;
+}
+.rec-good {
+    color: #a78bfa;
+    font-weight: bold;
+}
+.rec-excellent {
+    color: #fbbf24;
+    font-weight: bold;
+    animation: pulse 2s infinite;
+}
+.stale {
+    opacity: 0.55;
+    font-style: italic;
+}
+.has-depth {
+    text-decoration: underline dotted;
+    cursor: help;
+}
+.loading {
+    text-align: center;
+    padding: 60px;
+    color: #888;
+    font-size: 14px;
+}
+.update-time {
+    text-align: center;
+    color: #888;
+    margin-top: 20px;
+    font-size: 12px;
+}
+.opportunity {
+    background: rgba(251, 191, 36, 0.1);
+    border-left: 4px solid #fbbf24;
+}
+.tooltip {
+    position: relative;
+    cursor: help;
+}
+.tooltip:hover::after {
+    content: attr(data-tooltip);
+    position: absolute;
+    bottom: 100%;
+    left: 50%;
+    transform: translateX(-50%);
+    background: rgba(0, 0, 0, 0.9);
+    color: white;
+    padding: 8px 12px;
+    border-radius: 6px;
+    white-space: nowrap;
+    font-size: 11px;
+    z-index: 1000;
+}
+"""
 
-        function formatRuntime(seconds) {
-            const hours = Math.floor(seconds / 3600);
-            const minutes = Math.floor((seconds % 3600) / 60);
-            const secs = seconds % 60;
-            if (hours > 0) return `${hours}h ${minutes}m`;
-            if (minutes > 0) return `${minutes}m ${secs}s`;
-            return `${secs}s`;
-        }
+DASHBOARD_JS = """
+function formatFundingRate(rate) {
+    if (rate === 0) return '-';
+    // VAR API返回的funding_rate已经是百分比格式，不需要再乘100
+    return (rate > 0 ? '+' : '') + rate.toFixed(4) + '%';
+}
+
+function formatPrice(price) {
+    if (price === 0) return '-';
+    if (price >= 1000) return price.toFixed(2);
+    if (price >= 10) return price.toFixed(3);
+    if (price >= 1) return price.toFixed(4);
+    if (price >= 0.1) return price.toFixed(5);
+    return price.toFixed(6);
+}
+
+function formatRuntime(seconds) {
+    const hours = Math.floor(seconds / 3600);
+    const minutes = Math.floor((seconds % 3600) / 60);
+    const secs = seconds % 60;
+    if (hours > 0) return `${hours}h ${minutes}m`;
+    if (minutes > 0) return `${minutes}m ${secs}s`;
+    return `${secs}s`;
+}
+
+function formatInterval(seconds) {
+    if (seconds === 0) return '-';
+    const hours = seconds / 3600;
+    if (hours >= 1) return `${hours.toFixed(0)}小时`;
+    const minutes = seconds / 60;
+    return `${minutes.toFixed(0)}分钟`;
+}
+
+function formatFundingRateDiff(diff) {
+    if (diff === 0) return '-';
+    return (diff > 0 ? '+' : '') + diff.toFixed(4) + '%';
+}
+
+function getRowClass(item) {
+    // 判断是否为高费率差机会
+    const isOpportunity = Math.abs(item.funding_rate_diff) > 0.01;
+    return isOpportunity ? 'opportunity' : '';
+}
+
+function renderRowCells(item, rank) {
+    const varFunding = formatFundingRate(item.var_funding);
+    const varInterval = formatInterval(item.var_interval);
+    const bpxFunding = formatFundingRate(item.bpx_funding_hourly);
+    const bpxInterval = formatInterval(item.bpx_interval);
+
+    // 格式化费率差
+    const fundingDiff = formatFundingRateDiff(item.funding_rate_diff);
+    const fundingDiffApr = item.funding_diff_apr === 0 ? '-' :
+        (item.funding_diff_apr > 0 ? '+' : '') + item.funding_diff_apr.toFixed(1) + '%';
 
-        function formatInterval(seconds) {
-            if (seconds === 0) return '-';
-            const hours = seconds / 3600;
-            if (hours >= 1) return `${hours.toFixed(0)}小时`;
-            const minutes = seconds / 60;
-            return `${minutes.toFixed(0)}分钟`;
+    // 费率差样式
+    let fundingDiffClass = '';
+    if (Math.abs(item.funding_rate_diff) > 0.02) {
+        fundingDiffClass = 'funding-extreme';
+    } else if (Math.abs(item.funding_rate_diff) > 0.01) {
+        fundingDiffClass = 'funding-high';
+    } else if (item.funding_rate_diff > 0) {
+        fundingDiffClass = 'funding-positive';
+    } else if (item.funding_rate_diff < 0) {
+        fundingDiffClass = 'funding-negative';
+    }
+
+    const varPrice = formatPrice(item.var_price);
+    const bpxPrice = formatPrice(item.bpx_price);
+
+    let priceSpreadText = '-';
+    let priceSpreadClass = '';
+    if (item.price_spread !== 0) {
+        priceSpreadText = (item.price_spread > 0 ? '+' : '') + item.price_spread.toFixed(3) + '%';
+        if (Math.abs(item.price_spread) > 0.5) {
+            priceSpreadClass = 'spread-large';
+        } else if (item.price_spread > 0) {
+            priceSpreadClass = 'spread-positive';
+        } else {
+            priceSpreadClass = 'spread-negative';
         }
+    }
+    // 跟踪订单簿的币种：悬停显示 BP 一侧按各目标金额成交的价差和滑点
+    let priceSpreadTitle = '';
+    if (item.depth) {
+        priceSpreadTitle = `BP ${item.depth.side === 'buy' ? '买入' : '卖出'}可成交价差\\n` + item.depth.levels.map(level =>
+            `$${level.notional.toLocaleString()}: ` +
+            (level.spread === null ? '-' : (level.spread > 0 ? '+' : '') + level.spread.toFixed(3) + '%') +
+            `（滑点 ${level.slippage.toFixed(3)}%${level.filled ? '' : '，深度不足'}）`
+        ).join('\\n');
+        priceSpreadClass += ' has-depth';
+    }
+
+    // VAR 资金费率样式
+    let varFundingClass = '';
+    if (Math.abs(item.var_funding) > 0.02) {
+        varFundingClass = 'funding-extreme';
+    } else if (Math.abs(item.var_funding) > 0.01) {
+        varFundingClass = 'funding-high';
+    } else if (item.var_funding > 0) {
+        varFundingClass = 'funding-positive';
+    } else if (item.var_funding < 0) {
+        varFundingClass = 'funding-negative';
+    }
+
+    // BP 资金费率样式
+    let bpxFundingClass = '';
+    if (item.bpx_funding_hourly === 0) {
+        bpxFundingClass = 'status-no';
+    } else if (Math.abs(item.bpx_funding_hourly) > 0.02) {
+        bpxFundingClass = 'funding-extreme';
+    } else if (Math.abs(item.bpx_funding_hourly) > 0.01) {
+        bpxFundingClass = 'funding-high';
+    } else if (item.bpx_funding_hourly > 0) {
+        bpxFundingClass = 'funding-positive';
+    } else if (item.bpx_funding_hourly < 0) {
+        bpxFundingClass = 'funding-negative';
+    }
+    // 悬停显示原始结算周期费率；本轮未按时获取时沿用上次费率
+    let bpxFundingTitle = `原始费率 ${formatFundingRate(item.bpx_funding)} / ${formatInterval(item.bpx_interval)}`;
+    if (item.bpx_funding_stale) {
+        bpxFundingTitle += '（过期数据，沿用上次费率）';
+    }
+    if (item.bpx_funding_stale) {
+        bpxFundingClass += ' stale';
+    }
+
+    // 推荐信息
+    const recommendation = item.recommendation || {text: '-', class: 'rec-none'};
+    const recText = recommendation.text;
+    const recClass = recommendation.class;
+
+
+    return `
+        <td style="color: #888;">${rank}</td>
+        <td class="symbol">${item.symbol}</td>
+        <td class="${varFundingClass}">${varFunding}</td>
+        <td style="color: #aaa; font-size: 12px;">${varInterval}</td>
+        <td class="${bpxFundingClass}" title="${bpxFundingTitle}">${bpxFunding}</td>
+        <td style="color: #aaa; font-size: 12px;">${bpxInterval}</td>
+        <td class="${fundingDiffClass}">${fundingDiff}</td>
+        <td class="${fundingDiffClass}">${fundingDiffApr}</td>
+        <td class="price">${varPrice}</td>
+        <td class="price">${bpxPrice}</td>
+        <td class="${priceSpreadClass}" title="${priceSpreadTitle}">${priceSpreadText}</td>
+        <td class="${recClass}">${recText}</td>
+    `;
+}
+
+// 按币种缓存的表格行，增量更新时只修改变化的行
+const rowElements = new Map();
 
-        function formatFundingRateDiff(diff) {
-            if (diff === 0) return '-';
-            return (diff > 0 ? '+' : '') + diff.toFixed(4) + '%';
+function updateStats(stats) {
+    document.getElementById('total-symbols').textContent = stats.total_symbols;
+    document.getElementById('common-count').textContent = stats.common_count;
+    document.getElementById('high-funding').textContent = stats.high_funding_count;
+    document.getElementById('update-count').textContent = stats.update_count;
+    document.getElementById('runtime').textContent = formatRuntime(stats.runtime);
+    document.getElementById('cycle-time').textContent =
+        stats.last_cycle_ms === null ? '-' : (stats.last_cycle_ms / 1000).toFixed(1) + 's';
+
+    // 更新时间，交易所长时间获取失败时提示正在显示旧数据
+    const stale = Object.entries(stats.stale_exchanges || {})
+        .map(([exchange, age]) => exchange + ' 数据已 ' + age + 's 未更新');
+    document.getElementById('update-time').textContent =
+        '最后更新: ' + new Date().toLocaleTimeString('zh-CN') +
+        ' | 数据更新: ' + stats.last_update +
+        (stale.length ? ' | ⚠️ ' + stale.join('，') : '');
+}
+
+function applyRow(item) {
+    let tr = rowElements.get(item.symbol);
+    let rank = '';
+    if (tr) {
+        rank = tr.firstElementChild.textContent;  // 排名由 applyOrder 维护
+    } else {
+        tr = document.createElement('tr');
+        rowElements.set(item.symbol, tr);
+    }
+    tr.className = getRowClass(item);
+    tr.innerHTML = renderRowCells(item, rank);
+}
+
+function applyOrder(order) {
+    const tbody = document.getElementById('funding-table');
+    order.forEach((symbol, index) => {
+        const tr = rowElements.get(symbol);
+        if (tbody.children[index] !== tr) {
+            tbody.insertBefore(tr, tbody.children[index] || null);
         }
+        const rankCell = tr.firstElementChild;
+        if (rankCell.textContent !== String(index + 1)) {
+            rankCell.textContent = index + 1;
+        }
+    });
+}
 
-        async function updateData() {
-            try {
-                const response = await fetch('/api/data');
-                const data = await response.json();
-
-                // 更新统计
-                document.getElementById('total-symbols').textContent = data.stats.total_symbols;
-                document.getElementById('common-count').textContent = data.stats.common_count;
-                document.getElementById('high-funding').textContent = data.stats.high_funding_count;
-                document.getElementById('update-count').textContent = data.stats.update_count;
-                document.getElementById('runtime').textContent = formatRuntime(data.stats.runtime);
-
-                // 更新表格
-                const tbody = document.getElementById('funding-table');
-                tbody.innerHTML = data.summary.map((item, index) => {
-                    const varFunding = formatFundingRate(item.var_funding);
-                    const varInterval = formatInterval(item.var_interval);
-                    const bpxFunding = formatFundingRate(item.bpx_funding);
-                    const bpxInterval = formatInterval(item.bpx_interval);
-
-                    // 格式化费率差
-                    const fundingDiff = formatFundingRateDiff(item.funding_rate_diff);
-
-                    // 费率差样式
-                    let fundingDiffClass = '';
-                    if (Math.abs(item.funding_rate_diff) > 0.02) {
-                        fundingDiffClass = 'funding-extreme';
-                    } else if (Math.abs(item.funding_rate_diff) > 0.01) {
-                        fundingDiffClass = 'funding-high';
-                    } else if (item.funding_rate_diff > 0) {
-                        fundingDiffClass = 'funding-positive';
-                    } else if (item.funding_rate_diff < 0) {
-                        fundingDiffClass = 'funding-negative';
-                    }
-
-                    const varPrice = formatPrice(item.var_price);
-                    const bpxPrice = formatPrice(item.bpx_price);
-
-                    let priceSpreadText = '-';
-                    let priceSpreadClass = '';
-                    if (item.price_spread !== 0) {
-                        priceSpreadText = (item.price_spread > 0 ? '+' : '') + item.price_spread.toFixed(3) + '%';
-                        if (Math.abs(item.price_spread) > 0.5) {
-                            priceSpreadClass = 'spread-large';
-                        } else if (item.price_spread > 0) {
-                            priceSpreadClass = 'spread-positive';
-                        } else {
-                            priceSpreadClass = 'spread-negative';
-                        }
-                    }
-
-                    // VAR 资金费率样式
-                    let varFundingClass = '';
-                    if (Math.abs(item.var_funding) > 0.02) {
-                        varFundingClass = 'funding-extreme';
-                    } else if (Math.abs(item.var_funding) > 0.01) {
-                        varFundingClass = 'funding-high';
-                    } else if (item.var_funding > 0) {
-                        varFundingClass = 'funding-positive';
-                    } else if (item.var_funding < 0) {
-                        varFundingClass = 'funding-negative';
-                    }
-
-                    // BP 资金费率样式
-                    let bpxFundingClass = '';
-                    if (item.bpx_funding === 0) {
-                        bpxFundingClass = 'status-no';
-                    } else if (Math.abs(item.bpx_funding) > 0.02) {
-                        bpxFundingClass = 'funding-extreme';
-                    } else if (Math.abs(item.bpx_funding) > 0.01) {
-                        bpxFundingClass = 'funding-high';
-                    } else if (item.bpx_funding > 0) {
-                        bpxFundingClass = 'funding-positive';
-                    } else if (item.bpx_funding < 0) {
-                        bpxFundingClass = 'funding-negative';
-                    }
-
-                    // 推荐信息
-                    const recommendation = item.recommendation || {text: '-', class: 'rec-none'};
-                    const recText = recommendation.text;
-                    const recClass = recommendation.class;
-
-                    // 判断是否为高费率差机会
-                    const isOpportunity = Math.abs(item.funding_rate_diff) > 0.01;
-                    const rowClass = isOpportunity ? 'opportunity' : '';
-
-                    return `
-                        <tr class="${rowClass}">
-                            <td style="color: #888;">${index + 1}</td>
-                            <td class="symbol">${item.symbol}</td>
-                            <td class="${varFundingClass}">${varFunding}</td>
-                            <td style="color: #aaa; font-size: 12px;">${varInterval}</td>
-                            <td class="${bpxFundingClass}">${bpxFunding}</td>
-                            <td style="color: #aaa; font-size: 12px;">${bpxInterval}</td>
-                            <td class="${fundingDiffClass}">${fundingDiff}</td>
-                            <td class="price">${varPrice}</td>
-                            <td class="price">${bpxPrice}</td>
-                            <td class="${priceSpreadClass}">${priceSpreadText}</td>
-                            <td class="${recClass}">${recText}</td>
-                        </tr>
-                    `;
-                }).join('');
-
-                // 更新时间
-                document.getElementById('update-time').textContent =
-                    '最后更新: ' + new Date().toLocaleTimeString('zh-CN') +
-                    ' | 数据更新: ' + data.stats.last_update;
-
-            } catch (error) {
-                console.error('更新数据失败:', error);
-            }
+function applySnapshot(data) {
+    document.getElementById('funding-table').innerHTML = '';
+    rowElements.clear();
+    data.summary.forEach(applyRow);
+    applyOrder(data.summary.map(item => item.symbol));
+    updateStats(data.stats);
+}
+
+function applyDelta(delta) {
+    delta.removed.forEach(symbol => {
+        const tr = rowElements.get(symbol);
+        if (tr) {
+            tr.remove();
+            rowElements.delete(symbol);
         }
+    });
+    delta.upserts.forEach(applyRow);
+    if (delta.order) {
+        applyOrder(delta.order);
+    }
+    updateStats(delta.stats);
+}
 
-        // 初始加载
-        updateData();
+async function updateData() {
+    try {
+        const response = await fetch('/api/data');
+        applySnapshot(await response.json());
+    } catch (error) {
+        console.error('更新数据失败:', error);
+    }
+}
 
-        // 每5秒更新一次
-        setInterval(updateData, 5000);
-    </script>
-</body>
-</html>
+if (window.EventSource) {
+    // 服务端推送：连接时收到完整快照，之后只收到变化的行（断线后浏览器自动重连）
+    const source = new EventSource('/api/stream');
+    source.addEventListener('snapshot', event => applySnapshot(JSON.parse(event.data)));
+    source.addEventListener('delta', event => applyDelta(JSON.parse(event.data)));
+    source.onerror = () => console.error('推送连接中断，正在重连...');
+} else {
+    // 不支持 EventSource 的浏览器退回到每5秒轮询
+    updateData();
+    setInterval(updateData, 5000);
+}
+"""
+
+class StaticAsset:
+    """一个前端静态资源：原始内容及其压缩版本，每种压缩方式在第一次被请求时构建一次
+
+    Args:
+        content: 资源内容（str）
+        content_type: Content-Type
+        cache_control: Cache-Control 响应头
     """
-    return web.Response(text=html, content_type='text/html')
 
-async def handle_api_data(request):
-    """API接口"""
-    # 获取limit参数，默认None（显示全部）
-    limit_param = request.query.get('limit', None)
-    limit = int(limit_param) if limit_param else None
-    data = {
-        'summary': store.get_summary(limit=limit),
-        'stats': store.get_stats()
+    def __init__(self, content, content_type, cache_control):
+        self.body = content.encode('utf-8')
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(self.body).hexdigest()[:STATIC_HASH_LENGTH]
+        self.etag = f'"{self.digest}"'
+        self.variants = {}  # {压缩方式: 压缩后的内容}，按需构建
+
+    def variant(self, encoding):
+        """某种压缩方式的版本（只构建一次，使用最高压缩等级）"""
+        body = self.variants.get(encoding)
+        if body is None:
+            if encoding == 'br':
+                body = _optional_module('brotli').compress(self.body, quality=11)
+            else:
+                body = gzip.compress(self.body, compresslevel=9, mtime=0)
+            self.variants[encoding] = body
+        return body
+
+    def response(self, request):
+        """按 If-None-Match 和 Accept-Encoding 返回 304、压缩版本或原始内容"""
+        headers = {'ETag': self.etag, 'Cache-Control': self.cache_control, 'Vary': 'Accept-Encoding'}
+        if _etag_matches(request, self.etag):
+            return web.Response(status=304, headers=headers)
+        body = self.body
+        encoding = _response_encoding(request)
+        if encoding is not None and len(self.variant(encoding)) < len(body):
+            body = self.variants[encoding]
+            headers['Content-Encoding'] = encoding
+        return web.Response(body=body, content_type=self.content_type, charset='utf-8', headers=headers)
+
+def build_static_assets():
+    """构建前端资源：样式和脚本以内容哈希命名、长期缓存，页面每次向服务器确认（304）
+
+    Returns:
+        dict: {URL路径: StaticAsset}
+    """
+    immutable = f'public, max-age={STATIC_MAX_AGE}, immutable'
+    css = StaticAsset(DASHBOARD_CSS, 'text/css', immutable)
+    js = StaticAsset(DASHBOARD_JS, 'application/javascript', immutable)
+    css_path, js_path = f'/static/app.{css.digest}.css', f'/static/app.{js.digest}.js'
+    html = DASHBOARD_HTML.replace('__APP_CSS__', css_path).replace('__APP_JS__', js_path)
+    return {
+        '/': StaticAsset(html, 'text/html', 'no-cache'),
+        css_path: css,
+        js_path: js,
     }
-    return web.json_response(data)
 
-async def start_web_server():
-    """启动Web服务器"""
-    app = web.Application()
+async def handle_index(request):
+    """主页"""
+    return request.app[STATIC_ASSETS_KEY]['/'].response(request)
+
+async def handle_static(request):
+    """带内容哈希的静态资源，内容变化时 URL 随之变化，因此可以长期缓存"""
+    asset = request.app[STATIC_ASSETS_KEY].get(request.path)
+    if asset is None or request.path == '/':
+        raise web.HTTPNotFound()
+    return asset.response(request)
+
+
+def _etag_matches(request, etag):
+    """检查请求的 If-None-Match 是否命中当前 ETag"""
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+def _parse_data_query(params):
+    """解析 /api/data 的过滤、排序、分页和投影参数
+
+    Args:
+        params: 请求的查询参数
+
+    Returns:
+        dict: 规范化后的查询，所有值可哈希（作为快照内的缓存键）
+
+    Raises:
+        ValueError: 参数无效
+    """
+    def number(name, convert, default):
+        value = params.get(name)
+        if not value:
+            return default
+        try:
+            return convert(value)
+        except ValueError:
+            raise ValueError(f"{name} 必须是{'整数' if convert is int else '数字'}")
+
+    def names(name):
+        return [item.strip() for item in params.get(name, '').split(',') if item.strip()]
+
+    sort = params.get('sort', 'diff')
+    if sort not in DATA_SORT_KEYS:
+        raise ValueError(f"sort 必须是 {' / '.join(DATA_SORT_KEYS)} 之一")
+
+    has_var = params.get('has_var')
+    if has_var is not None:
+        if has_var.lower() not in ('true', 'false', '1', '0'):
+            raise ValueError('has_var 必须是 true 或 false')
+        has_var = has_var.lower() in ('true', '1')
+
+    min_level = number('min_level', int, 0)
+    if not 0 <= min_level <= len(RECOMMENDATION_THRESHOLDS):
+        raise ValueError(f'min_level 必须在 0 到 {len(RECOMMENDATION_THRESHOLDS)} 之间')
+    offset = number('offset', int, 0)
+    if offset < 0:
+        raise ValueError('offset 不能小于 0')
+    limit = number('limit', int, None)
+
+    # 投影时始终包含 symbol（分页 cursor 使用）
+    fields = names('fields')
+    if fields:
+        fields = ['symbol'] + [field for field in fields if field != 'symbol']
+
+    return {
+        'min_diff': abs(number('min_diff', float, 0.0)),
+        'min_level': min_level,
+        'has_var': has_var,
+        'symbols': frozenset(names('symbols')),
+        'exclude': frozenset(names('exclude')),
+        'sort': sort,
+        'offset': offset,
+        'limit': limit if limit and limit > 0 else None,
+        'cursor': params.get('cursor') or None,
+        'fields': tuple(fields),
+    }
+
+def _response_format(request):
+    """选择 /api/data 的响应格式：优先 format 参数，其次 Accept 头（MessagePack），默认 JSON"""
+    fmt = request.query.get('format')
+    if fmt is None:
+        accept = request.headers.get('Accept', '')
+        if HAS_MSGPACK and ('application/msgpack' in accept or 'application/x-msgpack' in accept):
+            return 'msgpack'
+        return 'json'
+    if fmt not in RESPONSE_FORMATS:
+        raise web.HTTPBadRequest(text=f"format 必须是 {' / '.join(RESPONSE_FORMATS)} 之一")
+    if fmt == 'msgpack' and not HAS_MSGPACK:
+        raise web.HTTPNotAcceptable(text='服务器未安装 msgpack，请使用 format=columnar')
+    return fmt
+
+def _response_encoding(request):
+    """按 Accept-Encoding 选择压缩方式（RESPONSE_ENCODERS 的优先顺序），不压缩时返回 None"""
+    accepted = set()
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = item.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q=') and params[2:] in ('0', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(name.strip().lower())
+    return next((encoding for encoding in RESPONSE_ENCODERS if encoding in accepted), None)
+
+async def handle_api_data(request):
+    """API接口
+
+    直接返回当前版本快照中预序列化的响应体；数据未变化时返回 304。
+    带过滤、排序、分页或投影参数时，结果按查询缓存在当前版本的快照中。
+    响应格式（format 参数 / Accept）和压缩方式（Accept-Encoding）的每种组合
+    同样每个版本只编码、压缩一次。
+    """
+    snapshot = store.snapshot
+    fmt = _response_format(request)
+    query = None
+    if request.query.keys() - {'limit', 'format'}:
+        try:
+            query = _parse_data_query(request.query)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+    else:
+        # 获取limit参数，默认None（显示全部）
+        limit_param = request.query.get('limit', None)
+        try:
+            limit = int(limit_param) if limit_param else None
+        except ValueError:
+            raise web.HTTPBadRequest(text='limit 必须是整数')
+
+    # 不同格式和压缩方式的响应体不同，ETag 需要区分
+    etag = snapshot.etag if fmt == 'json' else f'"{snapshot.etag[1:-1]}-{fmt}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept, Accept-Encoding'}
+    if _etag_matches(request, etag):
+        return web.Response(status=304, headers=headers)
+    if query is None:
+        body = snapshot.body(limit, fmt)
+    else:
+        try:
+            body = snapshot.query_body(query, fmt)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+
+    encoding = _response_encoding(request)
+    compressed = snapshot.compressed(body, encoding) if encoding else None
+    if compressed is not None:
+        body = compressed
+        headers['Content-Encoding'] = encoding
+        headers['ETag'] = f'W/{etag}'  # 压缩后字节不同，按惯例改为弱 ETag
+    return web.Response(body=body, content_type=RESPONSE_FORMATS[fmt], headers=headers)
+
+async def handle_api_changes(request):
+    """增量变更接口：返回 since 版本之后的合并变更集
+
+    since 太旧（已移出环形缓冲区）时返回 reset=true，客户端应重新拉取 /api/data。
+    """
+    try:
+        since = int(request.query['since'])
+    except (KeyError, ValueError):
+        raise web.HTTPBadRequest(text='缺少或无效的 since 参数（版本号）')
+
+    snapshot = store.snapshot
+    body = snapshot.changes_body(since, store.changes)
+    return web.Response(body=body, content_type='application/json', headers={'Cache-Control': 'no-cache'})
+
+async def handle_api_stream(request):
+    """推送接口（Server-Sent Events）
+
+    连接时推送一次完整快照，之后每个新数据版本只推送变化的行。
+    客户端落后多个版本（或断线重连时版本对不上）时改发完整快照。
+    """
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+    await response.prepare(request)
+
+    subscriber = store.subscribe()
+    try:
+        # EventSource 重连时会带上最后收到的版本号
+        try:
+            last_version = int(request.headers.get('Last-Event-ID', ''))
+        except ValueError:
+            last_version = None
+
+        snapshot = store.snapshot
+        if last_version != snapshot.version:
+            if last_version is not None and last_version == snapshot.base_version:
+                await response.write(snapshot.sse_delta())
+            else:
+                await response.write(snapshot.sse_snapshot())
+        last_version = snapshot.version
+
+        while True:
+            try:
+                snapshot = await asyncio.wait_for(subscriber.get(), timeout=STREAM_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                await response.write(b': ping\n\n')
+                continue
+
+            if snapshot.version <= last_version:
+                continue
+            if snapshot.base_version == last_version:
+                await response.write(snapshot.sse_delta())
+            else:
+                await response.write(snapshot.sse_snapshot())
+            last_version = snapshot.version
+    except ConnectionResetError:
+        pass  # 客户端断开
+    finally:
+        store.unsubscribe(subscriber)
+    return response
+
+async def handle_api_history(request):
+    """历史数据接口：按时间范围和步长返回聚合后的费率差、价差和双方费率
+
+    参数: symbol（必填）、from / to（Unix 秒，默认最近 HISTORY_DEFAULT_RANGE 秒）、
+    step（桶宽秒数，默认按 HISTORY_MAX_POINTS 自动选择）
+    """
+    history = request.app[HISTORY_APP_KEY]
+    if history is None:
+        raise web.HTTPNotFound(text='历史数据未启用')
+
+    symbol = request.query.get('symbol')
+    if not symbol:
+        raise web.HTTPBadRequest(text='缺少 symbol 参数')
+    try:
+        end = int(request.query.get('to') or time.time())
+        start = int(request.query.get('from') or end - HISTORY_DEFAULT_RANGE)
+        step_param = request.query.get('step')
+        step = int(step_param) if step_param else None
+    except ValueError:
+        raise web.HTTPBadRequest(text='from / to / step 必须是整数（秒）')
+    if end <= start:
+        raise web.HTTPBadRequest(text='to 必须大于 from')
+
+    if step is None:
+        # 自动选择步长：不超过 HISTORY_MAX_POINTS 个桶，并对齐到降采样层级
+        step = max(60, -(-(end - start) // HISTORY_MAX_POINTS))
+        for _, seconds in HISTORY_TIERS:
+            if step <= seconds:
+                step = seconds
+                break
+        else:
+            step = -(-step // HISTORY_TIERS[-1][1]) * HISTORY_TIERS[-1][1]
+    if step <= 0:
+        raise web.HTTPBadRequest(text='step 必须大于 0')
+    if (end - start) // step > HISTORY_MAX_POINTS:
+        raise web.HTTPBadRequest(text=f'桶数超过上限 {HISTORY_MAX_POINTS}，请增大 step 或缩小时间范围')
+
+    return web.json_response(await history.query(symbol, start, end, step))
+
+async def handle_metrics(request):
+    """监控指标接口（Prometheus 文本格式）"""
+    return web.Response(
+        body=render_metrics().encode('utf-8'),
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
+
+@web.middleware
+async def metrics_middleware(request, handler):
+    """记录每个接口的请求数和处理耗时（推送长连接只计数）"""
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else 'unmatched'
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        HTTP_REQUESTS.inc(route, str(status))
+        if route != '/api/stream':
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, route)
+
+def create_app(history=None):
+    """创建Web应用并注册路由
+
+    Args:
+        history: HistoryStore，供 /api/history 查询；None 表示未启用
+    """
+    app = web.Application(middlewares=[metrics_middleware])
+    app[HISTORY_APP_KEY] = history
+    app[STATIC_ASSETS_KEY] = build_static_assets()
     app.router.add_get('/', handle_index)
+    app.router.add_get('/static/{name}', handle_static)
     app.router.add_get('/api/data', handle_api_data)
+    app.router.add_get('/api/stream', handle_api_stream)
+    app.router.add_get('/api/changes', handle_api_changes)
+    app.router.add_get('/api/history', handle_api_history)
+    app.router.add_get('/metrics', handle_metrics)
+    return app
+
+async def start_web_server(history=None, worker=None):
+    """启动Web服务器
+
+    Args:
+        history: HistoryStore，供 /api/history 查询；None 表示未启用
+        worker: 多进程部署时的工作进程序号，以 SO_REUSEPORT 与其它工作进程共用端口
+    """
+    runner = web.AppRunner(create_app(history))
+    await runner.setup()
+    site = web.TCPSite(runner, '0.0.0.0', WEB_PORT, reuse_port=worker is not None)
+    await site.start()
+
+    if worker is not None:
+        log_event('web_started', f"✓ Web工作进程 {worker} 已启动 (pid {os.getpid()}, 端口 {WEB_PORT})",
+                  worker=worker, port=WEB_PORT)
+        return
+    log_event('web_started', f"✓ Web服务器已启动，访问地址: http://127.0.0.1:{WEB_PORT}", port=WEB_PORT)
 
+async def start_metrics_server():
+    """多进程部署时获取进程只提供 /metrics（交易所请求、更新周期等指标都在获取进程中）"""
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', WEB_PORT)
+    site = web.TCPSite(runner, '0.0.0.0', FETCHER_METRICS_PORT)
     await site.start()
+    log_event('metrics_started', f"✓ 获取进程监控指标: http://127.0.0.1:{FETCHER_METRICS_PORT}/metrics",
+              port=FETCHER_METRICS_PORT)
+
+# ==================== 多进程部署 ====================
+class SharedSnapshot:
+    """获取进程与 Web 工作进程共享的快照区（fork 前创建的匿名共享内存）
+
+    获取进程每生成一个新版本，把该版本 /api/data 的完整响应体和变更集写入共享区；工作进程轮询版本号，
+    有新版本时取出这两段字节直接作为自己的响应体缓存和变更集，不解析响应体、不重新计算变更集。
+    （共享区会被下一个版本覆盖，因此每个版本复制一次字节，这是工作进程唯一的按版本开销。）
+
+    只有一个写入方，按顺序锁（seqlock）协议读写：写入前序号置为奇数，写完置为偶数；
+    读取方前后两次读到相同的偶数序号才认为数据完整，否则重读。序号保存在共享区中，
+    重启的获取进程从中继续递增，不会与工作进程已读到的序号重复。
+
+    Args:
+        size: 共享区大小（字节），超过的版本不发布
+    """
+
+    HEADER = struct.Struct('<QQQQ')  # 序号、数据版本号、响应体长度、变更集长度
+
+    def __init__(self, size=SHARED_SNAPSHOT_SIZE):
+        self._mm = mmap.mmap(-1, size)
+
+    @property
+    def version(self):
+        """最近发布的数据版本号（0 表示尚未发布）"""
+        return self.HEADER.unpack_from(self._mm, 0)[1]
+
+    def publish(self, snapshot, update_count=None):
+        """写入新版本（可直接作为 FundingRateStore 的监听器）"""
+        if snapshot.version == self.version:
+            return  # 数据未变化的更新周期，版本已发布
+        body = snapshot.body()
+        changes = snapshot.changes.encode()
+        offset = self.HEADER.size
+        if offset + len(body) + len(changes) > len(self._mm):
+            log_event('shared_snapshot_overflow', f"共享快照区不足（需要 {len(body)} 字节），请增大 SHARED_SNAPSHOT_SIZE",
+                      logging.ERROR, body_bytes=len(body), version=snapshot.version)
+            return
+        seq, version, body_length, changes_length = self.HEADER.unpack_from(self._mm, 0)
+        seq += 1 + seq % 2  # 上一个获取进程在写入中途退出时序号为奇数
+        self.HEADER.pack_into(self._mm, 0, seq, version, body_length, changes_length)
+        self._mm[offset:offset + len(body)] = body
+        self._mm[offset + len(body):offset + len(body) + len(changes)] = changes
+        self.HEADER.pack_into(self._mm, 0, seq + 1, snapshot.version, len(body), len(changes))
+
+    def read(self):
+        """读出最近发布的版本
+
+        Returns:
+            tuple: (版本号, 响应体, ChangeSet)；尚未发布或多次重读仍在写入中时返回 None
+        """
+        offset = self.HEADER.size
+        for _ in range(100):
+            seq, version, body_length, changes_length = self.HEADER.unpack_from(self._mm, 0)
+            if seq % 2 == 0:
+                body = self._mm[offset:offset + body_length]
+                changes = self._mm[offset + body_length:offset + body_length + changes_length]
+                if self.HEADER.unpack_from(self._mm, 0)[0] == seq:
+                    return (version, body, ChangeSet.decode(changes)) if version else None
+            time.sleep(0)
+        return None
+
+async def follow_shared_snapshot(shared):
+    """工作进程：每 SHARED_SNAPSHOT_POLL_INTERVAL 秒检查共享区，有新版本时载入存储"""
+    while True:
+        if shared.version != store.version:
+            result = shared.read()
+            if result is not None and result[0] != store.version:
+                try:
+                    store.load_shared(*result)
+                except Exception as e:
+                    log_event('shared_snapshot_error', f"载入共享快照失败: {e}", logging.ERROR, exc_info=e)
+        await asyncio.sleep(SHARED_SNAPSHOT_POLL_INTERVAL)
+
+async def web_worker_main(shared, worker):
+    """Web 工作进程：从共享快照对外服务，不访问交易所"""
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass
+
+    # 历史数据只读查询（SQLite WAL 允许多个进程同时读），写入和建表由获取进程负责，
+    # 查询连接在第一次查询时才打开
+    history = HistoryStore() if HISTORY_ENABLED else None
+    try:
+        await asyncio.gather(
+            start_web_server(history, worker=worker),
+            follow_shared_snapshot(shared),
+        )
+    finally:
+        if history is not None:
+            await history.close()
+
+def _run_process(tag, target, *args):
+    """子进程入口：运行协程直到被 SIGTERM 取消（Ctrl+C 由主进程处理，再逐个终止子进程）
+
+    子进程不会执行 atexit，退出前在这里写完日志队列。
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C 由主进程统一处理
+    listener = setup_logging(tag)
+    try:
+        asyncio.run(target(*args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        listener.stop()
+
+def run_multiprocess(workers):
+    """多进程部署：主进程只负责启动和看护一个获取进程和 workers 个 Web 工作进程
+
+    子进程意外退出时自动重启；重启的获取进程从共享区的版本号继续编号，ETag 不会与之前的版本冲突。
+    """
+    shared = SharedSnapshot()
+    context = multiprocessing.get_context('fork')
+    targets = {'获取进程': ('fetcher', main, shared)}  # 名称 -> (日志文件后缀, 入口, 参数...)
+    for worker in range(1, workers + 1):
+        targets[f'Web工作进程 {worker}'] = (f'web{worker}', web_worker_main, shared, worker)
+
+    def start(name):
+        process = context.Process(target=_run_process, args=targets[name], name=name, daemon=True)
+        process.start()
+        return process
+
+    stopping = False
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
 
-    print(f"\n{'='*70}")
-    print(f"✓ Web服务器已启动")
-    print(f"✓ 访问地址: http://127.0.0.1:{WEB_PORT}")
-    print(f"{'='*70}\n")
+    processes = {name: start(name) for name in targets}
+    try:
+        while not stopping:
+            time.sleep(1)
+            for name, process in processes.items():
+                if not process.is_alive() and not stopping:
+                    log_event('process_restarted', f"{name} 已退出 (exitcode {process.exitcode})，重新启动",
+                              logging.WARNING, process=name, exitcode=process.exitcode)
+                    processes[name] = start(name)
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(timeout=10)
+        log_event('stopped', "程序退出")
 
 # ==================== 主函数 ====================
-async def main():
-    print("\n" + "="*70)
-    print("VAR 资金费率监控器")
-    print("实时监控VAR交易所的资金费率，对比Backpack价格")
-    print("="*70)
-
-    # 启动所有任务
-    await asyncio.gather(
-        update_funding_rates(),
-        start_web_server(),
-        return_exceptions=True
-    )
+async def main(shared=None):
+    """获取数据并提供 Web 服务
+
+    Args:
+        shared: 多进程部署时的 SharedSnapshot，此时只获取数据并发布到共享区，由工作进程对外服务
+    """
+    log_event('started', "VAR 资金费率监控器 - 实时监控VAR交易所的资金费率，对比Backpack价格",
+              pid=os.getpid(), mode='single' if shared is None else 'fetcher')
+
+    # SIGTERM（如 pkill）时取消主任务，走正常的清理流程
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except NotImplementedError:
+        pass  # Windows 不支持
+
+    # 先载入上次的快照并启动 Web 服务，重启后无需等待第一轮获取即可提供（标记为过期的）数据
+    checkpoint = SnapshotCheckpoint() if CHECKPOINT_PATH else None
+    if shared is not None and shared.version:
+        # 获取进程重启：载入工作进程正在服务的版本，之后的版本号和变更集与之衔接
+        published = shared.read()
+        if published is not None:
+            store.load_shared(*published)
+        else:
+            store.version = shared.version
+    elif checkpoint is not None and checkpoint.restore() and shared is not None:
+        shared.publish(store.snapshot)
+
+    history = HistoryStore() if HISTORY_ENABLED else None
+    if shared is None:
+        await start_web_server(history)
+    else:
+        store.add_listener(shared.publish)
+        await start_metrics_server()
+    if history is not None:
+        history.start()  # 在写线程中建表，不等待完成
+
+    # 共享HTTP客户端，整个进程生命周期内复用连接
+    client = ExchangeHttpClient()
+    await client.start()
+
+    # 交易所适配器及其后台任务（如 Backpack 价格推送，不可用时自动改用 REST）
+    adapters = create_adapters(client)
+    background_tasks = {'updater': lambda: update_funding_rates(client, history, adapters)}
+    for adapter in adapters:
+        background_tasks.update(adapter.background_tasks())
+    if checkpoint is not None:
+        background_tasks['checkpoint'] = checkpoint.run
+
+    # 告警引擎：每个新版本按变更集增量评估规则，告警由后台任务发送
+    if ALERTS_ENABLED and ALERT_RULES:
+        alert_engine = create_alert_engine(client)
+        store.add_listener(alert_engine.evaluate)
+        background_tasks['alerts'] = alert_engine.run
+
+    try:
+        # 启动所有任务，每个任务异常退出时单独重启
+        await asyncio.gather(*(supervise(name, factory) for name, factory in background_tasks.items()))
+    finally:
+        await client.close()
+        if checkpoint is not None:
+            checkpoint.save_now()
+        if history is not None:
+            await history.close()
 
 if __name__ == '__main__':
+    log_listener = setup_logging()
     try:
-        asyncio.run(main())
-    except KeyboardInterrupt:
-        print("\n\n程序退出")
+        if WEB_WORKERS > 0 and hasattr(socket, 'SO_REUSEPORT') and 'fork' in multiprocessing.get_all_start_methods():
+            run_multiprocess(WEB_WORKERS)
+        else:
+            if WEB_WORKERS > 0:
+                log_event('multiprocess_unsupported',
+                          "当前系统不支持多进程部署（需要 fork 和 SO_REUSEPORT），以单进程运行", logging.WARNING)
+            try:
+                asyncio.run(main())
+            except (KeyboardInterrupt, asyncio.CancelledError):
+                log_event('stopped', "程序退出")
+    finally:
+        log_listener.stop()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+"""
+本地模拟交易所（VAR + Backpack）
+提供与真实交易所相同路径和格式的接口（含 Backpack ticker 推送），可注入延迟和错误，
+用于离线测试和性能测试
+
+用法:
+    python mock_exchange.py --symbols 500 --latency-ms 50 --error-rate 0.02
+    python mock_exchange.py --fixtures fixtures/     # 使用录制的真实数据
+    python mock_exchange.py --record fixtures/       # 从真实交易所录制数据（需要网络/代理）
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime, timezone
+from aiohttp import web
+
+# 录制文件名
+FIXTURE_FILES = {
+    'var_stats': 'var_stats.json',
+    'bpx_markets': 'bpx_markets.json',
+    'bpx_tickers': 'bpx_tickers.json',
+    'bpx_funding_rates': 'bpx_funding_rates.json',
+    'bpx_mark_prices': 'bpx_mark_prices.json',
+}
+
+# 合成数据中使用的真实币种（含 BP/VAR 名称不同的币种）
+KNOWN_BASES = ['BTC', 'ETH', 'SOL', 'PUMP', 'kBONK', 'kPEPE', 'HYPE', 'SUI', 'XRP', 'DOGE']
+BPX_TO_VAR = {'PUMP': 'PUMPFUN', 'kBONK': 'BONK', 'kPEPE': 'PEPE'}
+
+# ==================== 数据 ====================
+def make_fixtures(n_symbols, seed=0):
+    """生成合成的交易所数据
+
+    Args:
+        n_symbols: 永续合约数量
+        seed: 随机种子，相同参数生成相同数据
+
+    Returns:
+        dict: {
+            'var_stats': VAR metadata/stats 响应,
+            'bpx_markets': Backpack markets 响应（含少量现货市场）,
+            'bpx_tickers': Backpack tickers 响应,
+            'bpx_funding_rates': {symbol: Backpack fundingRates 响应},
+            'bpx_mark_prices': Backpack markPrices 响应（当前费率与 fundingRates 最新一期相同）
+        }
+    """
+    rng = random.Random(seed)
+    bases = KNOWN_BASES[:n_symbols] + [f'C{i:04d}' for i in range(n_symbols - len(KNOWN_BASES))]
+    now = int(time.time())
+
+    listings, markets, tickers, funding_rates, mark_prices = [], [], [], {}, []
+    for base in bases:
+        price = 10 ** rng.uniform(-4, 5)
+        interval_s = rng.choice([3600, 3600, 28800])
+        symbol = f'{base}_USDC_PERP'
+
+        markets.append({'symbol': symbol, 'marketType': 'PERP', 'fundingInterval': interval_s * 1000})
+        tickers.append({'symbol': symbol, 'lastPrice': f'{price * rng.uniform(0.998, 1.002):.8g}'})
+        funding_rate = f'{rng.gauss(0.0001, 0.0002):.7f}'
+        last_settlement = now - now % interval_s
+        funding_rates[symbol] = [{
+            'symbol': symbol,
+            'fundingRate': funding_rate,
+            # 最近一次结算时间（UTC，与真实接口格式相同）
+            'intervalEndTimestamp': datetime.fromtimestamp(last_settlement, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S'),
+        }]
+        mark_prices.append({
+            'symbol': symbol,
+            'fundingRate': funding_rate,
+            'markPrice': f'{price:.8g}',
+            'indexPrice': f'{price:.8g}',
+            'nextFundingTimestamp': (last_settlement + interval_s) * 1000,
+        })
+
+        # 约 85% 的币种在 VAR 也有上市
+        if rng.random() < 0.85:
+            listings.append({
+                'ticker': BPX_TO_VAR.get(base, base),
+                'funding_rate': f'{rng.gauss(0.1, 0.3):.6f}',  # 年化
+                'funding_interval_s': rng.choice([3600, 28800]),
+                'mark_price': f'{price:.8g}',
+            })
+
+    # 少量现货市场，验证只处理 _USDC_PERP
+    for base in bases[:5]:
+        markets.append({'symbol': f'{base}_USDC', 'marketType': 'SPOT'})
+        tickers.append({'symbol': f'{base}_USDC', 'lastPrice': '1'})
+
+    return {
+        'var_stats': {'listings': listings},
+        'bpx_markets': markets,
+        'bpx_tickers': tickers,
+        'bpx_funding_rates': funding_rates,
+        'bpx_mark_prices': mark_prices,
+    }
+
+def load_fixtures(directory):
+    """从目录加载录制的数据（较早的录制没有 markPrices，此时模拟接口返回 404）"""
+    fixtures = {}
+    for key, filename in FIXTURE_FILES.items():
+        if key == 'bpx_mark_prices' and not os.path.exists(os.path.join(directory, filename)):
+            continue
+        with open(os.path.join(directory, filename), encoding='utf-8') as f:
+            fixtures[key] = json.load(f)
+    return fixtures
+
+def save_fixtures(fixtures, directory):
+    """把数据保存到目录"""
+    os.makedirs(directory, exist_ok=True)
+    for key, filename in FIXTURE_FILES.items():
+        if key not in fixtures:
+            continue
+        with open(os.path.join(directory, filename), 'w', encoding='utf-8') as f:
+            json.dump(fixtures[key], f, ensure_ascii=False)
+
+async def record_fixtures(directory):
+    """从真实交易所录制一份数据（Backpack 按监控器配置走代理）"""
+    import funding_rate_monitor as monitor
+
+    client = monitor.ExchangeHttpClient()
+    await client.start()
+    try:
+        async def get(url):
+            async with client.get(url, timeout=15) as response:
+                response.raise_for_status()
+                return await response.json()
+
+        fixtures = {
+            'var_stats': await get(monitor.VAR_STATS_API),
+            'bpx_markets': await get(f'{monitor.BPX_API_BASE}/api/v1/markets'),
+            'bpx_tickers': await get(f'{monitor.BPX_API_BASE}/api/v1/tickers'),
+            'bpx_mark_prices': await get(f'{monitor.BPX_API_BASE}/api/v1/markPrices'),
+            'bpx_funding_rates': {},
+        }
+        perps = [m['symbol'] for m in fixtures['bpx_markets'] if '_USDC_PERP' in m.get('symbol', '')]
+        for symbol in perps:
+            fixtures['bpx_funding_rates'][symbol] = await get(
+                f'{monitor.BPX_API_BASE}/api/v1/fundingRates?symbol={symbol}&limit=1'
+            )
+    finally:
+        await client.close()
+
+    save_fixtures(fixtures, directory)
+    print(f"已录制 {len(perps)} 个永续合约到 {directory}")
+
+# ==================== 模拟服务器 ====================
+class MockExchange:
+    """模拟 VAR 和 Backpack 的公开接口
+
+    Args:
+        fixtures: make_fixtures / load_fixtures 返回的数据
+        latency_ms: 每个请求的固定延迟（毫秒）
+        jitter_ms: 额外的随机延迟上限（毫秒）
+        error_rate: 返回 HTTP 500 的概率
+        timeout_rate: 挂起不响应（模拟超时）的概率
+        throttle_rate: 返回 HTTP 429（带 Retry-After）的概率
+        retry_after: 429 响应的 Retry-After（秒）
+        ws_tick_ms: 每个推送连接每隔多少毫秒推送一笔 ticker（随机选一个已订阅币种）
+        seed: 随机种子
+    """
+
+    def __init__(self, fixtures, latency_ms=0, jitter_ms=0, error_rate=0.0, timeout_rate=0.0,
+                 throttle_rate=0.0, retry_after=1, ws_tick_ms=50, seed=0):
+        self.fixtures = fixtures
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.ws_tick_ms = ws_tick_ms
+        self.request_counts = {}
+        self._rng = random.Random(seed)
+        # 响应体预先序列化，避免模拟服务器本身成为瓶颈
+        self._bodies = {
+            'var_stats': json.dumps(fixtures['var_stats']).encode('utf-8'),
+            'bpx_markets': json.dumps(fixtures['bpx_markets']).encode('utf-8'),
+            'bpx_tickers': json.dumps(fixtures['bpx_tickers']).encode('utf-8'),
+        }
+        if 'bpx_mark_prices' in fixtures:
+            self._bodies['bpx_mark_prices'] = json.dumps(fixtures['bpx_mark_prices']).encode('utf-8')
+        self._funding_bodies = {
+            symbol: json.dumps(rates).encode('utf-8')
+            for symbol, rates in fixtures['bpx_funding_rates'].items()
+        }
+        # 推送行情的当前价（随机游走），以及当前打开的推送连接
+        self._ws_prices = {
+            ticker['symbol']: float(ticker['lastPrice'])
+            for ticker in fixtures['bpx_tickers'] if ticker['symbol'].endswith('_PERP')
+        }
+        self._websockets = set()
+        self._books = {}  # {symbol: {'bids': {价: 量}, 'asks': {价: 量}, 'id': 更新序号}}，按需生成
+
+    def make_app(self):
+        """创建 aiohttp 应用"""
+        app = web.Application(middlewares=[self._inject_faults])
+        app.router.add_get('/metadata/stats', self._handle_var_stats)
+        app.router.add_get('/api/v1/markets', self._handle_bpx_markets)
+        app.router.add_get('/api/v1/tickers', self._handle_bpx_tickers)
+        app.router.add_get('/api/v1/fundingRates', self._handle_bpx_funding_rates)
+        app.router.add_get('/api/v1/markPrices', self._handle_bpx_mark_prices)
+        app.router.add_get('/api/v1/depth', self._handle_bpx_depth)
+        app.router.add_get('/ws', self._handle_bpx_ws)
+        return app
+
+    async def start(self, host='127.0.0.1', port=0):
+        """启动服务器，返回 (runner, 实际端口)"""
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        return runner, site._server.sockets[0].getsockname()[1]
+
+    @web.middleware
+    async def _inject_faults(self, request, handler):
+        self.request_counts[request.path] = self.request_counts.get(request.path, 0) + 1
+
+        delay = self.latency_ms + self._rng.uniform(0, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if self._rng.random() < self.timeout_rate:
+            await asyncio.sleep(3600)
+        if self._rng.random() < self.throttle_rate:
+            return web.Response(status=429, text='rate limited', headers={'Retry-After': str(self.retry_after)})
+        if self._rng.random() < self.error_rate:
+            return web.Response(status=500, text='injected error')
+        return await handler(request)
+
+    async def _handle_var_stats(self, request):
+        return web.Response(body=self._bodies['var_stats'], content_type='application/json')
+
+    async def _handle_bpx_markets(self, request):
+        return web.Response(body=self._bodies['bpx_markets'], content_type='application/json')
+
+    async def _handle_bpx_tickers(self, request):
+        return web.Response(body=self._bodies['bpx_tickers'], content_type='application/json')
+
+    async def _handle_bpx_mark_prices(self, request):
+        body = self._bodies.get('bpx_mark_prices')
+        if body is None:
+            return web.Response(status=404, text='not recorded')
+        return web.Response(body=body, content_type='application/json')
+
+    async def _handle_bpx_funding_rates(self, request):
+        body = self._funding_bodies.get(request.query.get('symbol', ''))
+        if body is None:
+            return web.Response(status=400, text='unknown symbol')
+        return web.Response(body=body, content_type='application/json')
+
+    def _book(self, symbol):
+        """某个永续合约的模拟订单簿：围绕当前价每侧 50 档"""
+        book = self._books.get(symbol)
+        if book is None:
+            price = self._ws_prices[symbol]
+            book = {'bids': {}, 'asks': {}, 'id': 1}
+            for i in range(1, 51):
+                book['bids'][f'{price * (1 - 0.0002 * i):.8g}'] = f'{self._rng.uniform(50, 500) / price:.6g}'
+                book['asks'][f'{price * (1 + 0.0002 * i):.8g}'] = f'{self._rng.uniform(50, 500) / price:.6g}'
+            self._books[symbol] = book
+        return book
+
+    async def _handle_bpx_depth(self, request):
+        symbol = request.query.get('symbol', '')
+        if symbol not in self._ws_prices:
+            return web.Response(status=400, text='unknown symbol')
+        book = self._book(symbol)
+        return web.json_response({
+            'bids': sorted(([p, q] for p, q in book['bids'].items()), key=lambda level: float(level[0])),
+            'asks': sorted(([p, q] for p, q in book['asks'].items()), key=lambda level: float(level[0])),
+            'lastUpdateId': str(book['id']),
+            'timestamp': int(time.time() * 1000),
+        })
+
+    async def _handle_bpx_ws(self, request):
+        """Backpack 推送：支持 SUBSCRIBE / UNSUBSCRIBE ticker.<symbol> 和 depth.<symbol>"""
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        subscribed = {'ticker': set(), 'depth': set()}
+        pusher = asyncio.create_task(self._push_tickers(ws, subscribed))
+        self._websockets.add(ws)
+        try:
+            async for message in ws:
+                if message.type != web.WSMsgType.TEXT:
+                    continue
+                payload = json.loads(message.data)
+                for param in payload.get('params', []):
+                    kind, _, symbol = param.partition('.')
+                    if kind not in subscribed or symbol not in self._ws_prices:
+                        continue
+                    if payload.get('method') == 'SUBSCRIBE':
+                        subscribed[kind].add(symbol)
+                    elif payload.get('method') == 'UNSUBSCRIBE':
+                        subscribed[kind].discard(symbol)
+        finally:
+            pusher.cancel()
+            self._websockets.discard(ws)
+        return ws
+
+    async def _push_tickers(self, ws, subscribed):
+        while not ws.closed:
+            await asyncio.sleep(self.ws_tick_ms / 1000)
+            if subscribed['depth']:
+                await ws.send_json(self._depth_event(self._rng.choice(tuple(subscribed['depth']))))
+            if not subscribed['ticker']:
+                continue
+            symbol = self._rng.choice(tuple(subscribed['ticker']))
+            price = self._ws_prices[symbol] = self._ws_prices[symbol] * (1 + self._rng.gauss(0, 0.0005))
+            await ws.send_json({
+                'stream': f'ticker.{symbol}',
+                'data': {'e': 'ticker', 'E': int(time.time() * 1e6), 's': symbol, 'c': f'{price:.8g}'},
+            })
+
+    def _depth_event(self, symbol):
+        """随机修改订单簿的一档（改量、删除或新增），返回对应的 depth 推送"""
+        book = self._book(symbol)
+        side = self._rng.choice(('bids', 'asks'))
+        price = self._rng.choice(tuple(book[side]))
+        if self._rng.random() < 0.2 and len(book[side]) > 10:
+            del book[side][price]
+            quantity = '0'
+        else:
+            quantity = book[side][price] = f'{float(book[side][price]) * self._rng.uniform(0.5, 1.5):.6g}'
+        book['id'] += 1
+        return {
+            'stream': f'depth.{symbol}',
+            'data': {
+                'e': 'depth', 'E': int(time.time() * 1e6), 's': symbol,
+                'a': [[price, quantity]] if side == 'asks' else [],
+                'b': [[price, quantity]] if side == 'bids' else [],
+                'U': book['id'], 'u': book['id'],
+            },
+        }
+
+    async def drop_websockets(self):
+        """断开所有推送连接（测试重连）"""
+        for ws in list(self._websockets):
+            await ws.close()
+
+def point_monitor_at(monitor, port, host='127.0.0.1'):
+    """把监控器的交易所地址指向本地模拟服务器（不走代理）"""
+    base = f'http://{host}:{port}'
+    monitor.VAR_STATS_API = f'{base}/metadata/stats'
+    monitor.BPX_API_BASE = base
+    monitor.BPX_WS_URL = f'ws://{host}:{port}/ws'
+
+# ==================== 主函数 ====================
+async def main():
+    parser = argparse.ArgumentParser(description='本地模拟交易所')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--symbols', type=int, default=50, help='合成数据的永续合约数量')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fixtures', help='使用录制数据的目录（代替合成数据）')
+    parser.add_argument('--record', help='从真实交易所录制数据到该目录后退出')
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='返回 429 的概率')
+    parser.add_argument('--retry-after', type=int, default=1, help='429 响应的 Retry-After（秒）')
+    parser.add_argument('--ws-tick-ms', type=float, default=50, help='每个推送连接的 ticker 推送间隔（毫秒）')
+    args = parser.parse_args()
+
+    if args.record:
+        await record_fixtures(args.record)
+        return
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else make_fixtures(args.symbols, args.seed)
+    mock = MockExchange(
+        fixtures,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        ws_tick_ms=args.ws_tick_ms,
+        seed=args.seed,
+    )
+    await mock.start(port=args.port)
+    print(f"模拟交易所已启动: http://127.0.0.1:{args.port}")
+    print(f"  VAR_STATS_API = 'http://127.0.0.1:{args.port}/metadata/stats'")
+    print(f"  BPX_API_BASE  = 'http://127.0.0.1:{args.port}'")
+    print(f"  BPX_WS_URL    = 'ws://127.0.0.1:{args.port}/ws'")
+    await asyncio.Event().wait()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,110 @@
+"""告警引擎：阈值越过、连续周期计数、滞回恢复、冷却期和版本不连续时的全量评估"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import funding_rate_monitor as monitor
+
+def _cycle(var_rates):
+    """一轮两个交易所的数据；VAR 结算间隔为 1 小时，var_funding 指标即传入的费率"""
+    now = time.time()
+    symbols = list(var_rates)
+    bpx = {
+        'funding_rates': {symbol: 0.0001 for symbol in symbols},
+        'funding_intervals': {symbol: 3600 for symbol in symbols},
+        'prices': {symbol: 100.0 for symbol in symbols},
+        'fetched_at': now,
+    }
+    var = {
+        'funding_rates': dict(var_rates),
+        'funding_intervals': {symbol: 3600 for symbol in symbols},
+        'prices': {symbol: 100.0 for symbol in symbols},
+        'fetched_at': now,
+    }
+    return {'bpx': bpx, 'var': var}
+
+def _engine(*rules):
+    store = monitor.FundingRateStore()
+    engine = monitor.AlertEngine(rules, {})
+    store.add_listener(engine.evaluate)
+    return store, engine
+
+def _events(engine):
+    """取出引擎本轮产生的告警事件：[(规则名, 币种, 状态)]"""
+    events = []
+    while not engine._queue.empty():
+        alert, _ = engine._queue.get_nowait()
+        events.append((alert['rule'], alert['symbol'], alert['state']))
+    return events
+
+def _run(store, engine, values, symbol='BTC'):
+    """依次输入每轮的指标值，返回每轮产生的事件"""
+    history = []
+    for value in values:
+        store.update_data(_cycle({symbol: value}))
+        history.append(_events(engine))
+    return history
+
+def test_fires_after_consecutive_cycles_and_resolves_below_clear_level():
+    rule = monitor.AlertRule('high', 'var_funding', 0.005, cycles=3, cooldown=0)
+    store, engine = _engine(rule)
+    history = _run(store, engine, [0.001, 0.01, 0.01, 0.01, 0.0045, 0.001])
+
+    # 第 3 个满足条件的周期触发（后两个周期数据未变化，不生成新版本），0.0045 仍高于恢复阈值 0.004
+    assert history == [[], [], [], [('high', 'BTC', 'firing')], [], [('high', 'BTC', 'resolved')]]
+    assert store.version == 4
+
+def test_interrupted_streak_does_not_fire():
+    rule = monitor.AlertRule('high', 'var_funding', 0.005, cycles=3, cooldown=0)
+    store, engine = _engine(rule)
+    history = _run(store, engine, [0.01, 0.01, 0.001, 0.01, 0.01, 0.01])
+    assert sum(history, []) == [('high', 'BTC', 'firing')]
+    assert history[5] == [('high', 'BTC', 'firing')]
+
+def test_only_crossed_thresholds_change_state():
+    rules = [
+        monitor.AlertRule('low', 'var_funding', 0.005, cooldown=0),
+        monitor.AlertRule('mid', 'var_funding', 0.01, cooldown=0),
+        monitor.AlertRule('top', 'var_funding', 0.02, cooldown=0),
+    ]
+    store, engine = _engine(*rules)
+    history = _run(store, engine, [0.001, 0.015, 0.03, 0.006, 0.001])
+    assert history[1] == [('low', 'BTC', 'firing'), ('mid', 'BTC', 'firing')]
+    assert history[2] == [('top', 'BTC', 'firing')]
+    assert sorted(history[3]) == [('mid', 'BTC', 'resolved'), ('top', 'BTC', 'resolved')]
+    assert history[4] == [('low', 'BTC', 'resolved')]
+
+def test_cooldown_suppresses_refiring_and_its_resolve():
+    rule = monitor.AlertRule('high', 'var_funding', 0.005, cooldown=60)
+    store, engine = _engine(rule)
+    history = _run(store, engine, [0.01, 0.001, 0.01, 0.001])
+    assert history == [[('high', 'BTC', 'firing')], [('high', 'BTC', 'resolved')], [], []]
+
+    # 冷却期过后再次触发
+    engine._last_sent = {key: sent - 61 for key, sent in engine._last_sent.items()}
+    assert _run(store, engine, [0.01]) == [[('high', 'BTC', 'firing')]]
+
+def test_below_rule():
+    rule = monitor.AlertRule('negative', 'var_funding', -0.005, direction='below', cooldown=0)
+    store, engine = _engine(rule)
+    history = _run(store, engine, [0.001, -0.01, -0.0045, -0.001])
+    assert history == [[], [('negative', 'BTC', 'firing')], [], [('negative', 'BTC', 'resolved')]]
+
+def test_version_gap_reevaluates_all_symbols():
+    rule = monitor.AlertRule('high', 'var_funding', 0.005, cooldown=0)
+    store = monitor.FundingRateStore()
+    engine = monitor.AlertEngine([rule], {})
+
+    store.update_data(_cycle({'BTC': 0.01, 'ETH': 0.001}))
+    engine.evaluate(store.snapshot, store.update_count)
+    assert _events(engine) == [('high', 'BTC', 'firing')]
+
+    # 错过了中间的版本（如从检查点载入）：变更集不连续，按新快照全量评估，已删除的币种也会恢复
+    store.update_data(_cycle({'ETH': 0.001, 'SOL': 0.001}))
+    store.update_data(_cycle({'ETH': 0.02, 'SOL': 0.001}))
+    assert store.snapshot.base_version != engine._version
+    engine.evaluate(store.snapshot, store.update_count)
+    assert sorted(_events(engine)) == [('high', 'BTC', 'resolved'), ('high', 'ETH', 'firing')]
@@ -0,0 +1,92 @@
+"""/api/changes：多个版本的变更集合并后与直接比较两个快照的结果一致，无效或过旧的 since 返回 reset"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import funding_rate_monitor as monitor
+
+# 每轮 BP 的费率（每小时，%），没有出现的币种表示本轮不存在
+CYCLES = [
+    {'BTC': 0.01, 'ETH': 0.02, 'SOL': 0.03},
+    {'BTC': 0.01, 'ETH': 0.05, 'SOL': 0.03, 'DOGE': 0.04},   # ETH 变化，DOGE 新增
+    {'BTC': 0.01, 'ETH': 0.05, 'DOGE': 0.06},                # SOL 删除，DOGE 变化
+    {'BTC': 0.02, 'ETH': 0.05, 'SOL': 0.07},                 # SOL 重新出现，DOGE 删除（新增后又删除）
+    {'BTC': 0.02, 'ETH': 0.01, 'SOL': 0.07, 'XRP': 0.02},
+]
+
+def _store():
+    """依次写入 CYCLES，返回存储和每个版本的快照 {版本: 快照}"""
+    store = monitor.FundingRateStore()
+    snapshots = {store.version: store.snapshot}
+    for rates in CYCLES:
+        store.update_data({'bpx': {
+            'funding_rates': rates,
+            'funding_intervals': {symbol: 3600 for symbol in rates},
+            'prices': {symbol: 100.0 for symbol in rates},
+            'fetched_at': time.time(),
+        }})
+        snapshots[store.version] = store.snapshot
+    return store, snapshots
+
+def _changes(store, since):
+    return json.loads(store.snapshot.changes_body(since, store.changes))
+
+def test_merged_changes_equal_direct_diff():
+    store, snapshots = _store()
+    current = store.snapshot
+    for since, old in snapshots.items():
+        merged = _changes(store, since)
+        direct = monitor.ChangeSet.compute(current.version, old, current.rows)
+        assert not merged['reset']
+        assert [row['symbol'] for row in merged['added']] == sorted(direct.added)
+        assert merged['removed'] == sorted(direct.removed)
+        # 合并结果包含直接比较得到的所有变化字段（只会多出中途变化后又变回的字段）
+        assert set(merged['changed']) >= set(direct.changed)
+        for symbol, fields in direct.changed.items():
+            assert fields.items() <= merged['changed'][symbol].items()
+
+        # 把合并后的变更应用到 since 版本的行上，得到当前版本的行
+        rows = {symbol: dict(row) for symbol, row in old.by_symbol.items()}
+        for symbol in merged['removed']:
+            del rows[symbol]
+        for row in merged['added']:
+            rows[row['symbol']] = row
+        for symbol, fields in merged['changed'].items():
+            rows[symbol].update(fields)
+        assert rows == json.loads(json.dumps(current.by_symbol))
+
+def test_removed_then_readded_symbol_is_not_reported_as_added():
+    store, snapshots = _store()
+    since = 2  # SOL 存在；版本 3 删除，版本 4 重新出现
+    assert 'SOL' in snapshots[since].by_symbol
+    merged = _changes(store, since)
+    assert 'SOL' not in [row['symbol'] for row in merged['added']]
+    assert 'SOL' not in merged['removed']
+    assert merged['changed']['SOL']['bpx_funding'] == 0.07
+
+    # DOGE 在版本 2 新增、版本 4 删除：从版本 1 看不出现在结果中
+    merged = _changes(store, 1)
+    assert 'DOGE' not in merged['changed']
+    assert 'DOGE' not in merged['removed']
+    assert 'DOGE' not in [row['symbol'] for row in merged['added']]
+
+def test_invalid_or_evicted_since_requires_reset():
+    store, _ = _store()
+    assert _changes(store, store.version) == {
+        'since': store.version, 'version': store.version, 'reset': False,
+        'added': [], 'removed': [], 'changed': {}, 'level_changes': [],
+    }
+    assert _changes(store, -1)['reset']
+    assert _changes(store, store.version + 1)['reset']
+
+    # 最旧的两个变更集超过 CHANGES_RETENTION，在下一个版本时移出缓冲区
+    for changes in list(store.changes)[:2]:
+        changes.created_at -= monitor.CHANGES_RETENTION + 1
+    store.update_prices('bpx', {'BTC': 101.0}, time.time())
+    assert store.changes[0].base_version == 2
+    assert _changes(store, 1)['reset']
+    assert not _changes(store, 2)['reset']
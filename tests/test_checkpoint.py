@@ -0,0 +1,89 @@
+"""快照检查点：保存、重启后载入，以及载入后某个交易所获取失败的情况"""
+
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import funding_rate_monitor as monitor
+
+def _leg(funding_rates, prices, fetched_at):
+    return {
+        'funding_rates': funding_rates,
+        'funding_intervals': {symbol: 3600 for symbol in funding_rates},
+        'prices': prices,
+        'fetched_at': fetched_at,
+    }
+
+def _bpx(fetched_at):
+    return _leg({'BTC': 0.001, 'ETH': 0.002}, {'BTC': 50000.0, 'ETH': 3000.0}, fetched_at)
+
+def _var(fetched_at):
+    # 与 BP 的每小时费率差 0.029 / 0.028，推荐等级为 3
+    return _leg({'BTC': 0.03, 'ETH': 0.03}, {'BTC': 50010.0, 'ETH': 3001.0}, fetched_at)
+
+def _restored_store(monkeypatch, tmp_path, saved_fetched_at):
+    """在一个存储中获取一轮并保存检查点，再用一个新存储载入，返回新存储"""
+    path = str(tmp_path / 'checkpoint.json')
+    saved = monitor.FundingRateStore()
+    monkeypatch.setattr(monitor, 'store', saved)
+    saved.update_data({'bpx': _bpx(saved_fetched_at), 'var': _var(saved_fetched_at)})
+    monitor.SnapshotCheckpoint(path).save_now()
+
+    restored = monitor.FundingRateStore()
+    monkeypatch.setattr(monitor, 'store', restored)
+    assert monitor.SnapshotCheckpoint(path).restore()
+    assert restored.version == saved.version
+    assert [row['symbol'] for row in restored.snapshot.rows] == [row['symbol'] for row in saved.snapshot.rows]
+    return restored
+
+def test_restore_then_primary_leg_fails(monkeypatch, tmp_path):
+    store = _restored_store(monkeypatch, tmp_path, time.time() - 300)
+    store.update_data({'bpx': None, 'var': _var(time.time())})
+
+    # BP 沿用保存时的数据，行不会消失，且标记为过期
+    rows = store.snapshot.by_symbol
+    assert set(rows) == {'BTC', 'ETH'}
+    assert rows['BTC']['bpx_funding'] == 0.001
+    assert all(row['bpx_funding_stale'] for row in rows.values())
+    assert set(store.snapshot.stats['stale_exchanges']) == {'BP'}
+
+    # BP 第一次获取成功后恢复正常
+    store.update_data({'bpx': _bpx(time.time()), 'var': _var(time.time())})
+    assert not any(row['bpx_funding_stale'] for row in store.snapshot.rows)
+    assert store.snapshot.stats['stale_exchanges'] == {}
+
+def test_restore_then_compare_leg_fails(monkeypatch, tmp_path):
+    store = _restored_store(monkeypatch, tmp_path, time.time() - 300)
+    store.update_data({'bpx': _bpx(time.time()), 'var': None})
+
+    # VAR 沿用保存时的费率和价格（不会变成 0 而凭空产生推荐），并标记为过期
+    row = store.snapshot.by_symbol['BTC']
+    assert row['var_funding'] == 0.03
+    assert row['var_price'] == 50010.0
+    assert row['recommendation']['level'] == 3
+    assert set(store.snapshot.stats['stale_exchanges']) == {'VAR'}
+
+def test_old_and_corrupt_checkpoints_are_rejected(monkeypatch, tmp_path):
+    store = monitor.FundingRateStore()
+    monkeypatch.setattr(monitor, 'store', store)
+    path = tmp_path / 'checkpoint.json'
+    checkpoint = monitor.SnapshotCheckpoint(str(path))
+
+    assert not checkpoint.restore()  # 没有文件
+
+    payload = {'summary': [], 'stats': {}}
+    path.write_text(json.dumps({
+        'saved_at': time.time() - monitor.CHECKPOINT_MAX_AGE - 1, 'version': 5, 'data': payload,
+    }))
+    assert not checkpoint.restore()
+
+    path.write_text('{"saved_at": 1, "version": ')
+    assert not checkpoint.restore()
+
+    path.write_text(json.dumps({'saved_at': time.time(), 'data': payload}))  # 缺少字段
+    assert not checkpoint.restore()
+
+    assert store.version == 0
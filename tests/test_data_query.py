@@ -0,0 +1,132 @@
+"""/api/data 查询：min_level 截断、cursor 分页、字段投影和列式格式"""
+
+import json
+import os
+import random
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import funding_rate_monitor as monitor
+
+def _cycle(symbols, seed=1):
+    """一轮数据：费率差分布在各推荐等级之间（含相同的费率差），部分币种没有 VAR 数据"""
+    rng = random.Random(seed)
+    levels = (0.001, 0.004, 0.005, 0.008, 0.01, 0.015, 0.02, 0.03)
+    var_rates = {symbol: rng.choice(levels) * rng.choice((1, -1)) for symbol in symbols[: len(symbols) * 4 // 5]}
+    now = time.time()
+    return {
+        'bpx': {
+            'funding_rates': {symbol: 0.0001 for symbol in symbols},
+            'funding_intervals': {symbol: 3600 for symbol in symbols},
+            'prices': {symbol: 100.0 + i for i, symbol in enumerate(symbols)},
+            'fetched_at': now,
+        },
+        'var': {
+            'funding_rates': var_rates,
+            'funding_intervals': {symbol: 3600 for symbol in var_rates},
+            'prices': {symbol: 100.5 + i for i, symbol in enumerate(var_rates)},
+            'fetched_at': now,
+        },
+    }
+
+SYMBOLS = [f'C{i:02d}' for i in range(60)]
+
+@pytest.fixture
+def store():
+    store = monitor.FundingRateStore()
+    store.update_data(_cycle(SYMBOLS))
+    return store
+
+def _query(snapshot, fmt='json', **params):
+    query = monitor._parse_data_query({name: str(value) for name, value in params.items()})
+    body = snapshot.query_body(query, fmt)
+    return json.loads(body)
+
+def _pages(snapshot, **params):
+    """用 limit + cursor 翻完所有页，返回各页的币种"""
+    pages, cursor = [], None
+    while True:
+        extra = {'cursor': cursor} if cursor else {}
+        payload = _query(snapshot, **params, **extra)
+        pages.append([row['symbol'] for row in payload['summary']])
+        cursor = payload['next_cursor']
+        if cursor is None:
+            return pages, payload['total']
+
+def test_rows_are_sorted_by_absolute_diff(store):
+    diffs = [abs(row['funding_rate_diff']) for row in store.snapshot.rows]
+    assert diffs == sorted(diffs, reverse=True)
+
+@pytest.mark.parametrize('sort', list(monitor.DATA_SORT_KEYS))
+def test_cursor_pagination_visits_every_row_once(store, sort):
+    snapshot = store.snapshot
+    full = [row['symbol'] for row in _query(snapshot, sort=sort)['summary']]
+    pages, total = _pages(snapshot, sort=sort, limit=7)
+    visited = [symbol for page in pages for symbol in page]
+    assert visited == full
+    assert len(set(visited)) == len(visited) == total == len(SYMBOLS)
+    assert all(len(page) == 7 for page in pages[:-1])
+
+    # 带过滤条件时同样不重复、不遗漏
+    pages, total = _pages(snapshot, sort=sort, limit=5, min_level=1, has_var='true')
+    filtered = [row['symbol'] for row in _query(snapshot, sort=sort, min_level=1, has_var='true')['summary']]
+    assert [symbol for page in pages for symbol in page] == filtered
+    assert total == len(filtered)
+
+@pytest.mark.parametrize('sort', ['diff', 'spread'])
+@pytest.mark.parametrize('min_level', [1, 2, 3])
+def test_min_level_matches_plain_filter(store, sort, min_level):
+    snapshot = store.snapshot
+    expected = [
+        row['symbol'] for row in _query(snapshot, sort=sort)['summary']
+        if row['recommendation']['level'] >= min_level
+    ]
+    assert expected  # 每个等级都有币种
+    assert [row['symbol'] for row in _query(snapshot, sort=sort, min_level=min_level)['summary']] == expected
+
+    # min_diff 与 min_level 同时给出时取更严格的一个
+    threshold = 0.015
+    stricter = [
+        row['symbol'] for row in _query(snapshot, sort=sort)['summary']
+        if row['recommendation']['level'] >= min_level and abs(row['funding_rate_diff']) >= threshold
+    ]
+    result = _query(snapshot, sort=sort, min_level=min_level, min_diff=threshold)['summary']
+    assert [row['symbol'] for row in result] == stricter
+
+def test_cursor_is_invalidated_when_its_symbol_leaves_the_result(store):
+    payload = _query(store.snapshot, limit=5)
+    cursor = payload['next_cursor']
+    assert _query(store.snapshot, limit=5, cursor=cursor)['summary']
+
+    store.update_data(_cycle([symbol for symbol in SYMBOLS if symbol != cursor]))
+    with pytest.raises(ValueError, match='cursor'):
+        _query(store.snapshot, limit=5, cursor=cursor)
+
+def test_fields_projection(store):
+    payload = _query(store.snapshot, fields='bpx_price,funding_rate_diff', limit=3)
+    assert [list(row) for row in payload['summary']] == [['symbol', 'bpx_price', 'funding_rate_diff']] * 3
+    full = store.snapshot.by_symbol
+    for row in payload['summary']:
+        assert row['bpx_price'] == full[row['symbol']]['bpx_price']
+
+    with pytest.raises(ValueError, match='未知字段'):
+        _query(store.snapshot, fields='bpx_price,nope')
+
+def test_columnar_format_matches_rows(store):
+    rows = _query(store.snapshot, min_level=1)['summary']
+    payload = _query(store.snapshot, fmt='columnar', min_level=1)
+    columns = payload['summary']
+    assert columns['symbol'] == [row['symbol'] for row in rows]
+    assert columns['funding_rate_diff'] == [row['funding_rate_diff'] for row in rows]
+    assert columns['recommendation_level'] == [row['recommendation']['level'] for row in rows]
+    assert 'recommendation' not in columns
+    assert payload['total'] == len(rows)
+
+    # 投影和分页同样适用于列式格式
+    payload = _query(store.snapshot, fmt='columnar', fields='bpx_price', limit=4)
+    assert set(payload['summary']) == {'symbol', 'bpx_price'}
+    assert len(payload['summary']['symbol']) == 4
@@ -0,0 +1,188 @@
+"""主机请求管控：熔断器状态机、Retry-After，以及 ExchangeHttpClient.get 的重试（通过 mock_exchange.py 注入故障）"""
+
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import funding_rate_monitor as monitor
+from mock_exchange import MockExchange, make_fixtures
+
+OPEN_SECONDS = 0.05
+
+@pytest.fixture(autouse=True)
+def fast_circuit(monkeypatch):
+    """缩短熔断时间和退避等待，让状态转换在测试中很快发生"""
+    monkeypatch.setattr(monitor, 'CIRCUIT_FAILURE_THRESHOLD', 3)
+    monkeypatch.setattr(monitor, 'CIRCUIT_OPEN_SECONDS', OPEN_SECONDS)
+    monkeypatch.setattr(monitor, 'CIRCUIT_OPEN_MAX_SECONDS', OPEN_SECONDS * 4)
+    monkeypatch.setattr(monitor, 'HTTP_BACKOFF_BASE', 0.001)
+
+def _governor():
+    return monitor.HostGovernor('test.invalid', rate=1000, burst=1000)
+
+def _open(governor):
+    for _ in range(monitor.CIRCUIT_FAILURE_THRESHOLD):
+        governor.record_failure()
+
+def test_opens_after_threshold_and_rejects():
+    async def scenario():
+        governor = _governor()
+        for _ in range(monitor.CIRCUIT_FAILURE_THRESHOLD - 1):
+            governor.record_failure()
+        assert governor.state == 'closed'
+        await governor.acquire()
+
+        # 成功清零连续失败次数
+        governor.record_success()
+        _open(governor)
+        assert governor.state == 'open'
+        with pytest.raises(monitor.ExchangeUnavailableError, match='熔断中'):
+            await governor.acquire()
+
+    asyncio.run(scenario())
+
+def test_half_open_allows_a_single_probe():
+    async def scenario():
+        governor = _governor()
+        _open(governor)
+        await asyncio.sleep(OPEN_SECONDS * 1.5)
+
+        await governor.acquire()
+        assert governor.state == 'half_open'
+        with pytest.raises(monitor.ExchangeUnavailableError, match='探测中'):
+            await governor.acquire()
+
+        governor.record_success()
+        assert governor.state == 'closed'
+        await governor.acquire()
+        await governor.acquire()
+
+    asyncio.run(scenario())
+
+def test_failed_probes_double_open_time_up_to_cap():
+    async def scenario():
+        governor = _governor()
+        _open(governor)
+        durations = []
+        for _ in range(4):
+            await asyncio.sleep(governor._open_seconds * 1.2)
+            await governor.acquire()
+            assert governor.state == 'half_open'
+            governor.record_failure()
+            assert governor.state == 'open'
+            durations.append(governor._open_seconds)
+        assert durations == [OPEN_SECONDS * 2, OPEN_SECONDS * 4, OPEN_SECONDS * 4, OPEN_SECONDS * 4]
+
+        # 探测成功后熔断时间恢复初始值
+        await asyncio.sleep(governor._open_seconds * 1.2)
+        await governor.acquire()
+        governor.record_success()
+        assert governor._open_seconds == OPEN_SECONDS
+
+    asyncio.run(scenario())
+
+def test_retry_after_blocks_the_host():
+    async def scenario():
+        governor = _governor()
+        governor.record_failure(retry_after=monitor.HTTP_MAX_QUEUE_WAIT + 10)
+        assert governor.state == 'closed'
+        with pytest.raises(monitor.ExchangeUnavailableError, match='需等待'):
+            await governor.acquire()
+
+        # 不超过 HTTP_MAX_QUEUE_WAIT 的 Retry-After 排队等待而不是放弃
+        governor = _governor()
+        governor.record_failure(retry_after=0.1)
+        start = time.monotonic()
+        await governor.acquire()
+        assert time.monotonic() - start >= 0.09
+
+    asyncio.run(scenario())
+
+def test_cancelled_probe_releases_the_slot():
+    async def scenario():
+        mock = MockExchange(make_fixtures(3), latency_ms=500)  # 探测请求在响应前被取消
+        runner, port = await mock.start()
+        client = monitor.ExchangeHttpClient()
+        await client.start()
+        try:
+            url = f'http://127.0.0.1:{port}/api/v1/markets'
+            governor = client.governor('127.0.0.1')
+            _open(governor)
+            await asyncio.sleep(OPEN_SECONDS * 1.5)
+
+            async def probe():
+                async with client.get(url):
+                    pass
+
+            # 探测请求挂起时被取消，探测名额必须释放，否则主机会永远停在半开状态
+            task = asyncio.create_task(probe())
+            await asyncio.sleep(0.05)
+            assert governor.state == 'half_open'
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await governor.acquire()
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+def test_get_retries_server_errors_then_opens_circuit():
+    async def scenario():
+        mock = MockExchange(make_fixtures(3), error_rate=1.0)
+        runner, port = await mock.start()
+        client = monitor.ExchangeHttpClient()
+        await client.start()
+        try:
+            url = f'http://127.0.0.1:{port}/api/v1/markets'
+            async with client.get(url) as response:
+                assert response.status == 500
+            attempts = monitor.HTTP_MAX_RETRIES + 1
+            assert mock.request_counts['/api/v1/markets'] == attempts
+            assert client.governor('127.0.0.1').state == 'open'  # 3 次连续失败达到阈值
+
+            # 熔断期间请求不再发出
+            with pytest.raises(monitor.ExchangeUnavailableError):
+                async with client.get(url):
+                    pass
+            assert mock.request_counts['/api/v1/markets'] == attempts
+
+            # 到期后探测成功，熔断关闭
+            mock.error_rate = 0.0
+            await asyncio.sleep(OPEN_SECONDS * 1.5)
+            async with client.get(url) as response:
+                assert response.status == 200
+                assert await response.json()
+            assert client.governor('127.0.0.1').state == 'closed'
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+def test_get_honours_long_retry_after_without_retrying():
+    async def scenario():
+        mock = MockExchange(make_fixtures(3), throttle_rate=1.0, retry_after=monitor.HTTP_MAX_QUEUE_WAIT + 10)
+        runner, port = await mock.start()
+        client = monitor.ExchangeHttpClient()
+        await client.start()
+        try:
+            url = f'http://127.0.0.1:{port}/api/v1/tickers'
+            async with client.get(url) as response:
+                assert response.status == 429
+            assert mock.request_counts['/api/v1/tickers'] == 1
+
+            with pytest.raises(monitor.ExchangeUnavailableError, match='需等待'):
+                async with client.get(url):
+                    pass
+            assert mock.request_counts['/api/v1/tickers'] == 1
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
@@ -0,0 +1,92 @@
+"""Backpack 行情推送与增量变更缓冲区（通过 mock_exchange.py 的本地模拟服务器）"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import funding_rate_monitor as monitor
+from mock_exchange import MockExchange, make_fixtures
+
+def _seeded_store(fixtures):
+    """用模拟数据的 BP 费率和价格初始化一个新的存储"""
+    store = monitor.FundingRateStore()
+    prices = {
+        monitor._bpx_base(ticker['symbol']): float(ticker['lastPrice'])
+        for ticker in fixtures['bpx_tickers'] if ticker['symbol'].endswith(monitor.BPX_PERP_SUFFIX)
+    }
+    store.update_data({'bpx': {
+        'funding_rates': {base: 0.01 for base in prices},
+        'funding_intervals': {base: 1 for base in prices},
+        'prices': prices,
+        'fetched_at': time.time(),
+    }})
+    return store
+
+async def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, '等待超时'
+        await asyncio.sleep(0.02)
+
+def test_stream_coalesces_prices_and_reconnects(monkeypatch):
+    fixtures = make_fixtures(5)
+    store = _seeded_store(fixtures)
+    monkeypatch.setattr(monitor, 'store', store)
+    monkeypatch.setattr(monitor, 'BPX_WS_COALESCE_INTERVAL', 0.05)
+    perps = [market['symbol'] for market in fixtures['bpx_markets'] if market['marketType'] == 'PERP']
+
+    async def scenario():
+        mock = MockExchange(fixtures, ws_tick_ms=5)
+        runner, port = await mock.start()
+        client = monitor.ExchangeHttpClient()
+        await client.start()
+        stream = monitor.BackpackPriceStream(client, url=f'ws://127.0.0.1:{port}/ws')
+        task = asyncio.create_task(stream.run())
+        try:
+            await stream.set_symbols(perps)
+            start_version = store.version
+            await _wait_for(lambda: stream.healthy and store.version >= start_version + 3)
+
+            # 推送的价格合并写入存储，每次合并一个版本，变更集只含变化的价格
+            row = store.snapshot.by_symbol
+            assert any(base in row and row[base]['bpx_price'] == price for base, price in stream.prices.items())
+            assert all(set(fields) <= {'bpx_price', 'price_spread', 'depth'}
+                       for changes in list(store.changes)[-3:] for fields in changes.changed.values())
+
+            # 断线后自动重连并继续更新
+            await mock.drop_websockets()
+            await _wait_for(lambda: not stream.connected)
+            reconnect_version = store.version
+            await _wait_for(lambda: stream.healthy and store.version > reconnect_version)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+def test_changes_retained_by_age_not_count():
+    fixtures = make_fixtures(5)
+    store = _seeded_store(fixtures)
+    base = store.symbols[0]
+    first_version = store.version
+    price = store.table('bpx').get(base, 'price')
+    for i in range(500):
+        store.update_prices('bpx', {base: price * (1 + 0.01 * (i + 1))}, time.time())
+
+    # 推送行情每 0.5s 一个版本也不会很快挤出缓冲区：时间窗口内的版本都能增量获取
+    assert len(store.changes) == 501
+    body = store.snapshot.changes_body(first_version, store.changes)
+    assert b'"reset": false' in body
+
+    # 超过 CHANGES_RETENTION 的变更集在下一个版本时移除，过旧的 since 需要重新拉取
+    for changes in list(store.changes)[:400]:
+        changes.created_at -= monitor.CHANGES_RETENTION + 1
+    store.update_prices('bpx', {base: price}, time.time())
+    assert len(store.changes) == 102
+    assert b'"reset": true' in store.snapshot.changes_body(first_version, store.changes)
+    assert b'"reset": false' in store.snapshot.changes_body(store.version - 50, store.changes)